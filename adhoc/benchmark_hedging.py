@@ -0,0 +1,63 @@
+"""
+Benchmark of the hedged forecast fetching (`fetch_forecast`) against querying one provider, with the
+provider stand-ins answering after heavy-tailed (log-normal) latencies.
+
+Usage: python adhoc/benchmark_hedging.py --requests 300 --median-ms 150 --sigma 0.8
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+# Allow `python adhoc/benchmark_hedging.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("OPENWEATHERMAP_API_KEY", "benchmark")
+
+from local_firestore import LocalFirestore
+import local_firestore
+import local_services
+from packages.gcp_phone_weather.src import providers, weather
+
+
+def lognormal(median_s, sigma):
+    return lambda: median_s * random.lognormvariate(0, sigma)
+
+
+def run(fetch, num_requests):
+    latencies = []
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        fetch(51.5, -0.12)
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--median-ms", type=float, default=150, help="Median latency of every provider.")
+    parser.add_argument("--sigma", type=float, default=0.8, help="Log-normal spread of the latencies.")
+    args = parser.parse_args()
+
+    latency = lognormal(args.median_ms / 1000, args.sigma)
+    services = local_services.LocalServices({"openweathermap": latency, "open-meteo": latency})
+    local_services.install(services, weather, providers)
+    local_firestore.install(LocalFirestore(), providers)
+    fetches = {
+        "openweathermap only": lambda lat, lon: providers.fetch_provider("openweathermap", lat, lon),
+        "open-meteo only": lambda lat, lon: providers.fetch_provider("open-meteo", lat, lon),
+        "hedged": providers.fetch_forecast,
+    }
+
+    print(f"{args.requests} requests, median {args.median_ms:g} ms, sigma {args.sigma:g}")
+    print(f"{'mode':<22}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, fetch in fetches.items():
+        latencies = run(fetch, args.requests)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"{name:<22}{p50:>9.0f}{p90:>9.0f}{p99:>9.0f}{latencies.max():>9.0f}")
+    print(f"Provider calls: {services.counts}")
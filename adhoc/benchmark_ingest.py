@@ -0,0 +1,86 @@
+"""
+Benchmark of the push-based ingestion (`POST /locations`) against storing the fixes one by one
+(what the 2-minute poll does), both writing to the in-memory Firestore stand-in.
+
+Usage: python adhoc/benchmark_ingest.py --fixes 2000 --latency-ms 20
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# Allow `python adhoc/benchmark_ingest.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["INGEST_TOKEN"] = "benchmark"
+os.environ["WEATHER_PREFETCH"] = "false"
+
+from local_firestore import LocalFirestore, install
+from packages.gcp_phone_location.src import aggregates, location
+
+import main
+
+
+def make_fixes(num_fixes, start=None):
+    """
+    Make a track of fixes one minute apart, in the FollowMee schema.
+    """
+    start = start or datetime(2024, 6, 1, 8, tzinfo=timezone(timedelta(hours=1)))
+    return [
+        {
+            "Date": (start + timedelta(minutes=i)).isoformat(),
+            "Latitude": 51.5 + i * 1e-5,
+            "Longitude": -0.12 + i * 1e-5,
+            "Accuracy": 10,
+            "Type": "GPS",
+        }
+        for i in range(num_fixes)
+    ]
+
+
+def benchmark_push(fixes, batch_size, latency_s):
+    client = LocalFirestore(latency_s)
+    install(client, location, aggregates)
+    app = main.app.test_client()
+    headers = {"Authorization": "Bearer benchmark"}
+    start = time.perf_counter()
+    for i in range(0, len(fixes), batch_size):
+        payload = {"device_id": "benchmark", "locations": fixes[i : i + batch_size]}
+        response = app.post("/locations", json=payload, headers=headers)
+        assert response.status_code == 200, response.get_json()
+    elapsed = time.perf_counter() - start
+    return elapsed, client.counts
+
+
+def benchmark_one_by_one(fixes, latency_s):
+    client = LocalFirestore(latency_s)
+    install(client, location, aggregates)
+    start = time.perf_counter()
+    for fix in fixes:
+        location.store_location({"benchmark": dict(fix, DeviceID="benchmark")})
+    elapsed = time.perf_counter() - start
+    return elapsed, client.counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixes", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Per round trip.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+    latency_s = args.latency_ms / 1000
+    fixes = make_fixes(args.fixes)
+
+    print(f"{args.fixes} fixes, {args.latency_ms:g} ms per round trip")
+    print(f"{'mode':<22}{'fixes/s':>10}{'reads':>8}{'writes':>8}{'commits':>9}")
+    results = [("one by one", benchmark_one_by_one(fixes, latency_s))]
+    for batch_size in args.batch_sizes:
+        results.append((f"push, {batch_size}/request", benchmark_push(fixes, batch_size, latency_s)))
+    for name, (elapsed, counts) in results:
+        print(
+            f"{name:<22}{len(fixes) / elapsed:>10.0f}{counts['reads']:>8}"
+            f"{counts['writes']:>8}{counts['commits']:>9}"
+        )
@@ -0,0 +1,119 @@
+"""
+Benchmark of the compact LLM prompt (`encode_weather_compact`) against the full prompt (`print_weather`)
+on forecasts covering every advice topic (rain, snow, cold, heat, sun, wind).
+The estimated prompt tokens are always reported. With `OPENAI_API_KEY` set (and without `--offline`),
+both prompts are also sent to the model to compare their latency and the topics of their advice.
+
+Usage: python adhoc/benchmark_prompt.py --repeats 3 --max-tokens 250
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+# Allow `python adhoc/benchmark_prompt.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packages.gcp_phone_weather.src.advice import get_rule_advice, compare_advice
+from packages.gcp_phone_weather.src.openai import get_llm_prompt, query_openai_prompt
+from packages.gcp_phone_weather.src.prompt import estimate_tokens
+
+METADATA = {
+    "name": "London",
+    "country": "GB",
+    "timezone": 1.0,
+    "sunrise": "2024-05-28T04:52:00",
+    "sunset": "2024-05-28T20:58:00",
+}
+MILD = {
+    "weather": "few clouds",
+    "temp": 15.0,
+    "temp_feels_like": 14.0,
+    "pressure": 1012,
+    "humidity": 70,
+    "wind_speed": 11.0,
+    "wind_gust": 18.0,
+    "wind_direction": 200,
+    "rain": 0.0,
+    "snow": 0.0,
+    "prob_precip": 0.1,
+    "cloudiness": 40,
+}
+# Changes to the mild forecast, for every step or from a step onwards
+SCENARIOS = {
+    "mild": {},
+    "rain": {3: {"weather": "moderate rain", "rain": 2.1, "prob_precip": 0.9, "cloudiness": 100}},
+    "cold": {0: {"temp": 1.0, "temp_feels_like": -3.0}, 3: {"temp": 4.0, "temp_feels_like": 1.0}},
+    "snow": {0: {"weather": "light snow", "temp": -1.0, "temp_feels_like": -5.0, "snow": 1.2}},
+    "hot": {0: {"weather": "clear sky", "temp": 27.0, "temp_feels_like": 29.0, "cloudiness": 0}},
+    "windy": {0: {"temp": 10.0, "temp_feels_like": 5.0, "wind_speed": 38.0, "wind_gust": 65.0}},
+    "layers": {0: {"temp": 6.0, "temp_feels_like": 4.0}, 3: {"weather": "clear sky", "temp": 18.0, "cloudiness": 5}},
+}
+
+
+def make_forecast(changes, num_steps=6):
+    """
+    Make a forecast of 3-hour steps from 6 AM, in the schema of `parse_weather_forecast`.
+    """
+    start = datetime.now().replace(hour=6, minute=0, second=0, microsecond=0)
+    steps = []
+    step = dict(MILD)
+    for i in range(num_steps):
+        step = {**step, **changes.get(i, {})}
+        steps.append({"timestamp": start + timedelta(hours=3 * i), **step})
+    return pd.DataFrame(steps)
+
+
+def timed_advice(prompt):
+    start = time.perf_counter()
+    advice = query_openai_prompt(prompt)
+    return advice, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=3, help="LLM queries per scenario and prompt.")
+    parser.add_argument("--max-tokens", type=int, default=250, help="Token budget of the compact forecast.")
+    parser.add_argument("--offline", action="store_true", help="Only compare the prompt sizes.")
+    args = parser.parse_args()
+    online = not args.offline and bool(os.getenv("OPENAI_API_KEY"))
+
+    print(f"{'scenario':<10}{'full tok':>10}{'compact tok':>13}{'saved':>8}", end="")
+    print(f"{'full s':>9}{'compact s':>11}{'agreement':>11}" if online else "")
+    totals = {"full": [], "compact": [], "agreement": []}
+    for name, changes in SCENARIOS.items():
+        weather_df = make_forecast(changes)
+        prompts = {
+            encoding: get_llm_prompt(weather_df, METADATA, encoding, args.max_tokens)
+            for encoding in ["full", "compact"]
+        }
+        tokens = {encoding: estimate_tokens(prompt) for encoding, prompt in prompts.items()}
+        saved = 1 - tokens["compact"] / tokens["full"]
+        line = f"{name:<10}{tokens['full']:>10}{tokens['compact']:>13}{saved:>8.0%}"
+        if online:
+            latencies = {"full": [], "compact": []}
+            for _ in range(args.repeats):
+                advice = {}
+                for encoding, prompt in prompts.items():
+                    advice[encoding], latency = timed_advice(prompt)
+                    latencies[encoding].append(latency)
+                comparison = compare_advice(advice["full"], advice["compact"])
+                totals["agreement"].append(comparison["similarity"])
+            for encoding in latencies:
+                totals[encoding] += latencies[encoding]
+            agreement = np.mean(totals["agreement"][-args.repeats :])
+            line += f"{np.median(latencies['full']):>9.2f}{np.median(latencies['compact']):>11.2f}{agreement:>11.0%}"
+            line += f"  (rules: {get_rule_advice(weather_df).replace(chr(10), ' ')})"
+        print(line)
+
+    if online:
+        print(
+            f"Median latency: full {np.median(totals['full']):.2f}s, compact {np.median(totals['compact']):.2f}s. "
+            f"Mean topic agreement of the advice: {np.mean(totals['agreement']):.0%}."
+        )
+    else:
+        print("Set OPENAI_API_KEY (and drop --offline) to compare the latency and the advice of both prompts.")
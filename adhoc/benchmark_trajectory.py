@@ -0,0 +1,84 @@
+"""
+Benchmark of the binary trajectory codec (`packages/gcp_phone_location/src/trajectory.py`) against the CSV export:
+size per point, encoding and decoding time, and reading one day (random access through the chunk index).
+
+Usage: python adhoc/benchmark_trajectory.py --path output/location_export_{device_id}.csv
+       python adhoc/benchmark_trajectory.py --points 500000
+"""
+
+import io
+import os
+import sys
+import gzip
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+
+# Allow `python adhoc/benchmark_trajectory.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packages.gcp_phone_location.src.trajectory import (
+    format_dates,
+    read_trajectory,
+    write_trajectory,
+)
+
+
+def make_track(num_points, seed=0):
+    """
+    Make a synthetic export: one fix every 2 minutes, walking around London, with summer and winter time.
+    """
+    rng = np.random.default_rng(seed)
+    epochs = 1_700_000_000 + np.cumsum(rng.integers(90, 150, num_points))
+    moving = (epochs // 3600) % 24 < 2
+    steps = np.where(moving, 3e-3, 3e-5)
+    latitudes = 51.5 + np.cumsum(rng.normal(0, 1, num_points) * steps)
+    longitudes = -0.12 + np.cumsum(rng.normal(0, 1, num_points) * steps)
+    offsets = np.where((epochs // 86400) % 365 < 210, 60, 0)
+    return pd.DataFrame(
+        {
+            "Date": format_dates(epochs, offsets),
+            "Epoch": epochs,
+            "Latitude": latitudes.round(7),
+            "Longitude": longitudes.round(7),
+        }
+    )
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    output = function(*args, **kwargs)
+    return output, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", help="A CSV export to encode (a synthetic track by default).")
+    parser.add_argument("--points", type=int, default=500_000, help="Points of the synthetic track.")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.path) if args.path else make_track(args.points)
+    num_points = len(df)
+    csv_data = df.to_csv(index=False).encode()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "export.traj")
+        _, encode_s = timed(write_trajectory, df, path)
+        traj_size = os.path.getsize(path)
+        decoded, decode_s = timed(read_trajectory, path)
+        _, decode_no_dates_s = timed(read_trajectory, path, with_dates=False)
+        day_start = int(decoded["Epoch"].iloc[num_points // 2])
+        day, day_s = timed(read_trajectory, path, day_start, day_start + 86400)
+    _, csv_parse_s = timed(pd.read_csv, io.BytesIO(csv_data))
+    csv_gz_size = len(gzip.compress(csv_data))
+
+    error_m = np.abs(decoded["Latitude"].to_numpy() - df["Latitude"].to_numpy()).max() * 111_000
+    print(f"{num_points} points")
+    print(f"{'format':<10}{'bytes/point':>13}{'ratio':>8}")
+    for name, size in [("csv", len(csv_data)), ("csv.gz", csv_gz_size), ("traj", traj_size)]:
+        print(f"{name:<10}{size / num_points:>13.2f}{len(csv_data) / size:>7.1f}x")
+    print(f"Encode: {encode_s * 1000:.0f} ms. Decode: {decode_s * 1000:.0f} ms "
+          f"({decode_no_dates_s * 1000:.0f} ms without the dates), CSV parse: {csv_parse_s * 1000:.0f} ms.")
+    print(f"One day ({len(day)} points) through the index: {day_s * 1000:.1f} ms.")
+    print(f"Max coordinate error: {error_m:.3f} m.")
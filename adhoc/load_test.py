@@ -0,0 +1,307 @@
+"""
+Load test: replay an exported location history through the real ingestion path (`store_location`, or the
+scheduled FollowMee poll) and the daily weather path (`packages/gcp_phone_weather/main.py::main`), on an
+accelerated clock and for a synthetic fleet of devices. Firestore, FollowMee, the weather providers,
+OpenAI and Pushover are replaced by in-memory stand-ins with configurable latencies (`local_firestore.py` and
+`local_services.py`).
+
+The fleet is made of copies of the history, each shifted in space and time, and the history is moved by
+whole days so that it starts within the last day (the services compare times with the real clock).
+If the simulation falls behind its clock, the lag grows: that is the speed at which the system breaks.
+
+Usage: python adhoc/load_test.py --devices 200 --days 1 --speed 1440 --workers 32
+"""
+
+import io
+import os
+import sys
+import time
+import heapq
+import random
+import argparse
+import threading
+import contextlib
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# Allow `python adhoc/load_test.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("FOLLOWMEE_API_KEY", "replay")
+os.environ.setdefault("FOLLOWMEE_USERNAME", "replay")
+os.environ.setdefault("OPENWEATHERMAP_API_KEY", "replay")
+os.environ.setdefault("OPENAI_API_KEY", "replay")
+os.environ.setdefault("PUSHOVER_WEATHER_API_TOKEN", "replay")
+os.environ.setdefault("PUSHOVER_USER_KEY", "replay")
+
+import local_firestore
+import local_services
+from packages.gcp_phone_location import main as location_main
+from packages.gcp_phone_location.src import aggregates, location
+from packages.gcp_phone_location.src.export import get_export_path
+from packages.gcp_phone_weather import main as weather_main
+from packages.gcp_phone_weather import schedule as weather_schedule
+from packages.gcp_phone_weather.src import notify, openai, prefetch, providers, utils, weather
+
+SECONDS_PER_DAY = 24 * 60 * 60
+POLL_INTERVAL_S = 120
+WEATHER_HOUR = 6
+
+
+class SimulatedClock:
+    """
+    Clock which runs `speed` times faster than the wall clock from `start_epoch`.
+    """
+
+    def __init__(self, start_epoch, speed):
+        self.start_epoch = start_epoch
+        self.speed = speed
+        self.start_wall = time.perf_counter()
+
+    def now(self):
+        return self.start_epoch + (time.perf_counter() - self.start_wall) * self.speed
+
+    def to_wall(self, epoch):
+        return self.start_wall + (epoch - self.start_epoch) / self.speed
+
+    def sleep_until(self, epoch):
+        delay = self.to_wall(epoch) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Recorder:
+    """
+    Thread-safe record of the latency, lag behind the clock and errors of every operation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.lags = {}
+        self.errors = {}
+
+    def record(self, kind, latency, lag, error=None):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(latency)
+            self.lags.setdefault(kind, []).append(lag)
+            if error is not None:
+                self.errors.setdefault(kind, []).append(error)
+
+
+def load_track(device_id=None, days=1):
+    """
+    Load the exported history of a device (see `export_locations`), or make a synthetic one if there is none:
+    a fix every 2 minutes, at home at night and moving around during the day.
+
+    Args:
+    - device_id (str): The device ID of the export. Defaults to the env variable `FOLLOWMEE_DEVICE_ID`.
+    - days (int): The number of days to replay (the last ones of the export).
+
+    Returns:
+    - pd.DataFrame: The fixes with `Date`, `Epoch`, `Latitude` and `Longitude`, sorted by time.
+    """
+    device_id = device_id or os.getenv("FOLLOWMEE_DEVICE_ID")
+    if device_id and os.path.exists(get_export_path(device_id)):
+        df = pd.read_csv(get_export_path(device_id))
+        if "Epoch" not in df.columns:
+            df["Epoch"] = df["Date"].apply(location.convert_time_to_epoch)
+        df = df.sort_values("Epoch").reset_index(drop=True)
+        return df[df["Epoch"] > df["Epoch"].max() - days * SECONDS_PER_DAY]
+    start = datetime(2024, 6, 1, tzinfo=timezone(timedelta(hours=1)))
+    rows = []
+    for i in range(days * SECONDS_PER_DAY // POLL_INTERVAL_S):
+        time_ = start + timedelta(seconds=i * POLL_INTERVAL_S)
+        hour = time_.hour + time_.minute / 60
+        away = max(0.0, np.sin((hour - 8) / 12 * np.pi))
+        rows.append(
+            {
+                "Date": time_.isoformat(),
+                "Epoch": int(time_.timestamp()),
+                "Latitude": 51.5 + 0.05 * away * np.sin(i / 50),
+                "Longitude": -0.12 + 0.05 * away * np.cos(i / 50),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def make_fleet(track, num_devices, spread_deg=0.5, jitter_s=600, seed=0):
+    """
+    Make the tracks of a synthetic fleet from one history. Every device is shifted in space (up to
+    `spread_deg`) and in time (up to `jitter_s`), and the history is moved by whole days so that it
+    starts within the last day.
+
+    Args:
+    - track (pd.DataFrame): The history (see `load_track`).
+    - num_devices (int): The number of devices.
+    - spread_deg (float): The maximum shift of the devices in degrees.
+    - jitter_s (int): The maximum shift of the devices in seconds.
+    - seed (int): The seed of the shifts.
+
+    Returns:
+    - dict: The fixes of every device in the FollowMee schema, keyed by device ID.
+    """
+    rng = random.Random(seed)
+    shift_days = (time.time() - track["Epoch"].min()) // SECONDS_PER_DAY
+    dates = [datetime.fromisoformat(date) for date in track["Date"]]
+    tracks = {}
+    for k in range(num_devices):
+        device_id = f"replay-{k:04d}"
+        dlat, dlon = rng.uniform(-spread_deg, spread_deg), rng.uniform(-spread_deg, spread_deg)
+        shift = timedelta(days=shift_days, seconds=rng.randint(0, jitter_s))
+        tracks[device_id] = [
+            {
+                "Date": (date + shift).isoformat(),
+                "Epoch": int(epoch + shift.total_seconds()),
+                "Latitude": float(latitude + dlat),
+                "Longitude": float(longitude + dlon),
+                "Accuracy": 10,
+                "Type": "GPS",
+                "DeviceID": device_id,
+                "DeviceName": device_id,
+            }
+            for date, epoch, latitude, longitude in zip(
+                dates, track["Epoch"], track["Latitude"], track["Longitude"]
+            )
+        ]
+    return tracks
+
+
+def make_events(tracks, path="store"):
+    """
+    Make the events of the replay: the fixes (or the scheduled polls) and a weather run per device
+    at 6:00 AM local time every day.
+
+    Args:
+    - tracks (dict): The fixes of every device (see `make_fleet`).
+    - path (str): "store" to store every fix with `store_location` as it is recorded, or "poll" to run
+      the scheduled location service (FollowMee poll) every 2 minutes.
+
+    Returns:
+    - list: The events as a heap of (epoch, sequence, kind, device ID, payload).
+    """
+    events = []
+    first = min(locations[0]["Epoch"] for locations in tracks.values())
+    last = max(locations[-1]["Epoch"] for locations in tracks.values())
+    for device_id, locations in tracks.items():
+        if path == "store":
+            for fix in locations:
+                events.append((fix["Epoch"], "store", device_id, fix))
+        offset = datetime.fromisoformat(locations[0]["Date"]).utcoffset().total_seconds()
+        local_day = (locations[0]["Epoch"] + offset) // SECONDS_PER_DAY * SECONDS_PER_DAY
+        weather_epoch = local_day + WEATHER_HOUR * 3600 - offset
+        while weather_epoch <= last:
+            if weather_epoch > locations[0]["Epoch"]:
+                events.append((weather_epoch, "weather", device_id, None))
+            weather_epoch += SECONDS_PER_DAY
+    if path == "poll":
+        for epoch in range(first + POLL_INTERVAL_S, last + POLL_INTERVAL_S, POLL_INTERVAL_S):
+            events.append((epoch, "poll", None, None))
+    events = [(epoch, i, kind, device, payload) for i, (epoch, kind, device, payload) in enumerate(events)]
+    heapq.heapify(events)
+    return events
+
+
+def run_event(kind, device_id, payload):
+    if kind == "store":
+        location.store_location({device_id: dict(payload)})
+    elif kind == "poll":
+        location_main.main(sync=True)
+    elif kind == "weather":
+        weather_main.main(device_id)
+
+
+def replay(events, clock, recorder, max_workers):
+    """
+    Run the events when the clock reaches them. The events of a device (and the polls) run in order,
+    the rest concurrently.
+    """
+    previous = {}
+
+    def run(epoch, kind, device_id, payload, before):
+        if before is not None:
+            before.result()
+        start = time.perf_counter()
+        lag = start - clock.to_wall(epoch)
+        error = None
+        try:
+            run_event(kind, device_id, payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        recorder.record(kind, time.perf_counter() - start, lag, error)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while events:
+            epoch, _, kind, device_id, payload = heapq.heappop(events)
+            clock.sleep_until(epoch)
+            key = device_id or kind
+            before = previous.get(key)
+            previous[key] = executor.submit(run, epoch, kind, device_id, payload, before)
+
+
+def print_report(recorder, elapsed, span, firestore, services):
+    print(f"\nReplayed {span / 3600:.1f} simulated hours in {elapsed:.1f}s ({span / elapsed:.0f}x)")
+    header = f"{'operation':<10}{'count':>8}{'errors':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max lag s':>11}"
+    print(header)
+    for kind, latencies in recorder.latencies.items():
+        latencies = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        errors = len(recorder.errors.get(kind, []))
+        print(
+            f"{kind:<10}{len(latencies):>8}{errors:>8}{len(latencies) / elapsed:>9.1f}"
+            f"{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{max(recorder.lags[kind]):>11.2f}"
+        )
+    print(f"Firestore: {firestore.counts}")
+    print(f"Services: {services.counts}")
+    for kind, errors in recorder.errors.items():
+        print(f"First {kind} error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device-id", help="The device of the export to replay (default: synthetic history).")
+    parser.add_argument("--devices", type=int, default=10, help="The size of the synthetic fleet.")
+    parser.add_argument("--days", type=int, default=1, help="The number of days to replay.")
+    parser.add_argument("--speed", type=float, default=1440, help="Simulated seconds per wall second.")
+    parser.add_argument("--path", choices=["store", "poll"], default="store")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--spread-deg", type=float, default=0.5)
+    parser.add_argument("--firestore-ms", type=float, default=10)
+    for service, latency_s in local_services.DEFAULT_LATENCIES_S.items():
+        parser.add_argument(f"--{service}-ms", type=float, default=latency_s * 1000)
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the services.")
+    args = parser.parse_args()
+
+    track = load_track(args.device_id, args.days)
+    tracks = make_fleet(track, args.devices, args.spread_deg)
+    events = make_events(tracks, args.path)
+    start_epoch = events[0][0]
+    span = max(event[0] for event in events) - start_epoch
+    clock = SimulatedClock(start_epoch, args.speed)
+    latencies_s = {
+        service: getattr(args, f"{service.replace('-', '_')}_ms") / 1000
+        for service in local_services.DEFAULT_LATENCIES_S
+    }
+    firestore = local_firestore.LocalFirestore(args.firestore_ms / 1000)
+    services = local_services.LocalServices(latencies_s, tracks, now=clock.now)
+    local_firestore.install(
+        firestore, location, aggregates, prefetch, providers, utils, notify, weather_schedule
+    )
+    local_services.install(
+        services, location, weather, providers, openai, notify, utils, weather_schedule
+    )
+
+    print(
+        f"Replaying {sum(map(len, tracks.values()))} fixes of {len(tracks)} devices "
+        f"({len(events)} events, path '{args.path}') at {args.speed:g}x"
+    )
+    recorder = Recorder()
+    logs = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(logs):
+        replay(events, clock, recorder, args.workers)
+    elapsed = time.perf_counter() - clock.start_wall
+    print_report(recorder, elapsed, span, firestore, services)
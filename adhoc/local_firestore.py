@@ -0,0 +1,299 @@
+"""
+In-memory stand-in for the Firestore client, for benchmarks and local runs without GCP.
+It implements the subset used by the services (documents, batches, transactions, simple queries)
+and counts the operations. `latency_s` adds a fixed delay per round trip to mimic the network.
+"""
+
+import copy
+import time
+import threading
+
+
+class LocalSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = reference.update_time
+        self._data = copy.deepcopy(data)
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class LocalDocument:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.split("/")[-1]
+
+    @property
+    def update_time(self):
+        return self.client.update_times.get(self.path)
+
+    def get(self, transaction=None):
+        self.client.round_trip()
+        self.client.count("reads")
+        with self.client.lock:
+            snapshot = LocalSnapshot(self, self.client.documents.get(self.path))
+        if transaction is not None:
+            transaction.reads.setdefault(self.path, snapshot.update_time)
+        return snapshot
+
+    def set(self, data):
+        self.client.commit_writes([("set", self.path, data)])
+
+    def update(self, data):
+        self.client.commit_writes([("update", self.path, data)])
+
+    def delete(self, option=None):
+        # A `write_option` precondition fails like a contended transaction
+        reads = {self.path: option["last_update_time"]} if option else None
+        self.client.commit_writes([("delete", self.path, None)], reads)
+
+
+class LocalCollection:
+    def __init__(self, client, path, filters=(), order=None, limit_count=None):
+        self.client = client
+        self.path = path
+        self.filters = list(filters)
+        self.order = order
+        self.limit_count = limit_count
+
+    def document(self, document_id):
+        return self.client.document(f"{self.path}/{document_id}")
+
+    def where(self, field, op, value):
+        filters = self.filters + [(field, op, value)]
+        return LocalCollection(self.client, self.path, filters, self.order, self.limit_count)
+
+    def order_by(self, field, direction="ASCENDING"):
+        order = (field, direction == "DESCENDING")
+        return LocalCollection(self.client, self.path, self.filters, order, self.limit_count)
+
+    def limit(self, count):
+        return LocalCollection(self.client, self.path, self.filters, self.order, count)
+
+    def stream(self):
+        self.client.round_trip()
+        operators = {
+            "==": lambda a, b: a == b,
+            "<": lambda a, b: a < b,
+            "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b,
+            ">=": lambda a, b: a >= b,
+        }
+        prefix = f"{self.path}/"
+        with self.client.lock:
+            items = [
+                (path, data)
+                for path, data in self.client.documents.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            ]
+        items = [
+            (path, data)
+            for path, data in items
+            if all(
+                field in data and operators[op](data[field], value)
+                for field, op, value in self.filters
+            )
+        ]
+        if self.order is not None:
+            field, descending = self.order
+            items.sort(key=lambda item: item[1][field], reverse=descending)
+        if self.limit_count is not None:
+            items = items[: self.limit_count]
+        self.client.count("reads", max(1, len(items)))
+        return [LocalSnapshot(self.client.document(path), data) for path, data in items]
+
+    def get(self):
+        return self.stream()
+
+
+class LocalBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference, data):
+        self.writes.append(("set", reference.path, data))
+
+    def update(self, reference, data):
+        self.writes.append(("update", reference.path, data))
+
+    def delete(self, reference):
+        self.writes.append(("delete", reference.path, None))
+
+    def commit(self):
+        self.client.commit_writes(self.writes)
+        self.writes = []
+
+
+class LocalContention(Exception):
+    pass
+
+
+class LocalTransaction(LocalBatch):
+    def __init__(self, client):
+        super().__init__(client)
+        self.reads = {}
+
+    def commit(self):
+        self.client.commit_writes(self.writes, self.reads)
+        self.writes = []
+
+
+class LocalHandle:
+    """
+    Stand-in for `gcp_pal.Firestore(path)`: `read` unwraps `{"data": ...}` documents like gcp_pal's.
+    """
+
+    def __init__(self, client, path=None):
+        self.client = client
+        self.path = path
+
+    def is_document(self):
+        return len(self.path.split("/")) % 2 == 0
+
+    def get(self):
+        if self.is_document():
+            return self.client.document(self.path)
+        return self.client.collection(self.path)
+
+    def read(self, allow_empty=False):
+        if not self.is_document():
+            return {
+                snapshot.id: LocalHandle(self.client, f"{self.path}/{snapshot.id}").read()
+                for snapshot in self.get().stream()
+            }
+        output = self.get().get().to_dict()
+        if output is None:
+            if not allow_empty:
+                raise ValueError(f"No document at {self.path}.")
+            output = {}
+        if set(output.keys()) in [{"data"}, {"data", "metadata"}]:
+            output = output["data"]
+        return output
+
+    def write(self, data):
+        if not isinstance(data, dict):
+            data = {"data": data}
+        self.get().set(data)
+        return True
+
+    def delete(self):
+        prefix = f"{self.path}/"
+        with self.client.lock:
+            paths = [path for path in self.client.documents if path.startswith(prefix)]
+        if self.is_document():
+            paths.append(self.path)
+        self.client.commit_writes([("delete", path, None) for path in paths])
+        return True
+
+    def ls(self):
+        self.client.round_trip()
+        prefix = f"{self.path}/"
+        with self.client.lock:
+            names = {
+                path[len(prefix) :].split("/")[0]
+                for path in self.client.documents
+                if path.startswith(prefix)
+            }
+        return sorted(names)
+
+
+class LocalFirestore:
+    """
+    The client: documents are kept in a dict keyed by path.
+    Transactions are optimistic: the commit fails (and the transaction is retried) if a document
+    it read was written in the meantime, so only transactions on the same documents contend, as in Firestore.
+    """
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self.documents = {}
+        self.update_times = {}
+        self.counts = {"reads": 0, "writes": 0, "commits": 0, "contentions": 0}
+        self.lock = threading.RLock()
+        self.project = "local"
+
+    def round_trip(self):
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+
+    def count(self, operation, number=1):
+        with self.lock:
+            self.counts[operation] += number
+
+    def document(self, path):
+        return LocalDocument(self, path)
+
+    def collection(self, path):
+        return LocalCollection(self, path)
+
+    def handle(self, path=None, **kwargs):
+        return LocalHandle(self, path)
+
+    def batch(self):
+        return LocalBatch(self)
+
+    def transaction(self):
+        return LocalTransaction(self)
+
+    def write_option(self, last_update_time=None):
+        return {"last_update_time": last_update_time}
+
+    def commit_writes(self, writes, reads=None):
+        self.round_trip()
+        with self.lock:
+            for path, update_time in (reads or {}).items():
+                if self.update_times.get(path) != update_time:
+                    self.counts["contentions"] += 1
+                    raise LocalContention(path)
+            for operation, path, data in writes:
+                if operation == "delete":
+                    self.documents.pop(path, None)
+                elif operation == "update":
+                    self.documents[path] = {**self.documents[path], **copy.deepcopy(data)}
+                else:
+                    self.documents[path] = copy.deepcopy(data)
+                self.update_times[path] = time.time_ns()
+            self.counts["writes"] += len(writes)
+            self.counts["commits"] += 1
+
+    def run_transaction(self, function, max_attempts=5):
+        """
+        Same as `packages.firestore.run_transaction`.
+        """
+        for attempt in range(max_attempts):
+            transaction = self.transaction()
+            result = function(transaction)
+            try:
+                transaction.commit()
+                return result
+            except LocalContention:
+                if attempt == max_attempts - 1:
+                    raise
+
+
+def install(client, *modules):
+    """
+    Make modules which imported the shared handles of `packages.firestore` (or `gcp_pal.Firestore`)
+    use the stand-in instead.
+
+    Args:
+    - client (LocalFirestore): The stand-in.
+    - modules (module): The modules to patch (e.g. `packages.gcp_phone_location.src.location`).
+    """
+    handles = {
+        "get_client": lambda: client,
+        "get_document": client.document,
+        "get_collection": client.collection,
+        "get_firestore": client.handle,
+        "run_transaction": client.run_transaction,
+        "Firestore": client.handle,
+    }
+    for module in modules:
+        for name, handle in handles.items():
+            if hasattr(module, name):
+                setattr(module, name, handle)
@@ -0,0 +1,206 @@
+"""
+In-memory stand-ins for the HTTP services the automations call (FollowMee, OpenWeatherMap, Open-Meteo, OpenAI,
+Pushover and the Google weather icon) and for the Cloud Scheduler job of the weather service, for load tests
+and local runs without the real APIs.
+Every service answers after a configurable latency (in seconds, or a function drawing it) and the calls are counted.
+"""
+
+import json
+import time
+import bisect
+import threading
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+DEFAULT_LATENCIES_S = {
+    "followmee": 0.3,
+    "openweathermap": 0.15,
+    "open-meteo": 0.1,
+    "openai": 2.0,
+    "pushover": 0.15,
+    "google": 1.0,
+    "scheduler": 0.5,
+}
+DEFAULT_ADVICE = "No umbrella needed today. A light jacket will do for the evening."
+
+
+class LocalResponse:
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class LocalServices:
+    """
+    Routes `requests.get`/`requests.post` by URL to the stand-ins. Install it with `install`.
+    The FollowMee stand-in serves the fixes of `tracks` ({device_id: [location, ...]} sorted by `Epoch`)
+    which are not later than `now()`, so a replay can reveal them as its clock advances.
+    """
+
+    RequestException = requests.RequestException
+
+    def __init__(self, latencies_s=None, tracks=None, now=None):
+        self.latencies_s = {**DEFAULT_LATENCIES_S, **(latencies_s or {})}
+        self.tracks = tracks or {}
+        self.epochs = {
+            device_id: [location["Epoch"] for location in locations]
+            for device_id, locations in self.tracks.items()
+        }
+        self.now = now or time.time
+        self.counts = {service: 0 for service in self.latencies_s}
+        self.lock = threading.Lock()
+        self.scheduled_time_zone = "UTC"
+
+    def call(self, service):
+        with self.lock:
+            self.counts[service] += 1
+        latency_s = self.latencies_s[service]
+        if callable(latency_s):
+            latency_s = latency_s()
+        if latency_s > 0:
+            time.sleep(latency_s)
+
+    def get(self, url, params=None, **kwargs):
+        if "followmee.com" in url:
+            self.call("followmee")
+            return LocalResponse({"Data": self.query_followmee(params or {})})
+        if "openweathermap.org" in url:
+            self.call("openweathermap")
+            return LocalResponse(self.make_forecast(params["lat"], params["lon"]))
+        if "open-meteo.com" in url:
+            self.call("open-meteo")
+            return LocalResponse(self.make_open_meteo_forecast(params["latitude"], params["longitude"]))
+        raise ValueError(f"No stand-in for GET {url}")
+
+    def post(self, url, data=None, json=None, **kwargs):
+        if "api.openai.com" in url:
+            self.call("openai")
+            return LocalResponse({"choices": [{"message": {"content": DEFAULT_ADVICE}}]})
+        if "api.pushover.net" in url:
+            self.call("pushover")
+            return LocalResponse({"status": 1}, headers={"X-Limit-App-Remaining": "10000"})
+        raise ValueError(f"No stand-in for POST {url}")
+
+    def get_visible(self, device_id, start_epoch=None, end_epoch=None):
+        epochs = self.epochs.get(device_id, [])
+        stop = bisect.bisect_right(epochs, self.now())
+        if end_epoch is not None:
+            stop = min(stop, bisect.bisect_right(epochs, end_epoch))
+        start = 0 if start_epoch is None else bisect.bisect_left(epochs, start_epoch)
+        return [dict(location) for location in self.tracks[device_id][start:stop]]
+
+    def query_followmee(self, params):
+        function = params.get("function")
+        if function == "currentforalldevices":
+            output = []
+            for device_id in self.tracks:
+                stop = bisect.bisect_right(self.epochs[device_id], self.now())
+                if stop > 0:
+                    output.append(dict(self.tracks[device_id][stop - 1]))
+            return output
+        if function == "daterangefordevice":
+            start = datetime.fromisoformat(params["from"]).replace(tzinfo=timezone.utc)
+            end = datetime.fromisoformat(params["to"]).replace(tzinfo=timezone.utc)
+            end += timedelta(days=1)
+            return self.get_visible(
+                params["deviceid"], int(start.timestamp()), int(end.timestamp()) - 1
+            )
+        raise ValueError(f"No stand-in for the FollowMee function {function}")
+
+    def make_forecast(self, latitude, longitude, num_steps=40):
+        """
+        Make a mild OpenWeatherMap 5-day forecast (3-hour steps) starting from the current hour.
+        """
+        start = datetime.now().replace(minute=0, second=0, microsecond=0)
+        steps = []
+        for i in range(num_steps):
+            timestamp = start + timedelta(hours=3 * i)
+            steps.append(
+                {
+                    "dt_txt": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                    "weather": [{"description": "light rain" if i % 5 == 0 else "few clouds"}],
+                    "clouds": {"all": 20},
+                    "pop": 0.2,
+                    "main": {"temp": 288.0, "feels_like": 287.0, "pressure": 1012, "humidity": 70},
+                    "wind": {"speed": 3.0, "gust": 5.0, "deg": 200},
+                    "rain": {"3h": 0.4} if i % 5 == 0 else {},
+                }
+            )
+        now = int(time.time())
+        city = {
+            "name": f"City {latitude:.1f},{longitude:.1f}",
+            "country": "GB",
+            "timezone": 0,
+            "sunrise": now - now % 86400 + 6 * 3600,
+            "sunset": now - now % 86400 + 19 * 3600,
+        }
+        return {"list": steps, "city": city}
+
+    def make_open_meteo_forecast(self, latitude, longitude, num_days=3):
+        """
+        Make the same forecast as `make_forecast`, in the hourly Open-Meteo format.
+        """
+        now = int(time.time())
+        start = now - now % 3600
+        hours = range(num_days * 24)
+        steps = [(start + 3600 * i, i // 3 % 5 == 0) for i in hours]
+        day = now - now % 86400
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "timezone": "Europe/London",
+            "utc_offset_seconds": 0,
+            "hourly": {
+                "time": [epoch for epoch, _ in steps],
+                "temperature_2m": [14.85] * len(steps),
+                "apparent_temperature": [13.85] * len(steps),
+                "pressure_msl": [1012] * len(steps),
+                "relative_humidity_2m": [70] * len(steps),
+                "wind_speed_10m": [10.8] * len(steps),
+                "wind_gusts_10m": [18.0] * len(steps),
+                "wind_direction_10m": [200] * len(steps),
+                "rain": [0.4 / 3 if rainy else 0 for _, rainy in steps],
+                "showers": [0] * len(steps),
+                "snowfall": [0] * len(steps),
+                "precipitation_probability": [20] * len(steps),
+                "cloud_cover": [20] * len(steps),
+                "weather_code": [61 if rainy else 1 for _, rainy in steps],
+            },
+            "daily": {"sunrise": [day + 6 * 3600], "sunset": [day + 19 * 3600]},
+        }
+
+    def get_weather_image_icon(self, metadata):
+        self.call("google")
+        return None
+
+    def get_scheduled_time_zone(self):
+        self.call("scheduler")
+        return self.scheduled_time_zone
+
+    def schedule_service(self, time_zone=None):
+        self.call("scheduler")
+        self.scheduled_time_zone = time_zone or "UTC"
+
+
+def install(services, *modules):
+    """
+    Make modules send their HTTP requests (and the weather icon lookup and the rescheduling) to the stand-ins.
+
+    Args:
+    - services (LocalServices): The stand-ins.
+    - modules (module): The modules to patch (e.g. `packages.gcp_phone_weather.src.weather`).
+    """
+    for module in modules:
+        if hasattr(module, "requests"):
+            module.requests = services
+        if hasattr(module, "get_weather_image_icon"):
+            module.get_weather_image_icon = services.get_weather_image_icon
+        if hasattr(module, "get_scheduled_time_zone"):
+            module.get_scheduled_time_zone = services.get_scheduled_time_zone
+            module.schedule_service = services.schedule_service
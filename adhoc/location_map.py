@@ -3,13 +3,45 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import sys
+import time
+import threading
+import concurrent.futures
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime, timedelta, date
 import plotly.express as px
 import plotly.graph_objects as go
 
 import dash
-from dash import dcc, html, Input, Output, State, callback_context
+from dash import dcc, html, Input, Output, State, Patch, callback_context
+from dash.exceptions import PreventUpdate
+
+# Allow `python adhoc/location_map.py` to import from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packages.gcp_phone_location.src.analysis import (
+    detect_stay_points,
+    cluster_stay_points,
+)
+from packages.gcp_phone_location.src.history import (
+    get_history_path,
+    read_history,
+    read_local_days,
+    get_local_days_range,
+    get_last_history_epoch,
+)
+from packages.gcp_phone_location.src.trajectory import (
+    get_trajectory_path,
+    read_trajectory,
+    get_last_trajectory_epoch,
+)
+from packages.gcp_phone_location.src.export import query_locations, DEFAULT_END_DATE
+from packages.gcp_phone_location.src.location import convert_time_to_epoch
+from packages.gcp_phone_location.src.aggregates import (
+    read_daily_aggregates,
+    summarise_daily_aggregates,
+)
 
 
 # --- Helper Functions ---
@@ -31,7 +63,41 @@ def format_datetime_for_display(dt_obj):
         return str(dt_obj)
 
 
-def create_location_figure(df_filtered: pd.DataFrame, add_lines: bool = True):
+def add_stay_points_trace(fig, stay_points: pd.DataFrame):
+    """
+    Overlays the stay points (see `detect_stay_points`) on the figure, sized by duration.
+    """
+    if stay_points is None or stay_points.empty:
+        return fig
+    durations_min = stay_points["Duration"] / 60
+    hover_text = [
+        f"{place}: {int(duration)} min (from {arrival})"
+        for place, duration, arrival in zip(
+            stay_points["Place"], durations_min, stay_points["ArrivalDate"]
+        )
+    ]
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=stay_points["Latitude"],
+            lon=stay_points["Longitude"],
+            mode="markers",
+            marker={
+                "size": (8 + durations_min.clip(upper=600) ** 0.5).tolist(),
+                "color": "rgba(220,50,50,0.6)",
+            },
+            hovertext=hover_text,
+            hovertemplate="<b>Stay:</b> %{hovertext}<extra></extra>",
+            name="Stay points",
+        )
+    )
+    return fig
+
+
+def create_location_figure(
+    df_filtered: pd.DataFrame,
+    add_lines: bool = True,
+    stay_points: pd.DataFrame = None,
+):
     fig_height = get_figure_height()
 
     df_plot = df_filtered.copy()
@@ -147,21 +213,252 @@ def create_location_figure(df_filtered: pd.DataFrame, add_lines: bool = True):
             "<extra></extra>"
         )
     )
+    fig = add_stay_points_trace(fig, stay_points)
     return fig
 
 
+def get_figure_signature(fig):
+    """
+    Returns what the figure looks like apart from its data: the traces and the way the map is framed.
+    Two figures with the same signature only differ by their trace data and bounds.
+    """
+    if fig.layout.annotations or fig.layout.mapbox.bounds is None:
+        # Placeholder figures and single-point (centred) maps are always sent in full
+        return None
+    traces = [[trace.type, trace.mode, trace.name] for trace in fig.data]
+    return {"traces": traces, "height": fig.layout.height}
+
+
+def make_figure_patch(fig):
+    """
+    Returns a partial update which turns the figure shown in the browser into `fig`, assuming both
+    have the same signature: only the trace data and the map bounds are sent.
+    """
+    patch = Patch()
+    for i, trace in enumerate(fig.data):
+        # 6 decimals is ~10cm, well below the GPS accuracy
+        patch["data"][i]["lat"] = [round(lat, 6) for lat in trace.lat]
+        patch["data"][i]["lon"] = [round(lon, 6) for lon in trace.lon]
+        patch["data"][i]["hovertext"] = list(trace.hovertext)
+        marker_size = trace.marker.size if trace.type == "scattermapbox" else None
+        if isinstance(marker_size, (list, tuple)):
+            patch["data"][i]["marker"]["size"] = list(marker_size)
+        elif marker_size is not None:
+            patch["data"][i]["marker"]["size"] = marker_size
+    patch["layout"]["mapbox"]["bounds"] = fig.layout.mapbox.bounds.to_plotly_json()
+    return patch
+
+
+class FigureCache:
+    """
+    Thread-safe LRU cache which evicts the least recently used entries once their total size
+    exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def invalidate(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.size -= self.entries.pop(key)[1]
+
+
+class LiveSync:
+    """
+    Keeps the location data newer than the local export in memory, by periodically querying Firestore
+    for the documents after the last known epoch (the watermark) only.
+    """
+
+    def __init__(self, device_id, interval, get_local_watermark):
+        self.device_id = device_id
+        self.interval = interval
+        self.get_local_watermark = get_local_watermark
+        self.data = pd.DataFrame(columns=["Date", "Epoch", "Latitude", "Longitude"])
+        self.watermark = None
+        self.version = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def sync(self):
+        """
+        Appends the documents newer than the watermark and returns the local dates they belong to.
+        """
+        if self.watermark is None:
+            self.watermark = self.get_local_watermark()
+        end_epoch = convert_time_to_epoch(DEFAULT_END_DATE)
+        output = query_locations(self.device_id, self.watermark + 1, end_epoch)
+        if not output:
+            return set()
+        new_df = pd.DataFrame(list(output.values()))
+        with self.lock:
+            self.data = pd.concat([self.data, new_df], ignore_index=True)
+            self.watermark = int(new_df["Epoch"].max())
+            self.version += 1
+        return set(new_df["Date"].astype(str).str[:10])
+
+    def run(self, on_new_days):
+        while True:
+            try:
+                new_days = self.sync()
+                if new_days:
+                    on_new_days(new_days)
+            except Exception as e:
+                print(f"Live sync failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self, on_new_days):
+        """
+        Starts the background sync (once).
+        """
+        with self.lock:
+            if self.thread is not None or self.interval <= 0:
+                return
+            self.thread = threading.Thread(
+                target=self.run, args=(on_new_days,), daemon=True
+            )
+        self.thread.start()
+
+    def get_data(self, start_date=None, end_date=None):
+        """
+        Returns the synced data between two local dates, with a day of margin like `read_local_days`.
+        """
+        with self.lock:
+            df = self.data
+        if start_date is None or df.empty:
+            return df
+        days = df["Date"].astype(str).str[:10]
+        start_day = (start_date - timedelta(days=1)).isoformat()
+        end_day = ((end_date or start_date) + timedelta(days=1)).isoformat()
+        return df[(days >= start_day) & (days <= end_day)]
+
+
+def estimate_figure_size(fig):
+    """
+    Rough size in bytes of a figure, dominated by its per-point data.
+    """
+    num_points = sum(len(trace.lat) for trace in fig.data if trace.lat is not None)
+    return 64 * num_points + 4096
+
+
 # --- Dash App ---
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 app.title = "Location Tracker"
 
 DEFAULT_DEVICE_ID = os.environ.get("FOLLOWMEE_DEVICE_ID", "YOUR_DEFAULT_DEVICE_ID_HERE")
 CSV_FILE_PATH = f"output/location_export_{DEFAULT_DEVICE_ID}.csv"
+HISTORY_PATH = get_history_path(DEFAULT_DEVICE_ID)
+TRAJECTORY_PATH = get_trajectory_path(DEFAULT_DEVICE_ID)
+
+
+# Seconds between two syncs of the new locations from Firestore (0 disables the live sync)
+LIVE_SYNC_INTERVAL = float(os.environ.get("DASHBOARD_SYNC_INTERVAL", 60))
+
+
+def load_local_data(start_date=None, end_date=None):
+    """
+    Loads the exported location data between two local dates (all of it if no dates are given).
+    The columnar history (`export.py --format arrow`) is preferred: only the day partitions and
+    columns needed are memory-mapped. Then the trajectory export (`export.py --format traj`), of which
+    only the chunks overlapping the days are decoded. Otherwise, the whole CSV export is parsed.
+    """
+    if os.path.isdir(HISTORY_PATH):
+        columns = ["Date", "Latitude", "Longitude"]
+        if start_date is None:
+            return read_history(DEFAULT_DEVICE_ID, columns=columns)
+        return read_local_days(DEFAULT_DEVICE_ID, start_date, end_date, columns=columns)
+    if os.path.exists(TRAJECTORY_PATH):
+        if start_date is None:
+            return read_trajectory(TRAJECTORY_PATH)
+        return read_trajectory(TRAJECTORY_PATH, *get_local_days_range(start_date, end_date))
+    return pd.read_csv(CSV_FILE_PATH)
+
+
+def get_local_watermark():
+    """
+    Returns the epoch of the last exported location, or the start of yesterday if nothing is exported,
+    so that the live sync never re-reads what is already on disk.
+    """
+    last_epoch = None
+    if os.path.isdir(HISTORY_PATH):
+        last_epoch = get_last_history_epoch(DEFAULT_DEVICE_ID)
+    elif os.path.exists(TRAJECTORY_PATH):
+        last_epoch = get_last_trajectory_epoch(TRAJECTORY_PATH)
+    elif os.path.exists(CSV_FILE_PATH):
+        df = pd.read_csv(CSV_FILE_PATH, usecols=lambda column: column in ["Date", "Epoch"])
+        if "Epoch" not in df.columns:
+            df["Epoch"] = df["Date"].apply(convert_time_to_epoch)
+        last_epoch = int(df["Epoch"].max()) if not df.empty else None
+    if last_epoch is None:
+        yesterday = datetime.combine(date.today() - timedelta(days=1), datetime.min.time())
+        last_epoch = int(yesterday.timestamp())
+    return last_epoch
+
+
+LIVE_SYNC = LiveSync(DEFAULT_DEVICE_ID, LIVE_SYNC_INTERVAL, get_local_watermark)
+
+
+def load_location_data(start_date=None, end_date=None):
+    """
+    Loads the location data between two local dates (all of it if no dates are given):
+    the local export plus the locations synced live from Firestore since.
+    """
+    live_df = LIVE_SYNC.get_data(start_date, end_date)
+    try:
+        df = load_local_data(start_date, end_date)
+    except FileNotFoundError:
+        if live_df.empty:
+            raise
+        df = pd.DataFrame(columns=["Date", "Latitude", "Longitude"])
+    if live_df.empty:
+        return df
+    live_df = live_df[[column for column in live_df.columns if column in df.columns]]
+    return pd.concat([df, live_df], ignore_index=True)
+
+
+def invalidate_days(days):
+    """
+    Drops the cached data and figures of the given local dates, e.g. after new locations were synced.
+    """
+    FIGURE_CACHE.invalidate(lambda key: key[1] in days)
+
 
 initial_today_str = date.today().isoformat()
 
 app.layout = html.Div(
     [
         dcc.Store(id="current-target-date-store", data=initial_today_str),
+        dcc.Store(id="figure-signature-store", data=None),
+        dcc.Store(id="live-version-store", data=0),
+        dcc.Interval(
+            id="live-sync-interval",
+            interval=max(LIVE_SYNC_INTERVAL, 1) * 1000,
+            disabled=LIVE_SYNC_INTERVAL <= 0,
+        ),
         html.H1("Device Location History"),
         html.Div(
             [
@@ -175,6 +472,7 @@ app.layout = html.Div(
                         {"label": "Single Day", "value": "single_day"},
                         {"label": "All History", "value": "all_history"},
                         {"label": "Custom Range", "value": "custom_range"},
+                        {"label": "Daily Summary", "value": "daily_summary"},
                     ],
                     value="single_day",
                     labelStyle={"display": "inline-block", "margin-right": "15px"},
@@ -182,6 +480,12 @@ app.layout = html.Div(
             ],
             style={"padding": "10px 0px"},
         ),
+        dcc.Checklist(
+            id="stay-points-checklist",
+            options=[{"label": "Show stay points", "value": "show"}],
+            value=[],
+            style={"padding": "0px 0px 10px 0px"},
+        ),
         html.Div(
             id="date-controls-wrapper",
             children=[
@@ -256,7 +560,7 @@ def toggle_control_visibility(selected_mode):
 
     if selected_mode == "single_day":
         return single_day_style, {**custom_range_style, "display": "none"}
-    elif selected_mode == "custom_range":
+    elif selected_mode in ["custom_range", "daily_summary"]:
         return {**single_day_style, "display": "none"}, custom_range_style
     else:
         return {**single_day_style, "display": "none"}, {
@@ -299,19 +603,188 @@ def update_target_date_store(
 
 
 @app.callback(
-    [Output("location-map-graph", "figure"), Output("data-info", "children")],
+    [
+        Output("location-map-graph", "figure"),
+        Output("data-info", "children"),
+        Output("figure-signature-store", "data"),
+        Output("live-version-store", "data"),
+    ],
     [
         Input("filter-mode-radio", "value"),
         Input("current-target-date-store", "data"),
         Input("custom-date-range-picker", "start_date"),
         Input("custom-date-range-picker", "end_date"),
+        Input("stay-points-checklist", "value"),
+        Input("live-sync-interval", "n_intervals"),
     ],
+    [State("figure-signature-store", "data"), State("live-version-store", "data")],
 )
 def update_map(
-    filter_mode, target_date_store_str, custom_start_date_str, custom_end_date_str
+    filter_mode,
+    target_date_store_str,
+    custom_start_date_str,
+    custom_end_date_str,
+    stay_points_options=None,
+    n_intervals=None,
+    previous_signature=None,
+    previous_version=None,
 ):
+    LIVE_SYNC.start(invalidate_days)
+    live_version = LIVE_SYNC.version
+    triggered_ids = [t["prop_id"].split(".")[0] for t in callback_context.triggered]
+    if triggered_ids == ["live-sync-interval"] and live_version == previous_version:
+        # Nothing new was synced since the last render
+        raise PreventUpdate
+    if filter_mode == "single_day" and target_date_store_str:
+        fig, info_text = get_day_map(target_date_store_str, stay_points_options)
+        prefetch_adjacent_days(target_date_store_str, stay_points_options)
+    elif filter_mode == "daily_summary":
+        fig, info_text = build_summary_map(custom_start_date_str, custom_end_date_str)
+    else:
+        fig, info_text = build_map(
+            filter_mode,
+            target_date_store_str,
+            custom_start_date_str,
+            custom_end_date_str,
+            stay_points_options,
+        )
+    signature = get_figure_signature(fig)
+    if signature is not None and signature == previous_signature:
+        # Same layout as in the browser: only send the new points and bounds
+        return make_figure_patch(fig), info_text, signature, live_version
+    return fig, info_text, signature, live_version
+
+
+# --- Per-day figure cache ---
+FIGURE_CACHE = FigureCache(max_bytes=256 * 1024**2)
+PREFETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+PREFETCHING = set()
+PREFETCHING_LOCK = threading.Lock()
+
+
+def load_day_data(target_date_str):
+    """
+    Loads the location data of one local day, from the cache if possible.
+    The `Date` strings carry the local offset, so their first 10 characters are the local date.
+    """
+    key = ("data", target_date_str)
+    df_day = FIGURE_CACHE.get(key)
+    if df_day is None:
+        live_version = LIVE_SYNC.version
+        target_date_obj = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+        df_full = load_location_data(target_date_obj, target_date_obj)
+        df_day = df_full[df_full["Date"].astype(str).str[:10] == target_date_str]
+        df_day = df_day.reset_index(drop=True)
+        if LIVE_SYNC.version != live_version:
+            # New locations were synced while loading: do not cache a stale day
+            return df_day
+        FIGURE_CACHE.put(key, df_day, int(df_day.memory_usage(deep=True).sum()))
+    return df_day
+
+
+def get_day_map(target_date_str, stay_points_options=None):
+    """
+    Returns the figure and info text of one day, from the cache if possible.
+    """
+    show_stay_points = bool(stay_points_options and "show" in stay_points_options)
+    key = ("figure", target_date_str, show_stay_points)
+    cached = FIGURE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    live_version = LIVE_SYNC.version
     try:
-        df_full = pd.read_csv(CSV_FILE_PATH)
+        df_day = load_day_data(target_date_str)
+    except FileNotFoundError:
+        df_day = None
+    fig, info_text = build_map(
+        "single_day", target_date_str, None, None, stay_points_options, df_full=df_day
+    )
+    if df_day is not None and LIVE_SYNC.version == live_version:
+        FIGURE_CACHE.put(key, (fig, info_text), estimate_figure_size(fig))
+    return fig, info_text
+
+
+def prefetch_adjacent_days(target_date_str, stay_points_options=None):
+    """
+    Builds the figures of the previous and next days in the background.
+    """
+    show_stay_points = bool(stay_points_options and "show" in stay_points_options)
+    target_date_obj = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+    for offset in [-1, 1]:
+        date_str = (target_date_obj + timedelta(days=offset)).isoformat()
+        key = ("figure", date_str, show_stay_points)
+        with PREFETCHING_LOCK:
+            if key in FIGURE_CACHE or key in PREFETCHING:
+                continue
+            PREFETCHING.add(key)
+        # Submitted outside the lock: the callback runs right away if the future is already done
+        future = PREFETCH_EXECUTOR.submit(get_day_map, date_str, stay_points_options)
+        future.add_done_callback(lambda _, key=key: finish_prefetch(key))
+
+
+def finish_prefetch(key):
+    """
+    Marks the prefetch of a figure as finished, so that it can be prefetched again once evicted.
+    """
+    with PREFETCHING_LOCK:
+        PREFETCHING.discard(key)
+
+
+def build_summary_map(custom_start_date_str=None, custom_end_date_str=None):
+    """
+    Returns the figure and info text of a range of days (all of them if no range is selected) from the
+    daily aggregates alone: one small document per day instead of every location, so years stay cheap.
+    Every day is drawn at the centre of its bounding box.
+    """
+    try:
+        aggregates = read_daily_aggregates(
+            DEFAULT_DEVICE_ID, custom_start_date_str, custom_end_date_str
+        )
+    except Exception as e:
+        return create_location_figure(pd.DataFrame()), f"Error: Could not load the daily aggregates: {e}"
+    aggregates = [aggregate for aggregate in aggregates if aggregate["num_fixes"] > 0]
+    if not aggregates:
+        return create_location_figure(pd.DataFrame()), "No daily aggregates for the selected period."
+
+    df = pd.DataFrame(aggregates)
+    df["Latitude"] = (df["min_latitude"] + df["max_latitude"]) / 2
+    df["Longitude"] = (df["min_longitude"] + df["max_longitude"]) / 2
+    df["datetime_obj"] = pd.to_datetime(df["day"])
+    df["DisplayDate"] = [
+        f"{day}: {distance_m / 1000:.1f} km, {moving_s / 3600:.1f} h moving, {num_fixes} points"
+        for day, distance_m, moving_s, num_fixes in zip(
+            df["day"], df["distance_m"], df["moving_s"], df["num_fixes"]
+        )
+    ]
+    fig = create_location_figure(df, add_lines=True)
+
+    summary = summarise_daily_aggregates(aggregates)
+    info_text = (
+        f"Daily summary from {df['day'].iloc[0]} to {df['day'].iloc[-1]} ({summary['days']} days): "
+        f"{summary['distance_m'] / 1000:.1f} km travelled, {summary['moving_s'] / 3600:.1f} h moving, "
+        f"{summary['num_fixes']} location points."
+    )
+    return fig, info_text
+
+
+def build_map(
+    filter_mode,
+    target_date_store_str,
+    custom_start_date_str,
+    custom_end_date_str,
+    stay_points_options=None,
+    df_full=None,
+):
+    load_start_date, load_end_date = None, None
+    if filter_mode == "single_day" and target_date_store_str:
+        load_start_date = datetime.strptime(target_date_store_str, "%Y-%m-%d").date()
+    elif filter_mode == "custom_range" and custom_start_date_str and custom_end_date_str:
+        load_start_date = datetime.strptime(custom_start_date_str, "%Y-%m-%d").date()
+        load_end_date = datetime.strptime(custom_end_date_str, "%Y-%m-%d").date()
+    try:
+        if df_full is None:
+            df_full = load_location_data(load_start_date, load_end_date)
+        df_full = df_full.copy()
     except FileNotFoundError:
         error_fig = go.Figure()
         fig_height = get_figure_height()  # Use new function for height
@@ -401,7 +874,13 @@ def update_map(
             f"to {custom_end_date_obj.strftime('%Y-%m-%d')}."
         )
 
-    fig = create_location_figure(df_filtered, add_lines=True)
+    stay_points = None
+    if stay_points_options and "show" in stay_points_options and not df_filtered.empty:
+        stay_points = detect_stay_points(df_filtered)
+        stay_points, _ = cluster_stay_points(stay_points)
+        time_range_info += f" {len(stay_points)} stay points."
+
+    fig = create_location_figure(df_filtered, add_lines=True, stay_points=stay_points)
 
     num_points = (
         len(df_filtered.dropna(subset=["Latitude", "Longitude"]))
@@ -420,7 +899,7 @@ if __name__ == "__main__":
             "Warning: FOLLOWMEE_DEVICE_ID environment variable is not set or is using the placeholder."
         )
         print("Please set it in your .env file or environment.")
-    if not os.path.exists(CSV_FILE_PATH):
+    if not any([os.path.exists(CSV_FILE_PATH), os.path.isdir(HISTORY_PATH), os.path.exists(TRAJECTORY_PATH)]):
         print(f"Warning: The CSV file '{CSV_FILE_PATH}' does not exist.")
         print("Make sure the file is present and the device ID is correct.")
     app.run(debug=True)
@@ -2,12 +2,47 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from packages.utils import make_requirements
+import argparse
+
+from packages.utils import deploy_services
 from packages.gcp_phone_location.deploy import deploy_phone_location
 from packages.gcp_phone_weather.deploy import deploy_phone_weather
 
+# `main.py` is the entry point of both services and dispatches to both, so a change to either service
+# redeploys the other as well; following its imports is what catches the modules it uses directly
+# (e.g. the ingest route and the Firestore usage tracking)
+SERVICES = {
+    "phone-location": {
+        "deploy": deploy_phone_location,
+        "entry_points": ["main.py", "packages/gcp_phone_location/main.py"],
+        "files": [
+            "requirements.txt",
+            "packages/gcp_phone_location/deploy.py",
+            "packages/gcp_phone_location/schedule.py",
+        ],
+    },
+    "phone-weather": {
+        "deploy": deploy_phone_weather,
+        "entry_points": ["main.py", "packages/gcp_phone_weather/main.py"],
+        "files": [
+            "packages/gcp_phone_weather/Dockerfile",
+            "packages/gcp_phone_weather/requirements.txt",
+            "packages/gcp_phone_weather/deploy.py",
+            "packages/gcp_phone_weather/schedule.py",
+        ],
+    },
+}
+
 
 if __name__ == "__main__":
-    make_requirements()
-    deploy_phone_location()
-    deploy_phone_weather()
+    parser = argparse.ArgumentParser(description="Deploy the changed services.")
+    parser.add_argument("services", nargs="*", help="Only consider these services.")
+    parser.add_argument("--force", action="store_true", help="Deploy even if unchanged.")
+    args = parser.parse_args()
+    services = {
+        name: service
+        for name, service in SERVICES.items()
+        if not args.services or name in args.services
+    }
+    outcomes = deploy_services(services, force=args.force)
+    print(f"Deployment finished: {outcomes}")
@@ -1,5 +1,25 @@
-from packages.gcp_phone_location.src.export import export_locations
+import argparse
+
+from packages.firestore_usage import track_firestore_usage
+from packages.gcp_phone_location.src.export import (
+    export_locations,
+    export_all_locations,
+)
 
 
 if __name__ == "__main__":
-    export_locations()
+    parser = argparse.ArgumentParser(description="Export the location history.")
+    parser.add_argument("--all", action="store_true", help="Export every device.")
+    parser.add_argument("--shards", type=int, default=8, help="Shards per device.")
+    parser.add_argument(
+        "--format",
+        choices=["csv", "arrow", "traj"],
+        default="csv",
+        help="Single CSV file, columnar history partitioned by day, or compact binary trajectory.",
+    )
+    args = parser.parse_args()
+    with track_firestore_usage("export"):
+        if args.all:
+            export_all_locations(num_shards=args.shards, output_format=args.format)
+        else:
+            export_locations(output_format=args.format)
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import hmac
 import json
 from gcp_pal.utils import log
 from flask import Flask, jsonify, request as flask_request
@@ -15,18 +16,39 @@ def main(task=None):
     Stores the current location of all my devices.
 
     Args:
-    - task (str): The task to run. Can be either "location" or "weather".
+    - task (str): The task to run. Can be "location", "weather", "weather_fan_out", "notify", "reschedule",
+      "prefetch" or "compact".
+
+    Returns:
+    - dict: The status of the task and its Firestore usage (see `track_firestore_usage`).
     """
+    from packages.firestore_usage import track_firestore_usage, FirestoreBudgetExceeded
+
     if task == "location":
         from packages.gcp_phone_location.main import main
     elif task == "weather":
         from packages.gcp_phone_weather.main import main
+    elif task == "weather_fan_out":
+        from packages.gcp_phone_weather.main import main_fan_out as main
+    elif task == "notify":
+        from packages.gcp_phone_weather.main import main_notify as main
+    elif task == "reschedule":
+        from packages.gcp_phone_location.main import main_reschedule as main
+    elif task == "prefetch":
+        from packages.gcp_phone_location.main import main_prefetch as main
+    elif task == "compact":
+        from packages.gcp_phone_location.main import main_compact as main
     else:
         raise ValueError(f"Invalid task: {task}")
 
-    main()
+    with track_firestore_usage(task) as usage:
+        try:
+            main()
+        except FirestoreBudgetExceeded as e:
+            log(f"Aborted {task}: {e}")
+            return {"status": "failure", "message": str(e), "firestore": usage.summary()}
 
-    return {"status": "success"}
+    return {"status": "success", "firestore": usage.summary()}
 
 
 def entry_point(request):
@@ -65,8 +87,39 @@ def flask_entry_point():
             "status": "failure",
             "message": f"No task provided. Recieved: {flask_request.args}",
         }
-    main(task=task)
-    return jsonify({"status": "success"}), 200
+    response = main(task=task)
+    return jsonify(response), 200 if response["status"] == "success" else 500
+
+
+@app.route("/locations", methods=["POST"])
+def ingest_entry_point():
+    """
+    Entry point for pushed location uploads. The body is `{"device_id": ..., "locations": [...]}` in the
+    schema stored by `store_location`, and the request must carry the token of the env variable
+    `INGEST_TOKEN` (`Authorization: Bearer <token>`).
+
+    Returns:
+    - dict: A dictionary containing the response.
+    """
+    from packages.firestore_usage import track_firestore_usage, FirestoreBudgetExceeded
+    from packages.gcp_phone_location.src.ingest import ingest_locations
+
+    token = os.getenv("INGEST_TOKEN")
+    authorization = flask_request.headers.get("Authorization", "")
+    # Constant-time comparison, so the token cannot be guessed from the response times
+    if not token or not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        return jsonify({"status": "failure", "message": "Invalid token."}), 401
+    payload = flask_request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"status": "failure", "message": "Invalid JSON payload."}), 400
+    with track_firestore_usage("ingest") as usage:
+        try:
+            output = ingest_locations(payload)
+        except FirestoreBudgetExceeded as e:
+            return jsonify({"status": "failure", "message": str(e), "firestore": usage.summary()}), 500
+        except ValueError as e:
+            return jsonify({"status": "failure", "message": str(e)}), 400
+    return jsonify({"status": "success", **output, "firestore": usage.summary()}), 200
 
 
 if __name__ == "__main__":
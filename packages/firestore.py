@@ -0,0 +1,120 @@
+import os
+import time
+import functools
+from gcp_pal import Firestore
+from gcp_pal.utils import log
+
+# Collection used to time the first request when `FIRESTORE_TIMING` is enabled (it need not exist)
+TIMING_COLLECTION = "device_locations"
+
+
+def is_timing_enabled():
+    """
+    Check whether the cost of setting up the Firestore client should be measured and logged.
+
+    Returns:
+    - bool: The env variable `FIRESTORE_TIMING` is "true".
+    """
+    return os.getenv("FIRESTORE_TIMING", "false").lower() == "true"
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    Get the Firestore client shared by the whole process, so that warm invocations reuse it
+    (and its open channel). With `FIRESTORE_TIMING=true`, the cost of the client construction,
+    of an uncached `Firestore(path)` handle and of the first request (which opens the channel) is logged.
+
+    Returns:
+    - google.cloud.firestore.Client: The client.
+    """
+    start = time.perf_counter()
+    client = Firestore(project=os.getenv("PROJECT")).client
+    if not is_timing_enabled():
+        return client
+    constructed = time.perf_counter()
+    # What every `Firestore(path)` costs without the shared handles (the project is resolved each time)
+    Firestore("timing")
+    handle_constructed = time.perf_counter()
+    list(client.collection(TIMING_COLLECTION).limit(1).get())
+    first_request = time.perf_counter()
+    list(client.collection(TIMING_COLLECTION).limit(1).get())
+    second_request = time.perf_counter()
+    log(
+        f"Firestore timing: client construction {constructed - start:.3f}s, "
+        f"uncached handle {handle_constructed - constructed:.3f}s, "
+        f"first request {first_request - handle_constructed:.3f}s, "
+        f"warm request {second_request - first_request:.3f}s."
+    )
+    return client
+
+
+@functools.lru_cache(maxsize=None)
+def get_project():
+    """
+    Get the project of the shared Firestore client.
+
+    Returns:
+    - str: The project ID.
+    """
+    return get_client().project
+
+
+@functools.lru_cache(maxsize=1024)
+def get_firestore(path=None):
+    """
+    Get a `Firestore` handle of a path, shared for the lifetime of the process.
+    Use it for the gcp_pal helpers (e.g. `read`, which unwraps `{"data": ...}` documents).
+
+    Args:
+    - path (str): The path of the document or collection.
+
+    Returns:
+    - gcp_pal.Firestore: The handle.
+    """
+    return Firestore(path, project=get_project())
+
+
+@functools.lru_cache(maxsize=1024)
+def get_document(path):
+    """
+    Get a reference to a Firestore document, shared for the lifetime of the process.
+    Only use it for paths which are used repeatedly (e.g. watermarks), not for one-off documents.
+
+    Args:
+    - path (str): The path of the document (e.g. "collection/document").
+
+    Returns:
+    - google.cloud.firestore.DocumentReference: The reference.
+    """
+    return get_client().document(path)
+
+
+def run_transaction(function):
+    """
+    Run a function in a Firestore transaction of the shared client, retrying it on contention.
+
+    Args:
+    - function (callable): Takes the transaction and returns the result. It may be run several times,
+      so it must not have side effects other than the transaction's reads and writes.
+
+    Returns:
+    - Any: The result of the function.
+    """
+    from google.cloud import firestore
+
+    return firestore.transactional(function)(get_client().transaction())
+
+
+@functools.lru_cache(maxsize=1024)
+def get_collection(path):
+    """
+    Get a reference to a Firestore collection, shared for the lifetime of the process.
+
+    Args:
+    - path (str): The path of the collection (e.g. "collection/document/collection").
+
+    Returns:
+    - google.cloud.firestore.CollectionReference: The reference.
+    """
+    return get_client().collection(path)
@@ -0,0 +1,336 @@
+import os
+import json
+import threading
+import contextlib
+import contextvars
+import functools
+from gcp_pal.utils import log
+
+OPERATIONS = ["reads", "writes", "deletes"]
+# The usage is also broken down by the first segments of the document paths (e.g. "device_locations/devices")
+DEFAULT_PREFIX_DEPTH = 2
+
+# The usage of the invocation running in the current context. Worker threads (e.g. the export shards)
+# do not inherit it: the functions they run are wrapped with `in_current_context`
+CURRENT_USAGE = contextvars.ContextVar("firestore_usage", default=None)
+INSTALL_LOCK = threading.Lock()
+INSTALLED = False
+
+
+class FirestoreBudgetExceeded(RuntimeError):
+    """
+    Raised when an invocation performs more Firestore operations than its budget (see `get_op_budget`).
+    """
+
+
+class FirestoreUsage:
+    """
+    The Firestore operations of one invocation: reads, writes, deletes and bytes, in total and per path prefix.
+    Once the budget is exceeded, every further operation raises `FirestoreBudgetExceeded`, so that the job
+    aborts even if the first error is caught along the way.
+    """
+
+    def __init__(self, name, budget=None, prefix_depth=None):
+        self.name = name
+        self.budget = budget
+        self.prefix_depth = prefix_depth or int(
+            os.getenv("FIRESTORE_USAGE_PREFIX_DEPTH", DEFAULT_PREFIX_DEPTH)
+        )
+        self.counts = {operation: 0 for operation in OPERATIONS}
+        self.bytes = {"read": 0, "written": 0}
+        self.by_prefix = {}
+        self.exceeded = False
+        self.lock = threading.Lock()
+
+    def get_prefix(self, path):
+        """
+        Get the prefix of a document or collection path (or of a full resource name) to group the counts by.
+        """
+        path = path.split("/documents/", 1)[-1]
+        return "/".join(path.split("/")[: self.prefix_depth])
+
+    def record(self, operation, path, count=1, num_bytes=0):
+        """
+        Count Firestore operations.
+
+        Args:
+        - operation (str): "reads", "writes" or "deletes".
+        - path (str): The path of the document or collection.
+        - count (int): The number of operations.
+        - num_bytes (int): The size of the documents read or written.
+        """
+        with self.lock:
+            self.counts[operation] += count
+            self.bytes["read" if operation == "reads" else "written"] += num_bytes
+            prefix_counts = self.by_prefix.setdefault(
+                self.get_prefix(path), {operation: 0 for operation in OPERATIONS}
+            )
+            prefix_counts[operation] += count
+            total = sum(self.counts.values())
+            if self.budget is not None and total > self.budget:
+                self.exceeded = True
+        if self.exceeded:
+            raise FirestoreBudgetExceeded(
+                f"{self.name} exceeded its budget of {self.budget} Firestore operations ({total} so far)."
+            )
+
+    def summary(self):
+        """
+        Get the counts, for logs and task responses.
+
+        Returns:
+        - dict: The number of reads, writes and deletes, the bytes read and written, and the counts per path prefix.
+        """
+        with self.lock:
+            return {
+                **self.counts,
+                "bytes_read": self.bytes["read"],
+                "bytes_written": self.bytes["written"],
+                "budget": self.budget,
+                "by_prefix": {prefix: dict(counts) for prefix, counts in sorted(self.by_prefix.items())},
+            }
+
+
+def get_current_usage():
+    """
+    Get the usage of the current invocation, if it is tracked.
+
+    Returns:
+    - FirestoreUsage: The usage, or None.
+    """
+    return CURRENT_USAGE.get()
+
+
+def in_current_context(function):
+    """
+    Wrap a function run in a worker thread (e.g. `executor.submit(in_current_context(function), ...)`) so that
+    it runs in a copy of the current context, and its Firestore operations count into the current invocation.
+
+    Args:
+    - function (callable): The function.
+
+    Returns:
+    - callable: The wrapped function.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # A context cannot be entered by several threads at once, so every call gets its own copy
+        return context.copy().run(function, *args, **kwargs)
+
+    return wrapper
+
+
+def get_document_size(data):
+    """
+    Estimate the size of a document from its JSON encoding.
+    """
+    if not data:
+        return 0
+    return len(json.dumps(data, default=str))
+
+
+def record(operation, path, count=1, num_bytes=0):
+    """
+    Count Firestore operations against the usage of the current invocation, if it is tracked
+    (see `track_firestore_usage`).
+
+    Args:
+    - operation (str): "reads", "writes" or "deletes".
+    - path (str): The path of the document or collection.
+    - count (int): The number of operations.
+    - num_bytes (int): The size of the documents read or written.
+    """
+    usage = get_current_usage()
+    if usage is not None:
+        usage.record(operation, path, count, num_bytes)
+
+
+# Nested calls (e.g. a document `get` through `get_all`, in older versions of google-cloud-firestore)
+# are only counted at the outermost one
+NESTING = threading.local()
+
+
+def counted(function):
+    """
+    Wrap a Firestore client method so that it is only counted when it is not called by another counted method.
+    The wrapper receives `outermost` to know whether to count.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        depth = getattr(NESTING, "depth", 0)
+        NESTING.depth = depth + 1
+        try:
+            return function(*args, outermost=depth == 0, **kwargs)
+        finally:
+            NESTING.depth = depth
+
+    return wrapper
+
+
+def count_stream(snapshots, path, outermost):
+    """
+    Count the documents of a query as they are streamed. An empty query is billed as one read.
+    """
+    num_snapshots = 0
+    for snapshot in snapshots:
+        num_snapshots += 1
+        if outermost:
+            record("reads", path, num_bytes=get_document_size(snapshot.to_dict()))
+        yield snapshot
+    if outermost and num_snapshots == 0:
+        record("reads", path)
+
+
+def count_writes(write_pbs):
+    """
+    Count the writes and deletes of a batch or transaction before it is committed.
+    """
+    for write_pb in write_pbs:
+        raw_pb = type(write_pb).pb(write_pb)
+        if raw_pb.WhichOneof("operation") == "delete":
+            record("deletes", raw_pb.delete)
+        else:
+            name = raw_pb.update.name if raw_pb.HasField("update") else raw_pb.transform.document
+            record("writes", name, num_bytes=raw_pb.ByteSize())
+
+
+def install_usage_tracking():
+    """
+    Count the operations of every Firestore client of the process (the shared one and those of
+    `gcp_pal.Firestore`), by wrapping the methods of google-cloud-firestore which send them.
+    Idempotent. Does nothing if google-cloud-firestore is not installed.
+
+    Returns:
+    - bool: True if the operations are counted.
+    """
+    global INSTALLED
+    with INSTALL_LOCK:
+        if INSTALLED:
+            return True
+        try:
+            from google.cloud.firestore_v1 import batch, client, collection, document, query
+            from google.cloud.firestore_v1 import transaction
+        except ImportError as e:
+            log(f"Firestore usage tracking is unavailable: {e}")
+            return False
+
+        get_document = document.DocumentReference.get
+        delete_document = document.DocumentReference.delete
+        stream_query = query.Query.stream
+        get_all = client.Client.get_all
+        list_documents = collection.CollectionReference.list_documents
+        commit_batch = batch.WriteBatch.commit
+        commit_transaction = transaction.Transaction._commit
+
+        @counted
+        def get(self, *args, outermost, **kwargs):
+            snapshot = get_document(self, *args, **kwargs)
+            if outermost:
+                record("reads", self.path, num_bytes=get_document_size(snapshot.to_dict()))
+            return snapshot
+
+        @counted
+        def delete(self, *args, outermost, **kwargs):
+            if outermost:
+                record("deletes", self.path)
+            return delete_document(self, *args, **kwargs)
+
+        @counted
+        def stream(self, *args, outermost, **kwargs):
+            snapshots = stream_query(self, *args, **kwargs)
+            if kwargs.get("explain_options") is not None:
+                # Keep the stream generator, which holds the explain metrics
+                return snapshots
+            return count_stream(snapshots, "/".join(self._parent._path), outermost)
+
+        @counted
+        def get_all_documents(self, references, *args, outermost, **kwargs):
+            references = list(references)
+            path = references[0].path if references else ""
+            return count_stream(get_all(self, references, *args, **kwargs), path, outermost)
+
+        @counted
+        def list_all_documents(self, *args, outermost, **kwargs):
+            references = list(list_documents(self, *args, **kwargs))
+            if outermost:
+                record("reads", "/".join(self._path), count=max(len(references), 1))
+            return iter(references)
+
+        def commit(self, *args, **kwargs):
+            count_writes(self._write_pbs)
+            return commit_batch(self, *args, **kwargs)
+
+        def _commit(self, *args, **kwargs):
+            count_writes(self._write_pbs)
+            return commit_transaction(self, *args, **kwargs)
+
+        document.DocumentReference.get = get
+        document.DocumentReference.delete = delete
+        query.Query.stream = stream
+        client.Client.get_all = get_all_documents
+        collection.CollectionReference.list_documents = list_all_documents
+        batch.WriteBatch.commit = commit
+        transaction.Transaction._commit = _commit
+        INSTALLED = True
+        return True
+
+
+def get_op_budget(name):
+    """
+    Get the maximum number of Firestore operations of an invocation, from the env variable `FIRESTORE_OP_BUDGET`:
+    a number for every task, or a JSON object per task (e.g. `{"location": 500, "compact": 20000}`).
+
+    Args:
+    - name (str): The name of the invocation (e.g. the task).
+
+    Returns:
+    - int: The budget, or None if there is none.
+    """
+    budget = os.getenv("FIRESTORE_OP_BUDGET")
+    if not budget:
+        return None
+    budget = json.loads(budget)
+    if isinstance(budget, dict):
+        budget = budget.get(name)
+    return None if budget is None else int(budget)
+
+
+def format_usage(usage):
+    """
+    Format the usage of an invocation for the logs.
+    """
+    summary = usage.summary()
+    prefixes = ", ".join(
+        f"{prefix} {counts['reads']}/{counts['writes']}/{counts['deletes']}"
+        for prefix, counts in summary["by_prefix"].items()
+    )
+    return (
+        f"Firestore usage of {usage.name}: {summary['reads']} reads, {summary['writes']} writes, "
+        f"{summary['deletes']} deletes ({summary['bytes_read'] / 1024:.1f} kB read, "
+        f"{summary['bytes_written'] / 1024:.1f} kB written). Reads/writes/deletes by path: {prefixes or '-'}."
+    )
+
+
+@contextlib.contextmanager
+def track_firestore_usage(name, budget=None):
+    """
+    Count the Firestore operations of an invocation (see `install_usage_tracking`) and log them at the end.
+
+    Args:
+    - name (str): The name of the invocation (e.g. the task).
+    - budget (int): The maximum number of operations. Defaults to `get_op_budget(name)`.
+
+    Yields:
+    - FirestoreUsage: The usage, whose `summary()` can be added to the response.
+    """
+    install_usage_tracking()
+    usage = FirestoreUsage(name, budget if budget is not None else get_op_budget(name))
+    token = CURRENT_USAGE.set(usage)
+    try:
+        yield usage
+    finally:
+        CURRENT_USAGE.reset(token)
+        log(format_usage(usage))
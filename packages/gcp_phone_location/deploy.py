@@ -1,7 +1,12 @@
 from gcp_pal import CloudFunctions
 from gcp_pal.utils import log
 
-from packages.gcp_phone_location.schedule import schedule_service
+from packages.gcp_phone_location.schedule import (
+    schedule_service,
+    schedule_reschedule,
+    schedule_forecast_prefetch,
+    schedule_compaction,
+)
 
 
 def deploy_cloud_function():
@@ -30,4 +35,10 @@ def deploy_phone_location():
     deploy_cloud_function()
     print("Scheduling service...")
     status = schedule_service()
+    schedule_reschedule()
+    schedule_forecast_prefetch()
+    try:
+        schedule_compaction()
+    except ValueError as e:
+        log(f"The compaction is not scheduled: {e}")
     return status
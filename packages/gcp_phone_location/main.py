@@ -1,17 +1,28 @@
+import os
 from gcp_pal.utils import log
 
 from packages.gcp_phone_location.src.location import (
     get_current_location,
     store_location,
+    sync_location_history,
 )
 
 
-def main():
+def main(sync=None):
     """
     Obtains the most recent location data and stores it in Firestore.
+
+    Args:
+    - sync (bool): If True, store every point recorded since the last run (and backfill any gaps)
+      instead of only the current location. Defaults to the env variable `FOLLOWMEE_SYNC_HISTORY` or True.
     """
-    location_data = get_current_location()
-    result = store_location(location_data)
+    if sync is None:
+        sync = os.getenv("FOLLOWMEE_SYNC_HISTORY", "true").lower() == "true"
+    if sync:
+        result = sync_location_history()
+    else:
+        location_data = get_current_location()
+        result = store_location(location_data)
     if result is True:
         log("Location data stored successfully.")
     else:
@@ -19,5 +30,46 @@ def main():
     return {"status": "success"}
 
 
+def main_reschedule():
+    """
+    Move the schedule of the weather service to the new time zone of the device once it has settled
+    (see `reschedule_on_time_zone_change`). It runs on the Cloud Function, so that the weather service
+    is not woken up just to check.
+
+    Returns:
+    - dict: A dictionary containing the response.
+    """
+    from packages.gcp_phone_weather.schedule import apply_pending_reschedule
+
+    outcome = apply_pending_reschedule()
+    return {"status": "success", "outcome": outcome}
+
+
+def main_prefetch():
+    """
+    Prefetch the weather forecasts requested when the devices moved (see `request_prefetch_if_moved`).
+
+    Returns:
+    - dict: A dictionary containing the response.
+    """
+    from packages.gcp_phone_weather.src.prefetch import prefetch_requested_forecasts
+
+    outcomes = prefetch_requested_forecasts()
+    return {"status": "success", "outcomes": outcomes}
+
+
+def main_compact():
+    """
+    Downsample the old location data of every device to the retention tiers, archiving the raw points first.
+
+    Returns:
+    - dict: A dictionary containing the response.
+    """
+    from packages.gcp_phone_location.src.compaction import compact_all_devices
+
+    summaries = compact_all_devices()
+    return {"status": "success", "summaries": summaries}
+
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,7 @@
 from gcp_pal import CloudScheduler, CloudFunctions
 
+from packages.gcp_phone_location.src.compaction import get_archive_root
+
 
 def schedule_service():
     """
@@ -21,5 +23,67 @@ def schedule_service():
     return status
 
 
+def schedule_reschedule():
+    """
+    Schedules the rescheduling of the weather service every 15 minutes (see `apply_pending_reschedule`).
+    It runs on the Cloud Function rather than with every location poll, and does nothing but one
+    Firestore read unless the time zone of the device changed.
+
+    Returns:
+    - str: The status of the Cloud Scheduler job.
+    """
+    cloud_function_uri = CloudFunctions("phone-location").uri()
+    CloudScheduler("phone-location-reschedule").create(
+        schedule="*/15 * * * *",
+        time_zone="UTC",
+        payload={},
+        target=f"{cloud_function_uri}?task=reschedule",
+        service_account="DEFAULT",
+    )
+    status = CloudScheduler("phone-location-reschedule").status()
+    return status
+
+
+def schedule_forecast_prefetch():
+    """
+    Schedules the prefetch of the requested weather forecasts every 15 minutes
+    (see `prefetch_requested_forecasts`), so that the location polls only record the requests.
+
+    Returns:
+    - str: The status of the Cloud Scheduler job.
+    """
+    cloud_function_uri = CloudFunctions("phone-location").uri()
+    CloudScheduler("phone-location-prefetch").create(
+        schedule="*/15 * * * *",
+        time_zone="UTC",
+        payload={},
+        target=f"{cloud_function_uri}?task=prefetch",
+        service_account="DEFAULT",
+    )
+    status = CloudScheduler("phone-location-prefetch").status()
+    return status
+
+
+def schedule_compaction():
+    """
+    Schedules the compaction of the old location data every day at 3:30 AM (UTC).
+    Requires the archive bucket to be configured (`LOCATION_ARCHIVE_PATH`, see `get_archive_root`).
+
+    Returns:
+    - str: The status of the Cloud Scheduler job.
+    """
+    get_archive_root()
+    cloud_function_uri = CloudFunctions("phone-location").uri()
+    CloudScheduler("phone-location-compaction").create(
+        schedule="30 3 * * *",
+        time_zone="UTC",
+        payload={},
+        target=f"{cloud_function_uri}?task=compact",
+        service_account="DEFAULT",
+    )
+    status = CloudScheduler("phone-location-compaction").status()
+    return status
+
+
 if __name__ == "__main__":
     schedule_service()
@@ -1,5 +1,19 @@
 import os
-from gcp_pal import Firestore
+from gcp_pal.utils import log
+
+from packages.firestore import get_client, get_collection, get_document, get_firestore
+from packages.firestore_usage import track_firestore_usage
+
+from packages.gcp_phone_location.src.location import (
+    LAST_UPDATED_TIME_PATH,
+    MAX_BATCH_SIZE,
+    convert_time_to_epoch,
+    make_last_updated_time,
+)
+from packages.gcp_phone_location.src.aggregates import (
+    update_daily_aggregates,
+    write_daily_aggregates,
+)
 
 
 def add_date_device_id_to_location(device_id=None):
@@ -16,10 +30,81 @@ def add_date_device_id_to_location(device_id=None):
     """
     if device_id is None:
         device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
-    col_ref = Firestore(f"device_locations/devices/{device_id}").read()
+    col_ref = get_firestore(f"device_locations/devices/{device_id}").read()
+    client = get_client()
     for date, doc in col_ref.items():
         doc["Date"] = date
         doc["DeviceID"] = device_id
-        Firestore(f"device_locations/devices/{device_id}/{date}").write(doc)
+        client.document(f"device_locations/devices/{device_id}/{date}").set(doc)
 
     return True
+
+
+def add_epoch_to_location(device_id=None, batch_size=MAX_BATCH_SIZE):
+    """
+    Older entries in Firestore do not have the `Epoch` field (the UTC epoch of `Date`), which is
+    needed for range queries and sorting. This function adds it to every location of the device
+    which does not have it yet, in batched updates, and adds it to the watermark too.
+
+    Args:
+    - device_id (str): The device ID to add the epoch to the location data for.
+    - batch_size (int): The maximum number of updates per batch.
+
+    Returns:
+    - int: The number of locations which were updated.
+    """
+    if device_id is None:
+        device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
+    client = get_client()
+    col_ref = get_collection(f"device_locations/devices/{device_id}")
+    batch = client.batch()
+    pending = 0
+    updated = 0
+    for doc in col_ref.stream():
+        doc_dict = doc.to_dict()
+        if "Epoch" in doc_dict:
+            continue
+        epoch = convert_time_to_epoch(doc_dict.get("Date", doc.id))
+        batch.update(doc.reference, {"Epoch": epoch})
+        pending += 1
+        if pending == batch_size:
+            batch.commit()
+            updated += pending
+            batch = client.batch()
+            pending = 0
+    if pending > 0:
+        batch.commit()
+        updated += pending
+
+    last_updated_time_path = LAST_UPDATED_TIME_PATH.format(device_id=device_id)
+    last_updated_time = get_firestore(last_updated_time_path).read(allow_empty=True)
+    if last_updated_time != {}:
+        watermark = make_last_updated_time(last_updated_time)
+        get_document(last_updated_time_path).set(watermark)
+    log(f"Added the epoch to {updated} locations of device {device_id}.")
+    return updated
+
+
+def backfill_daily_aggregates(device_id=None):
+    """
+    Older locations were stored before the daily aggregates were maintained (see `update_daily_aggregates`).
+    This function rebuilds the aggregates of every day from the stored locations of the device.
+    Run it before the compaction thins out the old days, and while no locations are being stored.
+    Its Firestore usage is logged at the end (one read per stored location).
+
+    Args:
+    - device_id (str): The device ID to rebuild the daily aggregates for.
+
+    Returns:
+    - int: The number of daily aggregates which were written.
+    """
+    if device_id is None:
+        device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
+    col_ref = get_collection(f"device_locations/devices/{device_id}")
+    aggregates = {}
+    previous = None
+    with track_firestore_usage("backfill_daily_aggregates"):
+        for doc in col_ref.order_by("Epoch").stream():
+            updated = update_daily_aggregates(aggregates, [doc.to_dict()], previous)
+            previous = next(iter(updated.values()))
+        return write_daily_aggregates(device_id, aggregates)
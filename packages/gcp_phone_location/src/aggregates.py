@@ -0,0 +1,250 @@
+import os
+import math
+from gcp_pal.utils import log
+
+from packages.firestore import get_client, get_collection
+
+DAILY_AGGREGATES_PATH = "device_locations/daily/{device_id}"
+EARTH_RADIUS_M = 6_371_000
+# Moves shorter than this (from the last counted point) are GPS jitter, not distance travelled
+MIN_MOVE_M = 25
+# A device is moving between two consecutive fixes if it went at least this fast (walking is ~1.4 m/s)
+MOVING_SPEED_MPS = 1.0
+# Consecutive fixes further apart than this do not count as time moving (the device was off)
+MAX_MOVING_GAP_S = 30 * 60
+# The fields which carry the running distance over to the next point (and the next day)
+CARRIED_FIELDS = ("last_epoch", "last_latitude", "last_longitude", "anchor_latitude", "anchor_longitude")
+
+
+def is_aggregation_enabled():
+    """
+    Check whether the daily aggregates are maintained when locations are stored.
+
+    Returns:
+    - bool: The env variable `LOCATION_AGGREGATES` is not "false".
+    """
+    return os.getenv("LOCATION_AGGREGATES", "true").lower() == "true"
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """
+    Compute the great-circle distance between two points (scalar version of `analysis.haversine`).
+
+    Returns:
+    - float: The distance in metres.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def get_day(location):
+    """
+    Get the local date of a location data point (its `Date` carries the local offset).
+
+    Args:
+    - location (dict): The location data point.
+
+    Returns:
+    - str: The local date (e.g. '2024-05-28').
+    """
+    return location["Date"][:10]
+
+
+def make_daily_aggregate(day):
+    """
+    Make the empty aggregate of a day. Schema:
+        - day (str): The local date.
+        - num_fixes (int): The number of location data points.
+        - distance_m (float): The distance travelled in metres (moves shorter than `MIN_MOVE_M` are ignored).
+        - moving_s (int): The time spent moving in seconds (see `MOVING_SPEED_MPS`).
+        - min_latitude, max_latitude, min_longitude, max_longitude (float): The bounding box.
+        - first_epoch, last_epoch (int): The UTC epochs of the first and last points.
+        - last_latitude, last_longitude (float): The last point, to continue the aggregates.
+        - anchor_latitude, anchor_longitude (float): The last point counted in the distance.
+
+    Args:
+    - day (str): The local date.
+
+    Returns:
+    - dict: The aggregate.
+    """
+    return {
+        "day": day,
+        "num_fixes": 0,
+        "distance_m": 0.0,
+        "moving_s": 0,
+        "min_latitude": None,
+        "max_latitude": None,
+        "min_longitude": None,
+        "max_longitude": None,
+        "first_epoch": None,
+        "last_epoch": None,
+        "last_latitude": None,
+        "last_longitude": None,
+        "anchor_latitude": None,
+        "anchor_longitude": None,
+    }
+
+
+def update_daily_aggregates(aggregates, locations, previous=None):
+    """
+    Add location data points to the daily aggregates, with a running distance, bounds and counts.
+    The move from the previous point is counted in the day of the new point.
+
+    Args:
+    - aggregates (dict): The existing aggregates keyed by day (updated in place).
+    - locations (list): The new location data points with their `Epoch`, sorted by time.
+    - previous (dict): The aggregate holding the point before `locations` (its `last_*` and `anchor_*`),
+      or None if there is none.
+
+    Returns:
+    - dict: The aggregates of the days of `locations`.
+    """
+    state = None
+    if previous and previous.get("last_epoch") is not None:
+        state = {key: previous[key] for key in CARRIED_FIELDS}
+    updated = {}
+    for location in locations:
+        day = get_day(location)
+        aggregate = aggregates.get(day) or make_daily_aggregate(day)
+        aggregates[day] = updated[day] = aggregate
+        epoch = location["Epoch"]
+        latitude, longitude = float(location["Latitude"]), float(location["Longitude"])
+        if state is None:
+            state = {"anchor_latitude": latitude, "anchor_longitude": longitude}
+        else:
+            gap_s = epoch - state["last_epoch"]
+            step_m = distance_m(state["last_latitude"], state["last_longitude"], latitude, longitude)
+            if 0 < gap_s <= MAX_MOVING_GAP_S and step_m >= MOVING_SPEED_MPS * gap_s:
+                aggregate["moving_s"] += gap_s
+            move_m = distance_m(state["anchor_latitude"], state["anchor_longitude"], latitude, longitude)
+            if move_m >= MIN_MOVE_M:
+                aggregate["distance_m"] += move_m
+                state["anchor_latitude"], state["anchor_longitude"] = latitude, longitude
+        state.update(last_epoch=epoch, last_latitude=latitude, last_longitude=longitude)
+
+        aggregate["num_fixes"] += 1
+        if aggregate["first_epoch"] is None:
+            aggregate.update(
+                first_epoch=epoch,
+                min_latitude=latitude,
+                max_latitude=latitude,
+                min_longitude=longitude,
+                max_longitude=longitude,
+            )
+        aggregate["min_latitude"] = min(aggregate["min_latitude"], latitude)
+        aggregate["max_latitude"] = max(aggregate["max_latitude"], latitude)
+        aggregate["min_longitude"] = min(aggregate["min_longitude"], longitude)
+        aggregate["max_longitude"] = max(aggregate["max_longitude"], longitude)
+        aggregate.update(state)
+    return updated
+
+
+def get_daily_aggregate_ref(device_id, day):
+    """
+    Get the reference to the aggregate document of a device for a day.
+
+    Args:
+    - device_id (str): The device ID.
+    - day (str): The local date.
+
+    Returns:
+    - google.cloud.firestore.DocumentReference: The reference.
+    """
+    return get_client().document(f"{DAILY_AGGREGATES_PATH.format(device_id=device_id)}/{day}")
+
+
+def read_daily_aggregates_for_commit(transaction, device_id, last_updated_time, locations):
+    """
+    Read, in a transaction, the aggregates which new location data points update:
+    the days of the points and the day of the previous point (the watermark).
+
+    Args:
+    - transaction (google.cloud.firestore.Transaction): The transaction.
+    - device_id (str): The device ID.
+    - last_updated_time (str): The time of the last stored location (the watermark).
+    - locations (list): The new location data points.
+
+    Returns:
+    - tuple: The aggregates keyed by day, and the aggregate of the previous point (or None).
+    """
+    previous_day = last_updated_time[:10] if last_updated_time else None
+    days = ({get_day(location) for location in locations} | {previous_day}) - {None}
+    aggregates = {}
+    for day in sorted(days):
+        snapshot = get_daily_aggregate_ref(device_id, day).get(transaction=transaction)
+        if snapshot.exists:
+            aggregates[day] = snapshot.to_dict()
+    return aggregates, aggregates.get(previous_day)
+
+
+def read_daily_aggregates(device_id, start_day=None, end_day=None):
+    """
+    Read the daily aggregates of a device between two local dates: one small document per day.
+
+    Args:
+    - device_id (str): The device ID.
+    - start_day (str): The first local date (e.g. '2024-05-28'). Defaults to the first day.
+    - end_day (str): The last local date. Defaults to the last day.
+
+    Returns:
+    - list: The aggregates (see `make_daily_aggregate`), sorted by day.
+    """
+    query = get_collection(DAILY_AGGREGATES_PATH.format(device_id=device_id))
+    if start_day is not None:
+        query = query.where("day", ">=", start_day)
+    if end_day is not None:
+        query = query.where("day", "<=", end_day)
+    return [snapshot.to_dict() for snapshot in query.order_by("day").get()]
+
+
+def summarise_daily_aggregates(aggregates):
+    """
+    Combine daily aggregates into the summary of a range of days.
+
+    Args:
+    - aggregates (list): The daily aggregates (see `make_daily_aggregate`).
+
+    Returns:
+    - dict: The number of days, fixes, the distance in metres, the time moving in seconds and the bounding box.
+    """
+    aggregates = [aggregate for aggregate in aggregates if aggregate["num_fixes"] > 0]
+    if not aggregates:
+        return {"days": 0, "num_fixes": 0, "distance_m": 0.0, "moving_s": 0}
+    return {
+        "days": len(aggregates),
+        "num_fixes": sum(aggregate["num_fixes"] for aggregate in aggregates),
+        "distance_m": sum(aggregate["distance_m"] for aggregate in aggregates),
+        "moving_s": sum(aggregate["moving_s"] for aggregate in aggregates),
+        "min_latitude": min(aggregate["min_latitude"] for aggregate in aggregates),
+        "max_latitude": max(aggregate["max_latitude"] for aggregate in aggregates),
+        "min_longitude": min(aggregate["min_longitude"] for aggregate in aggregates),
+        "max_longitude": max(aggregate["max_longitude"] for aggregate in aggregates),
+    }
+
+
+def write_daily_aggregates(device_id, aggregates, batch_size=500):
+    """
+    Write daily aggregates (e.g. rebuilt from the history) in batches.
+
+    Args:
+    - device_id (str): The device ID.
+    - aggregates (dict): The aggregates keyed by day.
+    - batch_size (int): The maximum number of writes per batch.
+
+    Returns:
+    - int: The number of aggregates written.
+    """
+    client = get_client()
+    days = sorted(aggregates)
+    for i in range(0, len(days), batch_size):
+        batch = client.batch()
+        for day in days[i : i + batch_size]:
+            batch.set(get_daily_aggregate_ref(device_id, day), aggregates[day])
+        batch.commit()
+    log(f"Wrote {len(days)} daily aggregates for device {device_id}.")
+    return len(days)
@@ -0,0 +1,284 @@
+import bisect
+import numpy as np
+import pandas as pd
+
+from packages.gcp_phone_location.src.location import convert_time_to_epoch
+
+EARTH_RADIUS_M = 6_371_000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Compute the great-circle distance between two (arrays of) points.
+
+    Args:
+    - lat1 (float or np.ndarray): The latitude of the first point(s) in degrees.
+    - lon1 (float or np.ndarray): The longitude of the first point(s) in degrees.
+    - lat2 (float or np.ndarray): The latitude of the second point(s) in degrees.
+    - lon2 (float or np.ndarray): The longitude of the second point(s) in degrees.
+
+    Returns:
+    - float or np.ndarray: The distance(s) in metres.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def to_history_frame(history):
+    """
+    Convert the exported location history to a DataFrame sorted by time.
+
+    Args:
+    - history (pd.DataFrame or dict): The exported history, either the CSV file loaded as a DataFrame
+      or the output of `export_locations`.
+
+    Returns:
+    - pd.DataFrame: The history with numeric `Epoch`, `Latitude` and `Longitude` columns.
+    """
+    if isinstance(history, dict):
+        history = pd.DataFrame(list(history.values()))
+    df = history.dropna(subset=["Latitude", "Longitude"]).copy()
+    if "Epoch" not in df.columns:
+        df["Epoch"] = df["Date"].apply(convert_time_to_epoch)
+    df = df.astype({"Epoch": "int64", "Latitude": "float64", "Longitude": "float64"})
+    df = df.sort_values("Epoch", kind="stable").reset_index(drop=True)
+    return df
+
+
+def get_stay_extents(latitudes, longitudes, radius_m, max_offset=16):
+    """
+    For every point, find the first later point which is farther than `radius_m` from it,
+    looking at most `max_offset` points ahead. All the points are advanced together one offset at a time,
+    so the work is vectorised and only the points still within the radius are carried to the next offset.
+
+    Args:
+    - latitudes (np.ndarray): The latitudes of the points sorted by time.
+    - longitudes (np.ndarray): The longitudes of the points sorted by time.
+    - radius_m (float): The radius in metres.
+    - max_offset (int): How many points ahead to look at most.
+
+    Returns:
+    - np.ndarray: For every point i, the index j of the first point after i farther than the radius
+      (or the number of points if there is none). Points i..j-1 are all within the radius of i.
+      -1 if all the next `max_offset` points are within the radius (use `get_stay_extent`).
+    """
+    n = len(latitudes)
+    extents = np.full(n, -1, dtype=np.int64)
+    active = np.arange(n, dtype=np.int64)
+    for offset in range(1, max_offset + 1):
+        reached_end = active + offset >= n
+        extents[active[reached_end]] = n
+        active = active[~reached_end]
+        if active.size == 0:
+            break
+        following = active + offset
+        distances = haversine(
+            latitudes[active],
+            longitudes[active],
+            latitudes[following],
+            longitudes[following],
+        )
+        left = distances > radius_m
+        extents[active[left]] = following[left]
+        active = active[~left]
+    return extents
+
+
+def get_stay_extent(latitudes, longitudes, radius_m, start, chunk_size=64):
+    """
+    Find the first point after `start` which is farther than `radius_m` from it.
+    The distances are computed in vectorised chunks which double in size.
+
+    Args:
+    - latitudes (np.ndarray): The latitudes of the points sorted by time.
+    - longitudes (np.ndarray): The longitudes of the points sorted by time.
+    - radius_m (float): The radius in metres.
+    - start (int): The index of the first point.
+    - chunk_size (int): The size of the first chunk.
+
+    Returns:
+    - int: The index of the first point farther than the radius (or the number of points if there is none).
+    """
+    n = len(latitudes)
+    chunk_start = start + 1
+    while chunk_start < n:
+        chunk_end = min(chunk_start + chunk_size, n)
+        distances = haversine(
+            latitudes[start],
+            longitudes[start],
+            latitudes[chunk_start:chunk_end],
+            longitudes[chunk_start:chunk_end],
+        )
+        left = np.flatnonzero(distances > radius_m)
+        if left.size > 0:
+            return chunk_start + int(left[0])
+        chunk_start = chunk_end
+        chunk_size *= 2
+    return n
+
+
+def detect_stay_points(history, radius_m=100, min_duration_s=15 * 60):
+    """
+    Find the stay points: places where the device stayed within `radius_m` for at least `min_duration_s`.
+
+    Args:
+    - history (pd.DataFrame or dict): The exported location history (see `to_history_frame`).
+    - radius_m (float): The maximum distance in metres from the first point of the stay.
+    - min_duration_s (float): The minimum duration of the stay in seconds.
+
+    Returns:
+    - pd.DataFrame: One row per stay point. Schema:
+        - Latitude (float): The mean latitude of the points of the stay.
+        - Longitude (float): The mean longitude of the points of the stay.
+        - ArrivalEpoch (int): The UTC epoch of the first point of the stay.
+        - DepartureEpoch (int): The UTC epoch of the last point of the stay.
+        - ArrivalDate (str): The `Date` of the first point of the stay (if available).
+        - DepartureDate (str): The `Date` of the last point of the stay (if available).
+        - Duration (int): The duration of the stay in seconds.
+        - NumPoints (int): The number of location points in the stay.
+    """
+    df = to_history_frame(history)
+    columns = [
+        "Latitude",
+        "Longitude",
+        "ArrivalEpoch",
+        "DepartureEpoch",
+        "ArrivalDate",
+        "DepartureDate",
+        "Duration",
+        "NumPoints",
+    ]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    latitudes = df["Latitude"].to_numpy()
+    longitudes = df["Longitude"].to_numpy()
+    epochs = df["Epoch"].to_numpy()
+
+    # Most points (on the move) leave the radius quickly: find those in bulk
+    extents = get_stay_extents(latitudes, longitudes, radius_m)
+    known = extents >= 0
+    durations = np.zeros(len(df), dtype=np.int64)
+    durations[known] = epochs[extents[known] - 1] - epochs[known]
+    candidates = np.flatnonzero(~known | (durations >= min_duration_s)).tolist()
+
+    # Single linear sweep: take the earliest stay, then skip to the first candidate after it
+    starts, ends = [], []
+    position = 0
+    while position < len(candidates):
+        start = candidates[position]
+        end = int(extents[start])
+        if end < 0:
+            end = get_stay_extent(latitudes, longitudes, radius_m, start)
+            if epochs[end - 1] - epochs[start] < min_duration_s:
+                position += 1
+                continue
+        starts.append(start)
+        ends.append(end)
+        position = bisect.bisect_left(candidates, end, lo=position + 1)
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+
+    # Mean position of every stay from cumulative sums
+    cum_latitudes = np.concatenate([[0.0], np.cumsum(latitudes)])
+    cum_longitudes = np.concatenate([[0.0], np.cumsum(longitudes)])
+    num_points = ends - starts
+    dates = df["Date"].to_numpy() if "Date" in df.columns else None
+    stay_points = pd.DataFrame(
+        {
+            "Latitude": (cum_latitudes[ends] - cum_latitudes[starts]) / num_points,
+            "Longitude": (cum_longitudes[ends] - cum_longitudes[starts]) / num_points,
+            "ArrivalEpoch": epochs[starts],
+            "DepartureEpoch": epochs[ends - 1],
+            "ArrivalDate": dates[starts] if dates is not None else None,
+            "DepartureDate": dates[ends - 1] if dates is not None else None,
+            "Duration": epochs[ends - 1] - epochs[starts],
+            "NumPoints": num_points,
+        },
+        columns=columns,
+    )
+    return stay_points
+
+
+def cluster_stay_points(stay_points, radius_m=200, known_places=None):
+    """
+    Cluster the repeated stays into places. Stays are assigned greedily, longest first,
+    to the place around the longest unassigned stay.
+
+    Args:
+    - stay_points (pd.DataFrame): The output of `detect_stay_points`.
+    - radius_m (float): The maximum distance in metres of a stay from the centre of its place.
+    - known_places (dict): Names of known places, e.g. `{"Home": (51.5, -0.12)}`. Every known place names
+      the closest place within `radius_m` (at most one), the others are "Place N" (by total time spent).
+
+    Returns:
+    - tuple: The stay points with an added `Place` column, and the places. Schema of the places:
+        - Place (str): The name of the place.
+        - Latitude (float): The duration-weighted mean latitude of the stays.
+        - Longitude (float): The duration-weighted mean longitude of the stays.
+        - Visits (int): The number of stays at the place.
+        - TotalDuration (int): The total time spent at the place in seconds.
+    """
+    stay_points = stay_points.copy()
+    place_columns = ["Place", "Latitude", "Longitude", "Visits", "TotalDuration"]
+    if stay_points.empty:
+        stay_points["Place"] = pd.Series(dtype=str)
+        return stay_points, pd.DataFrame(columns=place_columns)
+    latitudes = stay_points["Latitude"].to_numpy(dtype=float)
+    longitudes = stay_points["Longitude"].to_numpy(dtype=float)
+    durations = stay_points["Duration"].to_numpy(dtype=float)
+
+    labels = np.full(len(stay_points), -1, dtype=np.int64)
+    num_places = 0
+    for index in np.argsort(-durations, kind="stable"):
+        if labels[index] >= 0:
+            continue
+        distances = haversine(latitudes[index], longitudes[index], latitudes, longitudes)
+        labels[(distances <= radius_m) & (labels < 0)] = num_places
+        num_places += 1
+
+    # Duration-weighted centres (+1s so that zero-length stays still count)
+    weights = durations + 1
+    total_weights = np.bincount(labels, weights=weights)
+    places = pd.DataFrame(
+        {
+            "Latitude": np.bincount(labels, weights=latitudes * weights) / total_weights,
+            "Longitude": np.bincount(labels, weights=longitudes * weights)
+            / total_weights,
+            "Visits": np.bincount(labels),
+            "TotalDuration": np.bincount(labels, weights=durations).astype(np.int64),
+        }
+    )
+    order = np.argsort(-places["TotalDuration"].to_numpy(), kind="stable")
+    names = np.empty(num_places, dtype=object)
+    names[order] = [f"Place {rank + 1}" for rank in range(num_places)]
+
+    if known_places:
+        # Closest pairs first, so that every known place names at most one place (its closest), and
+        # every place takes at most one name (its closest known place that is not taken)
+        known_names = list(known_places)
+        known_coordinates = np.array(list(known_places.values()), dtype=float)
+        distances = haversine(
+            places["Latitude"].to_numpy()[:, None],
+            places["Longitude"].to_numpy()[:, None],
+            known_coordinates[None, :, 0],
+            known_coordinates[None, :, 1],
+        )
+        named_places, used_names = set(), set()
+        for flat_index in np.argsort(distances, axis=None, kind="stable"):
+            place, known = np.unravel_index(flat_index, distances.shape)
+            if distances[place, known] > radius_m:
+                break
+            if place in named_places or known in used_names:
+                continue
+            names[place] = known_names[known]
+            named_places.add(place)
+            used_names.add(known)
+
+    places.insert(0, "Place", names)
+    places = places.iloc[order].reset_index(drop=True)
+    stay_points["Place"] = names[labels]
+    return stay_points, places[place_columns]
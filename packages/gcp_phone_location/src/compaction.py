@@ -0,0 +1,311 @@
+import os
+import json
+import gzip
+from datetime import datetime, timedelta, timezone
+from gcp_pal.utils import log
+
+from packages.firestore import get_client, get_collection, get_document
+from packages.gcp_phone_location.src.location import MAX_BATCH_SIZE
+
+# From the finest to the coarsest: full resolution until the first tier applies
+DEFAULT_RETENTION_TIERS = [
+    {"after_days": 90, "interval_s": 600},
+    {"after_days": 365, "stay_points": True},
+]
+COMPACTION_STATE_PATH = "device_locations/compaction/{device_id}/state"
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_retention_tiers():
+    """
+    Get the retention tiers, from the env variable `LOCATION_RETENTION_TIERS` (JSON list) or the defaults.
+    Every tier applies to the days older than `after_days`, and either keeps one point per `interval_s`
+    seconds or, with `stay_points`, only the arrival and departure of every stay point.
+
+    Returns:
+    - list: The tiers sorted by `after_days`.
+    """
+    tiers = os.getenv("LOCATION_RETENTION_TIERS")
+    tiers = json.loads(tiers) if tiers else DEFAULT_RETENTION_TIERS
+    for tier in tiers:
+        if "interval_s" not in tier and not tier.get("stay_points"):
+            raise ValueError(f"Tier {tier} needs an `interval_s` or `stay_points`.")
+    return sorted(tiers, key=lambda tier: tier["after_days"])
+
+
+def get_archive_root():
+    """
+    Get the root of the archives, from the env variable `LOCATION_ARCHIVE_PATH`. It must be a `gs://` bucket
+    prefix: the Cloud Function can only write to /tmp, which does not outlive the instance, so a local
+    archive would be lost (or fail to be written) once the points are deleted.
+
+    Returns:
+    - str: The `gs://` prefix, without a trailing slash.
+    """
+    root = os.getenv("LOCATION_ARCHIVE_PATH", "")
+    if not root.startswith("gs://"):
+        raise ValueError(
+            f"LOCATION_ARCHIVE_PATH must be a gs:// bucket prefix to archive the location data. Got: {root!r}"
+        )
+    return root.rstrip("/")
+
+
+def get_archive_path(device_id, day):
+    """
+    Get the path of the archive of the raw location data of a device for one UTC day
+    (see `get_archive_root`).
+
+    Args:
+    - device_id (str): The device ID.
+    - day (str): The UTC day (e.g. '2024-05-28').
+
+    Returns:
+    - str: The path of the gzipped JSON lines file.
+    """
+    return f"{get_archive_root()}/{device_id}/day={day}.jsonl.gz"
+
+
+def open_archive(path, mode):
+    """
+    Open an archive file in Cloud Storage.
+
+    Args:
+    - path (str): The path of the file (see `get_archive_path`).
+    - mode (str): "rb" or "wb".
+
+    Returns:
+    - file: The file object, or None if the file is opened for reading and does not exist.
+    """
+    from gcp_pal import Storage
+
+    storage = Storage(path)
+    if mode == "rb" and not storage.exists():
+        return None
+    return storage.open(mode)
+
+
+def read_archive(path):
+    """
+    Read an archive file.
+
+    Args:
+    - path (str): The path of the file (see `get_archive_path`).
+
+    Returns:
+    - dict: The archived location documents keyed by document ID.
+    """
+    file = open_archive(path, "rb")
+    if file is None:
+        return {}
+    with file, gzip.open(file, "rt") as lines:
+        return {row["id"]: row["data"] for row in map(json.loads, lines)}
+
+
+def archive_locations(device_id, day, documents):
+    """
+    Merge raw location documents into the archive of their day, and check that they are all in it.
+    Archiving the same documents again (e.g. a re-run, or a coarser tier) is a no-op.
+
+    Args:
+    - device_id (str): The device ID.
+    - day (str): The UTC day of the documents.
+    - documents (dict): The location documents keyed by document ID.
+
+    Returns:
+    - str: The path of the archive.
+    """
+    path = get_archive_path(device_id, day)
+    archived = read_archive(path)
+    # The archive was written first, so it holds the raw version of the points kept so far
+    merged = {**documents, **archived}
+    merged = dict(sorted(merged.items(), key=lambda item: item[1]["Epoch"]))
+    with open_archive(path, "wb") as file, gzip.open(file, "wt") as lines:
+        for document_id, data in merged.items():
+            lines.write(json.dumps({"id": document_id, "data": data}, default=str) + "\n")
+    missing = set(documents) - set(read_archive(path))
+    if missing:
+        raise RuntimeError(f"{len(missing)} documents are missing from the archive {path}.")
+    return path
+
+
+def downsample_locations(documents, tier):
+    """
+    Choose the location documents which a retention tier keeps.
+
+    Args:
+    - documents (dict): The location documents keyed by document ID, sorted by time.
+    - tier (dict): The retention tier (see `get_retention_tiers`).
+
+    Returns:
+    - set: The IDs of the documents to keep.
+    """
+    if not documents:
+        return set()
+    if tier.get("stay_points"):
+        from packages.gcp_phone_location.src.analysis import detect_stay_points
+
+        stay_points = detect_stay_points(dict(documents))
+        epochs = set(stay_points["ArrivalEpoch"]) | set(stay_points["DepartureEpoch"])
+        return {key for key, data in documents.items() if data["Epoch"] in epochs}
+    keep = {}
+    for document_id, data in documents.items():
+        # The first point of every interval
+        keep.setdefault(data["Epoch"] // tier["interval_s"], document_id)
+    return set(keep.values())
+
+
+def read_day(device_id, day_start):
+    """
+    Read all the location documents of a device for one UTC day.
+
+    Args:
+    - device_id (str): The device ID.
+    - day_start (int): The UTC epoch of the start of the day.
+
+    Returns:
+    - tuple: The documents keyed by document ID (sorted by time), and their references.
+    """
+    snapshots = (
+        get_collection(f"device_locations/devices/{device_id}")
+        .where("Epoch", ">=", day_start)
+        .where("Epoch", "<", day_start + SECONDS_PER_DAY)
+        .order_by("Epoch")
+        .get()
+    )
+    documents, references = {}, {}
+    for snapshot in snapshots:
+        documents[snapshot.id] = snapshot.to_dict()
+        references[snapshot.id] = snapshot.reference
+    return documents, references
+
+
+def delete_documents(references, batch_size=MAX_BATCH_SIZE):
+    """
+    Delete Firestore documents in batches.
+
+    Args:
+    - references (list): The references of the documents.
+    - batch_size (int): The maximum number of deletes per batch.
+
+    Returns:
+    - int: The number of deleted documents.
+    """
+    client = get_client()
+    for i in range(0, len(references), batch_size):
+        batch = client.batch()
+        for reference in references[i : i + batch_size]:
+            batch.delete(reference)
+        batch.commit()
+    return len(references)
+
+
+def compact_day(device_id, day_start, tier):
+    """
+    Downsample one UTC day of the location data of a device: archive the raw points first,
+    then delete the points which the tier does not keep.
+
+    Args:
+    - device_id (str): The device ID.
+    - day_start (int): The UTC epoch of the start of the day.
+    - tier (dict): The retention tier (see `get_retention_tiers`).
+
+    Returns:
+    - tuple: The number of points read and deleted.
+    """
+    documents, references = read_day(device_id, day_start)
+    keep = downsample_locations(documents, tier)
+    to_delete = [references[key] for key in documents if key not in keep]
+    if to_delete:
+        day = datetime.fromtimestamp(day_start, timezone.utc).date().isoformat()
+        archive_locations(device_id, day, documents)
+        delete_documents(to_delete)
+    return len(documents), len(to_delete)
+
+
+def get_next_day(device_id, start_epoch=0):
+    """
+    Get the first UTC day with location data of a device from a time on (a single-document read),
+    so that the days without data are skipped.
+
+    Args:
+    - device_id (str): The device ID.
+    - start_epoch (int): The UTC epoch to search from (inclusive).
+
+    Returns:
+    - int: The UTC epoch of the start of the day, or None if there is no location data after `start_epoch`.
+    """
+    col_ref = get_collection(f"device_locations/devices/{device_id}")
+    first = list(col_ref.where("Epoch", ">=", start_epoch).order_by("Epoch").limit(1).get())
+    if not first:
+        return None
+    epoch = first[0].to_dict()["Epoch"]
+    return epoch - epoch % SECONDS_PER_DAY
+
+
+def compact_device(device_id, tiers=None, max_days=None, now=None):
+    """
+    Apply the retention tiers to the location data of a device. The progress of every tier is kept
+    in Firestore, so every day is read once per tier and the days without data are skipped. The coarsest
+    tiers run first, so that the days they cover are not downsampled by the finer tiers in vain.
+    Refuses to run (before anything is deleted) unless the archive is in Cloud Storage (see `get_archive_root`).
+
+    Args:
+    - device_id (str): The device ID.
+    - tiers (list): The retention tiers. Defaults to `get_retention_tiers()`.
+    - max_days (int): The maximum number of days to compact in this run (the rest is left to the next runs).
+      Defaults to the env variable `LOCATION_COMPACTION_MAX_DAYS` or 30.
+    - now (datetime): The current time. Defaults to now.
+
+    Returns:
+    - dict: The number of days compacted and of points read and deleted.
+    """
+    get_archive_root()
+    tiers = tiers or get_retention_tiers()
+    if max_days is None:
+        max_days = int(os.getenv("LOCATION_COMPACTION_MAX_DAYS", 30))
+    now = now or datetime.now(timezone.utc)
+    state_ref = get_document(COMPACTION_STATE_PATH.format(device_id=device_id))
+    # The start of the first day which is not compacted yet, for every tier
+    state = (state_ref.get().to_dict() or {}).get("compacted_until", {})
+    summary = {"days": 0, "read": 0, "deleted": 0}
+    covered_until = 0
+    for index in reversed(range(len(tiers))):
+        tier = tiers[index]
+        cutoff = (now - timedelta(days=tier["after_days"])).timestamp()
+        # Only whole days older than the cutoff
+        cutoff = int(cutoff - cutoff % SECONDS_PER_DAY)
+        day_start = max(state.get(str(index), 0), covered_until)
+        while day_start < cutoff and summary["days"] < max_days:
+            day_start = get_next_day(device_id, day_start)
+            if day_start is None or day_start >= cutoff:
+                day_start = cutoff
+            else:
+                num_read, num_deleted = compact_day(device_id, day_start, tier)
+                summary["days"] += 1
+                summary["read"] += num_read
+                summary["deleted"] += num_deleted
+                day_start += SECONDS_PER_DAY
+            state[str(index)] = day_start
+            state_ref.set({"compacted_until": state})
+        covered_until = max(covered_until, state.get(str(index), 0))
+    log(f"Compacted the location data of device {device_id}: {summary}.")
+    return summary
+
+
+def compact_all_devices(max_days=None):
+    """
+    Apply the retention tiers to the location data of every device.
+
+    Args:
+    - max_days (int): The maximum number of days to compact per device (see `compact_device`).
+
+    Returns:
+    - dict: The summary of every device, keyed by device ID.
+    """
+    from packages.gcp_phone_location.src.export import list_devices
+
+    tiers = get_retention_tiers()
+    return {
+        device_id: compact_device(device_id, tiers, max_days)
+        for device_id in list_devices()
+    }
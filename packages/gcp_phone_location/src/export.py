@@ -3,62 +3,296 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import concurrent.futures
 import pandas as pd
 from gcp_pal import Firestore
+from gcp_pal.utils import log
 
+from packages.firestore_usage import in_current_context
+from packages.gcp_phone_location.src.location import convert_time_to_epoch
+from packages.gcp_phone_location.src.history import (
+    write_history,
+    get_last_history_epoch,
+)
+from packages.gcp_phone_location.src.trajectory import (
+    get_trajectory_path,
+    write_trajectory,
+    get_last_trajectory_epoch,
+)
 
-def export_locations(device_id=None, start_date=None, end_date=None, append=True):
+KEYS_TO_KEEP = ["Date", "Epoch", "Latitude", "Longitude"]
+DEFAULT_START_DATE = "2010-05-28T18:09:53+00:00"
+DEFAULT_END_DATE = "2200-05-28T18:09:53+00:00"
+
+
+def get_export_path(device_id):
     """
-    Export the location data from Firestore between the start and end dates.
+    Get the path of the CSV export of a device.
 
     Args:
-    - device_id (str): The device ID to export the location data for.
-    - start_date (str): The start date to export the location data from (e.g. '2024-05-28T18:09:53+00:00').
-    - end_date (str): The end date to export the location data to (e.g. '2024-05-28T18:09:53+00:00').
+    - device_id (str): The device ID.
 
     Returns:
-    - dict: The location data between the start and end dates.
+    - str: The path of the CSV file.
     """
-    if device_id is None:
-        device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
-    col_ref = Firestore(f"device_locations/devices/{device_id}").get()
-    # Query all documents between the start and end dates
-    if start_date is None:
-        start_date = "2010-05-28T18:09:53+00:00"
-    if end_date is None:
-        end_date = "2200-05-28T18:09:53+00:00"
+    return f"output/location_export_{device_id}.csv"
 
-    if append:
-        # Append the location data to the existing CSV file
-        try:
-            existing_df = pd.read_csv(f"output/location_export_{device_id}.csv")
-            existing_dates = existing_df["Date"].tolist()
-            start_date = max(existing_dates)
-        except FileNotFoundError:
-            existing_df = pd.DataFrame()
-    else:
-        existing_df = pd.DataFrame()
-
-    # Filter the documents between the start and end dates by the ID
+
+def list_devices():
+    """
+    List all the devices which have location data in Firestore.
+
+    Returns:
+    - list: The device IDs.
+    """
+    return Firestore("device_locations/devices").ls()
+
+
+def query_locations(device_id, start_epoch, end_epoch, end_inclusive=True):
+    """
+    Query the location data of a device between two UTC epochs, sorted by time.
+
+    Args:
+    - device_id (str): The device ID.
+    - start_epoch (int): The start of the range (inclusive).
+    - end_epoch (int): The end of the range.
+    - end_inclusive (bool): Whether the end of the range is inclusive.
+
+    Returns:
+    - dict: The location data (`KEYS_TO_KEEP`) keyed by document ID, in time order.
+    """
+    col_ref = Firestore(f"device_locations/devices/{device_id}").get()
     doc_ref = (
-        col_ref.where("Date", ">=", start_date).where("Date", "<=", end_date).get()
+        col_ref.where("Epoch", ">=", start_epoch)
+        .where("Epoch", "<=" if end_inclusive else "<", end_epoch)
+        .order_by("Epoch")
+        .get()
     )
     output = {}
-    keys_to_keep = ["Date", "Latitude", "Longitude"]
     for doc in doc_ref:
         doc_dict = doc.to_dict()
-        doc_dict = {k: doc_dict[k] for k in keys_to_keep}
+        doc_dict = {k: doc_dict[k] for k in KEYS_TO_KEEP}
         output[doc.id] = doc_dict
-    df = pd.DataFrame(output).T
+    return output
+
+
+def get_epoch_range(device_id):
+    """
+    Get the UTC epochs of the first and last location of a device (two single-document reads).
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - tuple: The first and last epochs, or (None, None) if the device has no location data.
+    """
+    col_ref = Firestore(f"device_locations/devices/{device_id}").get()
+    first = list(col_ref.order_by("Epoch").limit(1).get())
+    last = list(col_ref.order_by("Epoch", direction="DESCENDING").limit(1).get())
+    if not first or not last:
+        return None, None
+    return first[0].to_dict()["Epoch"], last[0].to_dict()["Epoch"]
+
+
+def split_range(start_epoch, end_epoch, num_shards):
+    """
+    Split a range of epochs into contiguous shards.
+
+    Args:
+    - start_epoch (int): The start of the range (inclusive).
+    - end_epoch (int): The end of the range (inclusive).
+    - num_shards (int): The number of shards.
+
+    Returns:
+    - list: The (start, end) of every shard. All shards are half-open except the last one.
+    """
+    num_shards = max(1, min(num_shards, end_epoch - start_epoch + 1))
+    step = (end_epoch - start_epoch + 1) / num_shards
+    bounds = [start_epoch + round(i * step) for i in range(num_shards)] + [end_epoch]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_existing_export(device_id, output_format="csv"):
+    """
+    Read the existing CSV export of a device, if any.
+    For the columnar and trajectory formats, only the last epoch is read, as they are merged on write.
+
+    Args:
+    - device_id (str): The device ID.
+    - output_format (str): The format of the export: "csv", "arrow" or "traj".
+
+    Returns:
+    - pd.DataFrame: The existing export (empty if there is none).
+    """
+    if output_format in ["arrow", "traj"]:
+        last_epoch = None
+        if output_format == "arrow":
+            last_epoch = get_last_history_epoch(device_id)
+        elif os.path.exists(get_trajectory_path(device_id)):
+            last_epoch = get_last_trajectory_epoch(get_trajectory_path(device_id))
+        if last_epoch is None:
+            return pd.DataFrame()
+        return pd.DataFrame({"Epoch": [last_epoch]})
+    try:
+        existing_df = pd.read_csv(get_export_path(device_id))
+    except FileNotFoundError:
+        return pd.DataFrame()
+    if "Epoch" not in existing_df.columns:
+        # Files exported before the epoch was introduced
+        existing_df["Epoch"] = existing_df["Date"].apply(convert_time_to_epoch)
+    return existing_df
+
+
+def save_export(device_id, output, existing_df, output_format="csv"):
+    """
+    Merge the newly exported location data with the existing export and save it.
+
+    Args:
+    - device_id (str): The device ID.
+    - output (dict): The newly exported location data (see `query_locations`).
+    - existing_df (pd.DataFrame): The existing export (possibly empty).
+    - output_format (str): The format of the export: "csv", "arrow" (columnar, partitioned by day)
+      or "traj" (compact binary trajectory, see `packages.gcp_phone_location.src.trajectory`).
+
+    Returns:
+    - pd.DataFrame: The saved export (only the new data for the columnar and trajectory formats).
+    """
+    df = pd.DataFrame(output, index=KEYS_TO_KEEP).T
     df = df.reset_index(drop=True)
     folder_name = "output"
-    print(f"Appended {len(df)} new rows (from {start_date} to {df['Date'].max()})")
+    if output_format == "arrow":
+        write_history(df, device_id)
+        return df
+    if output_format == "traj":
+        os.makedirs(folder_name, exist_ok=True)
+        if existing_df.empty and os.path.exists(get_trajectory_path(device_id)):
+            # Not appending: start a new file
+            os.remove(get_trajectory_path(device_id))
+        if not df.empty:
+            write_trajectory(df, get_trajectory_path(device_id))
+        return df
     df = pd.concat([existing_df, df], axis=0, ignore_index=True)
-    df = df.drop_duplicates(subset=["Date", "Latitude", "Longitude"], keep="last")
+    df = df.drop_duplicates(subset=["Epoch", "Latitude", "Longitude"], keep="last")
+    df = df.sort_values("Epoch", kind="stable").reset_index(drop=True)
     os.makedirs(folder_name, exist_ok=True)
-    df.to_csv(f"output/location_export_{device_id}.csv", index=False)
+    df.to_csv(get_export_path(device_id), index=False)
+    return df
+
+
+def export_locations(
+    device_id=None, start_date=None, end_date=None, append=True, output_format="csv"
+):
+    """
+    Export the location data from Firestore between the start and end dates.
+
+    Args:
+    - device_id (str): The device ID to export the location data for.
+    - start_date (str): The start date to export the location data from (e.g. '2024-05-28T18:09:53+00:00').
+    - end_date (str): The end date to export the location data to (e.g. '2024-05-28T18:09:53+00:00').
+    - append (bool): If True, only export the data newer than the existing CSV file and append it.
+    - output_format (str): "csv" for a single CSV file, "arrow" for the columnar history partitioned
+      by day (see `packages.gcp_phone_location.src.history`), or "traj" for the compact binary trajectory
+      (see `packages.gcp_phone_location.src.trajectory`).
+
+    Returns:
+    - dict: The location data between the start and end dates.
+    """
+    if device_id is None:
+        device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
+    # Query all documents between the start and end dates
+    start_epoch = convert_time_to_epoch(start_date or DEFAULT_START_DATE)
+    end_epoch = convert_time_to_epoch(end_date or DEFAULT_END_DATE)
+
+    existing_df = pd.DataFrame()
+    if append:
+        # Append the location data to the existing CSV file
+        existing_df = read_existing_export(device_id, output_format)
+        if not existing_df.empty:
+            start_epoch = int(existing_df["Epoch"].max())
+
+    # Filter the documents between the start and end epochs (integer UTC seconds)
+    output = query_locations(device_id, start_epoch, end_epoch)
+    print(f"Appended {len(output)} new rows (from {start_epoch} to {end_epoch})")
+    save_export(device_id, output, existing_df, output_format)
     return output
 
 
+def export_all_locations(
+    start_date=None,
+    end_date=None,
+    append=True,
+    num_shards=8,
+    max_workers=16,
+    output_format="csv",
+):
+    """
+    Export the location data of every device. The time range of every device is split into shards,
+    which are all queried concurrently in one bounded pool and merged back in time order.
+
+    Args:
+    - start_date (str): The start date to export the location data from (e.g. '2024-05-28T18:09:53+00:00').
+    - end_date (str): The end date to export the location data to (e.g. '2024-05-28T18:09:53+00:00').
+    - append (bool): If True, only export the data newer than the existing CSV files and append it.
+    - num_shards (int): The number of shards per device.
+    - max_workers (int): The maximum number of concurrent Firestore queries.
+    - output_format (str): The format of the exports: "csv", "arrow" or "traj" (see `export_locations`).
+
+    Returns:
+    - dict: The location data of every device, keyed by device ID.
+    """
+    start_epoch = convert_time_to_epoch(start_date or DEFAULT_START_DATE)
+    end_epoch = convert_time_to_epoch(end_date or DEFAULT_END_DATE)
+    device_ids = list_devices()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        existing_dfs = {}
+        if append:
+            existing_dfs = {
+                device_id: executor.submit(in_current_context(read_existing_export), device_id, output_format)
+                for device_id in device_ids
+            }
+            existing_dfs = {k: future.result() for k, future in existing_dfs.items()}
+        epoch_ranges = dict(zip(device_ids, executor.map(in_current_context(get_epoch_range), device_ids)))
+
+        shard_futures = {}
+        for device_id in device_ids:
+            first_epoch, last_epoch = epoch_ranges[device_id]
+            existing_df = existing_dfs.get(device_id, pd.DataFrame())
+            device_start = start_epoch
+            if not existing_df.empty:
+                device_start = max(device_start, int(existing_df["Epoch"].max()))
+            if first_epoch is None:
+                shard_futures[device_id] = []
+                continue
+            # Only shard the range which actually has data
+            device_start = max(device_start, first_epoch)
+            device_end = min(end_epoch, last_epoch)
+            shards = split_range(device_start, device_end, num_shards)
+            if device_start > device_end:
+                shards = []
+            shard_futures[device_id] = [
+                executor.submit(
+                    in_current_context(query_locations),
+                    device_id,
+                    shard_start,
+                    shard_end,
+                    end_inclusive=(i == len(shards) - 1),
+                )
+                for i, (shard_start, shard_end) in enumerate(shards)
+            ]
+
+        outputs = {}
+        for device_id, futures in shard_futures.items():
+            output = {}
+            # The shards are contiguous and in order, so merging them keeps the time order
+            for future in futures:
+                output.update(future.result())
+            existing_df = existing_dfs.get(device_id, pd.DataFrame())
+            save_export(device_id, output, existing_df, output_format)
+            outputs[device_id] = output
+            log(f"Exported {len(output)} new rows for device {device_id}.")
+    return outputs
+
+
 if __name__ == "__main__":
     export_locations()
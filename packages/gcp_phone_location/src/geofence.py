@@ -0,0 +1,222 @@
+import os
+import json
+import math
+import functools
+from gcp_pal.utils import log
+
+from packages.gcp_phone_location.src.analysis import haversine
+
+# Cell sizes (degrees) of the levels of the grid index, finest first
+GRID_LEVELS = [0.01, 0.1, 1.0, 10.0]
+# A fence is indexed at the finest level where its bounding box spans at most this many cells per axis
+MAX_CELLS_PER_AXIS = 4
+
+# The state of every device between fixes: {device_id: {fence_name: {"since": epoch, "dwelled": bool}}}
+DEVICE_STATES = {}
+
+
+def make_fence(fence):
+    """
+    Validate a fence definition and compute its bounding box.
+
+    Args:
+    - fence (dict): The fence. Either a circle `{"name": ..., "center": [lat, lon], "radius_m": ...}`
+      or a polygon `{"name": ..., "points": [[lat, lon], ...]}`. `dwell_s` (optional) fires a "dwell"
+      event once the device has been inside for that long.
+
+    Returns:
+    - dict: The fence with its `bbox` (south, west, north, east).
+    """
+    fence = dict(fence)
+    if "center" in fence:
+        latitude, longitude = fence["center"]
+        radius_m = float(fence["radius_m"])
+        dlat = math.degrees(radius_m / 6_371_000)
+        dlon = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+        fence["bbox"] = (latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+    elif "points" in fence:
+        latitudes = [point[0] for point in fence["points"]]
+        longitudes = [point[1] for point in fence["points"]]
+        fence["bbox"] = (min(latitudes), min(longitudes), max(latitudes), max(longitudes))
+    else:
+        raise ValueError(f"Fence {fence.get('name')} needs a `center` or `points`.")
+    return fence
+
+
+def is_inside(fence, latitude, longitude):
+    """
+    Check whether a point is inside a fence.
+
+    Args:
+    - fence (dict): The fence (see `make_fence`).
+    - latitude (float): The latitude of the point.
+    - longitude (float): The longitude of the point.
+
+    Returns:
+    - bool: True if the point is inside the fence.
+    """
+    south, west, north, east = fence["bbox"]
+    if not (south <= latitude <= north and west <= longitude <= east):
+        return False
+    if "center" in fence:
+        distance_m = haversine(*fence["center"], latitude, longitude)
+        return distance_m <= fence["radius_m"]
+    # Ray casting (fences are small enough for latitude/longitude to be treated as planar)
+    points = fence["points"]
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:] + points[:1]):
+        if (lat1 > latitude) != (lat2 > latitude):
+            crossing = lon1 + (latitude - lat1) / (lat2 - lat1) * (lon2 - lon1)
+            if longitude < crossing:
+                inside = not inside
+    return inside
+
+
+class GeofenceIndex:
+    """
+    Multi-level grid index of the fences. Every fence is stored in the cells of the finest level
+    where its bounding box spans only a few cells, so a lookup costs one dict access per level
+    whatever the number of fences, plus the exact check of the few fences of those cells.
+    """
+
+    def __init__(self, fences):
+        self.fences = [make_fence(fence) for fence in fences]
+        self.dwell_times = {fence["name"]: fence.get("dwell_s") for fence in self.fences}
+        self.levels = [{} for _ in GRID_LEVELS]
+        for index, fence in enumerate(self.fences):
+            south, west, north, east = fence["bbox"]
+            for level, cell_size in enumerate(GRID_LEVELS):
+                rows = range(math.floor(south / cell_size), math.floor(north / cell_size) + 1)
+                cols = range(math.floor(west / cell_size), math.floor(east / cell_size) + 1)
+                is_last_level = level == len(GRID_LEVELS) - 1
+                if max(len(rows), len(cols)) <= MAX_CELLS_PER_AXIS or is_last_level:
+                    for row in rows:
+                        for col in cols:
+                            self.levels[level].setdefault((row, col), []).append(index)
+                    break
+
+    def query(self, latitude, longitude):
+        """
+        Find the fences which contain a point.
+
+        Args:
+        - latitude (float): The latitude of the point.
+        - longitude (float): The longitude of the point.
+
+        Returns:
+        - list: The names of the fences containing the point.
+        """
+        names = []
+        for cell_size, cells in zip(GRID_LEVELS, self.levels):
+            cell = (math.floor(latitude / cell_size), math.floor(longitude / cell_size))
+            for index in cells.get(cell, []):
+                fence = self.fences[index]
+                if is_inside(fence, latitude, longitude):
+                    names.append(fence["name"])
+        return names
+
+
+@functools.lru_cache(maxsize=4)
+def get_geofence_index(definition):
+    """
+    Build (once per definition) the index of the fences.
+
+    Args:
+    - definition (str): The fences as JSON (see `make_fence`).
+
+    Returns:
+    - GeofenceIndex: The index.
+    """
+    return GeofenceIndex(json.loads(definition))
+
+
+def evaluate_fix(index, device_id, location):
+    """
+    Update the state of a device with a new fix and return the events it triggers.
+    The first fix of a device after a (cold) start only initialises its state, as its previous state is unknown.
+
+    Args:
+    - index (GeofenceIndex): The index of the fences.
+    - device_id (str): The device ID.
+    - location (dict): The fix, with `Latitude`, `Longitude`, `Epoch` and `Date`.
+
+    Returns:
+    - list: The events. Schema: {"device_id", "fence", "event" ("enter", "exit" or "dwell"), "epoch", "date"}.
+    """
+    epoch = location["Epoch"]
+    inside = set(index.query(location["Latitude"], location["Longitude"]))
+    state = DEVICE_STATES.get(device_id)
+    if state is None:
+        DEVICE_STATES[device_id] = {name: {"since": epoch, "dwelled": False} for name in inside}
+        return []
+    events = []
+
+    def add_event(fence, event):
+        event = {"device_id": device_id, "fence": fence, "event": event}
+        events.append({**event, "epoch": epoch, "date": location["Date"]})
+
+    for name in sorted(set(state) - inside):
+        del state[name]
+        add_event(name, "exit")
+    for name in sorted(inside - set(state)):
+        state[name] = {"since": epoch, "dwelled": False}
+        add_event(name, "enter")
+    for name in sorted(inside):
+        dwell_s = index.dwell_times.get(name)
+        fence_state = state[name]
+        if dwell_s is None or fence_state["dwelled"]:
+            continue
+        if epoch - fence_state["since"] >= dwell_s:
+            fence_state["dwelled"] = True
+            add_event(name, "dwell")
+    return events
+
+
+def notify_geofence_events(events):
+    """
+    Send a Pushover notification for every geofence event (through the notification queue).
+
+    Args:
+    - events (list): The events (see `evaluate_fix`).
+
+    Returns:
+    - dict: The outcome of every notification, keyed by notification ID.
+    """
+    from packages.gcp_phone_weather.src.notify import make_notification, deliver_notifications
+
+    verbs = {"enter": "entered", "exit": "left", "dwell": "is staying at"}
+    notifications = [
+        make_notification(
+            f"{event['device_id']} {verbs[event['event']]} {event['fence']} ({event['date']}).",
+            title="Geofence",
+        )
+        for event in events
+    ]
+    return deliver_notifications(notifications)
+
+
+def check_geofences(device_id, locations, notify=True):
+    """
+    Evaluate new fixes of a device against the fences of the env variable `GEOFENCES` (JSON list, see
+    `make_fence`) and notify the events.
+
+    Args:
+    - device_id (str): The device ID.
+    - locations (list): The new fixes, sorted by time.
+    - notify (bool): Whether to send the notifications.
+
+    Returns:
+    - list: The events (see `evaluate_fix`).
+    """
+    definition = os.getenv("GEOFENCES")
+    if not definition:
+        return []
+    index = get_geofence_index(definition)
+    events = []
+    for location in locations:
+        events += evaluate_fix(index, device_id, location)
+    if events:
+        log(f"Geofence events for device {device_id}: {events}")
+        if notify:
+            notify_geofence_events(events)
+    return events
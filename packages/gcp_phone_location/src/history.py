@@ -0,0 +1,229 @@
+import os
+import glob
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+
+from packages.gcp_phone_location.src.location import convert_time_to_epoch
+
+HISTORY_COLUMNS = ["Epoch", "Timestamp", "Date", "Latitude", "Longitude"]
+
+
+def import_pyarrow():
+    """
+    Import pyarrow, which is only needed for the columnar history format.
+
+    Returns:
+    - module: The pyarrow module.
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required for the columnar history format: `pip install pyarrow`."
+        )
+    return pyarrow
+
+
+def get_history_path(device_id):
+    """
+    Get the directory of the columnar history of a device. It holds one Arrow IPC file per UTC day,
+    sorted by time, named `day=YYYY-MM-DD.arrow`.
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - str: The path of the directory.
+    """
+    return f"output/location_history_{device_id}"
+
+
+def list_history_days(device_id):
+    """
+    List the days (partitions) of the columnar history of a device.
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - list: The sorted days as strings (e.g. '2024-05-28').
+    """
+    paths = glob.glob(f"{get_history_path(device_id)}/day=*.arrow")
+    days = [os.path.basename(path)[len("day=") : -len(".arrow")] for path in paths]
+    return sorted(days)
+
+
+def to_history_table(df):
+    """
+    Convert location data to the typed columns of the columnar history.
+
+    Args:
+    - df (pd.DataFrame): The location data with `Date`, `Latitude`, `Longitude` and optionally `Epoch`.
+
+    Returns:
+    - pd.DataFrame: The location data with the `HISTORY_COLUMNS`, sorted by time.
+    """
+    df = df.dropna(subset=["Latitude", "Longitude"]).copy()
+    if "Epoch" not in df.columns:
+        df["Epoch"] = df["Date"].apply(convert_time_to_epoch)
+    df = df.astype(
+        {"Epoch": "int64", "Date": str, "Latitude": "float64", "Longitude": "float64"}
+    )
+    df["Timestamp"] = pd.to_datetime(df["Epoch"], unit="s", utc=True)
+    df = df.sort_values("Epoch", kind="stable").reset_index(drop=True)
+    return df[HISTORY_COLUMNS]
+
+
+def read_history_day(device_id, day, columns=None):
+    """
+    Read one day of the columnar history of a device. The file is memory-mapped and only
+    the requested columns are materialised.
+
+    Args:
+    - device_id (str): The device ID.
+    - day (str): The UTC day (e.g. '2024-05-28').
+    - columns (list): The columns to read. Defaults to all the columns.
+
+    Returns:
+    - pyarrow.Table: The location data of the day.
+    """
+    pa = import_pyarrow()
+    path = f"{get_history_path(device_id)}/day={day}.arrow"
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def write_history(df, device_id):
+    """
+    Write location data to the columnar history of a device, merging it with the days already written.
+    Only the days present in `df` are rewritten.
+
+    Args:
+    - df (pd.DataFrame): The location data (see `to_history_table`).
+    - device_id (str): The device ID.
+
+    Returns:
+    - list: The days which were written.
+    """
+    pa = import_pyarrow()
+    if df.empty:
+        return []
+    df = to_history_table(df)
+    folder_name = get_history_path(device_id)
+    os.makedirs(folder_name, exist_ok=True)
+    existing_days = set(list_history_days(device_id))
+    days = df["Timestamp"].dt.strftime("%Y-%m-%d")
+    for day, day_df in df.groupby(days, sort=True):
+        if day in existing_days:
+            existing_df = read_history_day(device_id, day).to_pandas()
+            day_df = pd.concat([existing_df, day_df], ignore_index=True)
+            day_df = day_df.drop_duplicates(subset=["Epoch"], keep="last")
+            day_df = day_df.sort_values("Epoch", kind="stable")
+        table = pa.Table.from_pandas(day_df[HISTORY_COLUMNS], preserve_index=False)
+        # Write to a temporary file first, so that readers never see a partial file
+        path = f"{folder_name}/day={day}.arrow"
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+    return sorted(set(days))
+
+
+def read_history(device_id, start_epoch=None, end_epoch=None, columns=None):
+    """
+    Read the columnar history of a device between two UTC epochs.
+    Only the days overlapping the range are opened, and only the requested columns are read.
+
+    Args:
+    - device_id (str): The device ID.
+    - start_epoch (int): The start of the range (inclusive). Defaults to the beginning of the history.
+    - end_epoch (int): The end of the range (inclusive). Defaults to the end of the history.
+    - columns (list): The columns to read. Defaults to all the columns.
+
+    Returns:
+    - pd.DataFrame: The location data, sorted by time.
+    """
+    pa = import_pyarrow()
+    if not os.path.isdir(get_history_path(device_id)):
+        raise FileNotFoundError(get_history_path(device_id))
+    days = list_history_days(device_id)
+    if start_epoch is not None:
+        start_day = datetime.fromtimestamp(start_epoch, timezone.utc).date().isoformat()
+        days = [day for day in days if day >= start_day]
+    if end_epoch is not None:
+        end_day = datetime.fromtimestamp(end_epoch, timezone.utc).date().isoformat()
+        days = [day for day in days if day <= end_day]
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(["Epoch", *columns]))
+    tables = [read_history_day(device_id, day, read_columns) for day in days]
+    if not tables:
+        return pd.DataFrame(columns=columns or HISTORY_COLUMNS)
+    table = pa.concat_tables(tables)
+    # Only the first and last days need filtering, but the mask is cheap on the memory-mapped data
+    if start_epoch is not None:
+        table = table.filter(pa.compute.greater_equal(table["Epoch"], start_epoch))
+    if end_epoch is not None:
+        table = table.filter(pa.compute.less_equal(table["Epoch"], end_epoch))
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+def read_local_days(device_id, start_date, end_date=None, columns=None):
+    """
+    Read the columnar history of a device for a range of local dates. The days are partitioned in UTC,
+    so a day of margin is read on both sides; the caller filters by local date.
+
+    Args:
+    - device_id (str): The device ID.
+    - start_date (datetime.date): The first local date.
+    - end_date (datetime.date): The last local date. Defaults to `start_date`.
+    - columns (list): The columns to read. Defaults to all the columns.
+
+    Returns:
+    - pd.DataFrame: The location data, sorted by time.
+    """
+    start_epoch, end_epoch = get_local_days_range(start_date, end_date)
+    return read_history(device_id, start_epoch, end_epoch, columns=columns)
+
+
+def get_local_days_range(start_date, end_date=None):
+    """
+    Get the UTC epochs covering a range of local dates in any time zone (with a day of margin on both sides).
+
+    Args:
+    - start_date (datetime.date): The first local date.
+    - end_date (datetime.date): The last local date. Defaults to `start_date`.
+
+    Returns:
+    - tuple: The start and end UTC epochs.
+    """
+    end_date = end_date or start_date
+    start = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=2), datetime.min.time())
+    start_epoch = int(start.replace(tzinfo=timezone.utc).timestamp())
+    end_epoch = int(end.replace(tzinfo=timezone.utc).timestamp())
+    return start_epoch, end_epoch
+
+
+def get_last_history_epoch(device_id):
+    """
+    Get the UTC epoch of the last location in the columnar history of a device.
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - int: The last epoch, or None if there is no history.
+    """
+    days = list_history_days(device_id)
+    if not days:
+        return None
+    epochs = read_history_day(device_id, days[-1], columns=["Epoch"])["Epoch"]
+    return int(epochs[-1].as_py()) if len(epochs) > 0 else None
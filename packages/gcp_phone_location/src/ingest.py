@@ -0,0 +1,100 @@
+import os
+import math
+from datetime import datetime
+from gcp_pal.utils import log
+
+from packages.gcp_phone_location.src.location import convert_time_to_epoch, store_location_history
+
+# Same cap as the number of points a FollowMee history request returns for a week of 1-min fixes
+DEFAULT_MAX_LOCATIONS = 10_000
+# Fields derived by the server (the time is taken from `Date` only), so uploaded values are dropped
+SERVER_KEYS = ["Epoch"]
+
+
+def validate_location(location):
+    """
+    Validate an uploaded location data point against the schema stored by `store_location`.
+
+    Args:
+    - location (dict): The location data point. `Date` (ISO time with a UTC offset, e.g.
+      '2024-05-28T20:09:53+02:00'), `Latitude` and `Longitude` are required, other fields are kept as is
+      (except the fields derived by the server, see `SERVER_KEYS`).
+
+    Returns:
+    - str: The reason the point is invalid, or None if it is valid.
+    """
+    if not isinstance(location, dict):
+        return "The location must be an object."
+    date = location.get("Date")
+    if not isinstance(date, str) or "/" in date:
+        return "`Date` must be an ISO time string."
+    try:
+        time = datetime.fromisoformat(date)
+    except ValueError:
+        return "`Date` must be an ISO time string."
+    if time.tzinfo is None:
+        # The offset is needed to know the time zone of the device
+        return "`Date` must have a UTC offset."
+    for key, limit in [("Latitude", 90), ("Longitude", 180)]:
+        value = location.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"`{key}` must be a number."
+        if not math.isfinite(value) or abs(value) > limit:
+            return f"`{key}` must be between -{limit} and {limit}."
+    return None
+
+
+def ingest_locations(payload, max_locations=None):
+    """
+    Store a batch of uploaded location data points. The valid points of every device are written
+    in as few transactions as possible (about one per 500 writes), together with the watermark (see `commit_locations`).
+
+    Args:
+    - payload (dict): The upload: `{"device_id": ..., "locations": [...]}`. The device ID can also be given
+      per point (`DeviceID`), which allows one upload for several devices.
+    - max_locations (int): The maximum number of points per upload. Defaults to the env variable
+      `INGEST_MAX_LOCATIONS` or 10000.
+
+    Returns:
+    - dict: The number of points received and stored, the rejected points (index and reason), and the indices
+      of the valid points which were not stored because they are not newer than the last stored point of
+      their device (late or out-of-order uploads).
+    """
+    if max_locations is None:
+        max_locations = int(os.getenv("INGEST_MAX_LOCATIONS", DEFAULT_MAX_LOCATIONS))
+    locations = payload.get("locations")
+    if not isinstance(locations, list):
+        raise ValueError("The payload must have a list of `locations`.")
+    if len(locations) > max_locations:
+        raise ValueError(f"At most {max_locations} locations can be uploaded at once.")
+
+    rejected = []
+    device_locations = {}
+    for index, location in enumerate(locations):
+        error = validate_location(location)
+        device_id = None
+        if error is None:
+            device_id = str(location.get("DeviceID") or payload.get("device_id") or "")
+            if not device_id or "/" in device_id:
+                error = "The device ID is missing or invalid."
+        if error is not None:
+            rejected.append({"index": index, "error": error})
+            continue
+        location = {key: value for key, value in location.items() if key not in SERVER_KEYS}
+        location["DeviceID"] = device_id
+        device_locations.setdefault(device_id, {})[index] = location
+
+    stored = 0
+    stale = []
+    for device_id, device_points in device_locations.items():
+        epochs = {index: convert_time_to_epoch(point["Date"]) for index, point in device_points.items()}
+        stored_locations = store_location_history(device_id, list(device_points.values()))
+        stored += len(stored_locations)
+        # Duplicates of a stored point (same instant) are not stale, as the point was stored
+        stored_epochs = {point["Epoch"] for point in stored_locations}
+        stale += [index for index, epoch in epochs.items() if epoch not in stored_epochs]
+    log(
+        f"Ingested {stored}/{len(locations)} uploaded locations "
+        f"({len(rejected)} rejected, {len(stale)} stale)."
+    )
+    return {"received": len(locations), "stored": stored, "rejected": rejected, "stale": sorted(stale)}
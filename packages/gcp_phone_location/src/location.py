@@ -1,41 +1,129 @@
 import os
+import zlib
 import requests
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from gcp_pal import Firestore
 from gcp_pal.utils import log
 
+from packages.firestore import get_client, get_document, run_transaction
+from packages.gcp_phone_location.src import aggregates as daily
 
-def get_current_location():
+
+FOLLOWMEE_URL = "https://www.followmee.com/api/tracks.aspx"
+IRRELEVANT_KEYS = ["Altitude(ft)", "Speed(km/h)"]
+LAST_UPDATED_TIME_PATH = "device_locations/last_updated_times/{device_id}/last_updated_time"
+DEFAULT_UPDATED_TIME = "1970-01-01T00:00:00Z"
+# Firestore allows at most 500 operations per batched write
+MAX_BATCH_SIZE = 500
+# The time zone the weather service should be rescheduled to (applied later, once settled)
+PENDING_RESCHEDULE_PATH = "weather_schedule/pending_reschedule"
+
+
+def query_followmee(function, **params):
     """
-    Get the current location of all devices being tracked by FollowMee.
+    Query the FollowMee tracks API.
+
+    Args:
+    - function (str): The FollowMee function to call (e.g. "currentforalldevices").
+    - params (dict): Additional parameters for the function (e.g. `deviceid`, `from`, `to`).
 
     Returns:
-    - dict: A dictionary where the keys are the device IDs and the values are the location data.
+    - list: The location data points returned by FollowMee.
     """
-    key = os.getenv("FOLLOWMEE_API_KEY")
-    username = os.getenv("FOLLOWMEE_USERNAME")
-    url = f"https://www.followmee.com/api/tracks.aspx"
-
     params = {
-        "key": key,
-        "username": username,
+        "key": os.getenv("FOLLOWMEE_API_KEY"),
+        "username": os.getenv("FOLLOWMEE_USERNAME"),
         "output": "json",
-        "function": "currentforalldevices",
+        "function": function,
+        **params,
     }
-    response = requests.get(url, params=params)
+    response = requests.get(FOLLOWMEE_URL, params=params)
     response = response.json()
-    devices_locations = response["Data"]
-    irrelevant_keys = ["Altitude(ft)", "Speed(km/h)"]
+    return response.get("Data") or []
+
+
+def get_current_location():
+    """
+    Get the current location of all devices being tracked by FollowMee.
+
+    Returns:
+    - dict: A dictionary where the keys are the device IDs and the values are the location data.
+    """
+    devices_locations = query_followmee("currentforalldevices")
     output = {}
     for device_location in devices_locations:
         device_id = device_location.get("DeviceID")
-        for key in irrelevant_keys:
-            device_location.pop(key)
+        for key in IRRELEVANT_KEYS:
+            device_location.pop(key, None)
         output[device_id] = device_location
     return output
 
 
+def get_location_history(device_id, start_time, end_time=None, max_days=7):
+    """
+    Get all the location data points recorded by a device between two times.
+    FollowMee only accepts whole dates for the range, so the range is padded by a day on
+    each side (to be safe across time zones) and the points are then filtered exactly.
+
+    Args:
+    - device_id (str): The device ID to get the history for.
+    - start_time (str): Only points strictly after this time are returned (e.g. '2024-05-28T20:09:53+02:00').
+    - end_time (str): Only points up to and including this time are returned. Defaults to now.
+    - max_days (int): The maximum number of days to request from FollowMee in a single call.
+
+    Returns:
+    - list: The location data points sorted by time, without duplicates.
+    """
+    start = datetime.fromisoformat(start_time).astimezone(timezone.utc)
+    end = datetime.fromisoformat(end_time) if end_time else datetime.now(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    points = []
+    window_start = start.date() - timedelta(days=1)
+    last_date = end.date() + timedelta(days=1)
+    while window_start <= last_date:
+        window_end = min(window_start + timedelta(days=max_days - 1), last_date)
+        points += query_followmee(
+            "daterangefordevice",
+            deviceid=device_id,
+            **{"from": window_start.isoformat(), "to": window_end.isoformat()},
+        )
+        window_start = window_end + timedelta(days=1)
+    start_epoch = int(start.timestamp())
+    end_epoch = int(end.timestamp())
+    return dedupe_locations(points, start_epoch=start_epoch, end_epoch=end_epoch)
+
+
+def dedupe_locations(locations, start_epoch=None, end_epoch=None):
+    """
+    Remove duplicated location data points (same instant) and sort them by time.
+    Also adds the `Epoch` field (UTC seconds) to every point.
+
+    Args:
+    - locations (list): The location data points.
+    - start_epoch (int): If provided, only keep points strictly after this UTC epoch.
+    - end_epoch (int): If provided, only keep points up to and including this UTC epoch.
+
+    Returns:
+    - list: The unique location data points sorted by time.
+    """
+    unique = {}
+    for location in locations:
+        epoch = location.get("Epoch")
+        if epoch is None:
+            epoch = convert_time_to_epoch(location["Date"])
+        if start_epoch is not None and epoch <= start_epoch:
+            continue
+        if end_epoch is not None and epoch > end_epoch:
+            continue
+        for key in IRRELEVANT_KEYS:
+            location.pop(key, None)
+        location["Epoch"] = epoch
+        # Later duplicates win, as they are the most recent version of the point
+        unique[epoch] = location
+    output = [unique[epoch] for epoch in sorted(unique)]
+    return output
+
+
 def convert_time_to_utc(time):
     """
     Convert a time string (e.g. '2024-05-28T20:09:53+02:00') to UTC time string (e.g. '2024-05-28T18:09:53+00:00').
@@ -52,6 +140,40 @@ def convert_time_to_utc(time):
     return time
 
 
+def convert_time_to_epoch(time):
+    """
+    Convert a time string (e.g. '2024-05-28T20:09:53+02:00') to a UTC epoch in seconds (e.g. 1716919793).
+    This is the canonical time of a location data point: unlike `Date`, it compares correctly across time zones.
+
+    Args:
+    - time (str): The time string to convert.
+
+    Returns:
+    - int: The number of seconds since 1970-01-01T00:00:00Z.
+    """
+    time = datetime.fromisoformat(time)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return int(time.timestamp())
+
+
+def make_last_updated_time(time, epoch=None):
+    """
+    Make the watermark document of a device. The time string stays in `data` so that it can be read
+    as a plain string, and the UTC epoch is kept alongside it.
+
+    Args:
+    - time (str): The time of the last stored location.
+    - epoch (int): The UTC epoch of `time`. Computed if not provided.
+
+    Returns:
+    - dict: The watermark document.
+    """
+    if epoch is None:
+        epoch = convert_time_to_epoch(time)
+    return {"data": time, "metadata": {"epoch": epoch}}
+
+
 def parse_time_zone(time):
     """
     Parse the time zone from a time string.
@@ -84,6 +206,169 @@ def parse_time_zone(time):
     return time_zone
 
 
+def read_last_updated_time(device_id):
+    """
+    Read the time of the last stored location of a device (the watermark).
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - tuple: The time string and the UTC epoch of the last stored location,
+      or of 1970-01-01 if nothing was stored yet.
+    """
+    last_updated_time_path = LAST_UPDATED_TIME_PATH.format(device_id=device_id)
+    # Read the raw document, as the epoch is kept next to the (unwrapped) time string
+    doc = get_document(last_updated_time_path).get()
+    return parse_last_updated_time(doc)
+
+
+def parse_last_updated_time(doc):
+    """
+    Parse the watermark document of a device (see `make_last_updated_time`).
+
+    Args:
+    - doc (google.cloud.firestore.DocumentSnapshot): The watermark document.
+
+    Returns:
+    - tuple: The time string and the UTC epoch of the last stored location,
+      or of 1970-01-01 if nothing was stored yet.
+    """
+    doc = doc.to_dict() or {}
+    last_updated_time = doc.get("data", DEFAULT_UPDATED_TIME)
+    last_updated_epoch = doc.get("metadata", {}).get("epoch")
+    if last_updated_epoch is None:
+        # Watermarks written before the epoch was introduced
+        last_updated_epoch = convert_time_to_epoch(last_updated_time)
+    return last_updated_time, last_updated_epoch
+
+
+def reschedule_on_time_zone_change(device_id, last_updated_time, updated_time):
+    """
+    Request the rescheduling of the weather service if the time zone of the device has changed.
+    Only the request is written here, once the location is stored: it is applied later by the "reschedule"
+    task, once the time zone has settled (see `apply_pending_reschedule`), so that flips near a border
+    cost a single write.
+
+    Args:
+    - device_id (str): The device ID.
+    - last_updated_time (str): The time of the last stored location.
+    - updated_time (str): The time of the newest location.
+
+    Returns:
+    - bool: True if the time zone has changed, False otherwise.
+    """
+    last_updated_time_zone = parse_time_zone(last_updated_time)
+    current_time_zone = parse_time_zone(updated_time)
+    if current_time_zone == last_updated_time_zone:
+        return False
+    # Time zone changed! We have to reschedule the weather service.
+    log(f"Time zone changed for device {device_id}!")
+    pending_reschedule = {
+        "device_id": device_id,
+        "time_zone": current_time_zone,
+        "detected_at": convert_time_to_epoch(updated_time),
+    }
+    # The latest change always overwrites the earlier ones
+    get_document(PENDING_RESCHEDULE_PATH).set(pending_reschedule)
+    return True
+
+
+def request_prefetch_on_move(device_id, location):
+    """
+    Request the prefetch of the weather forecast if the device moved far from its last forecast location,
+    so that the morning weather run can use the cached forecast (see `request_prefetch_if_moved`).
+
+    Args:
+    - device_id (str): The device ID.
+    - location (dict): The newest location of the device.
+
+    Returns:
+    - bool: True if the prefetch was requested, False otherwise.
+    """
+    if os.getenv("WEATHER_PREFETCH", "true").lower() != "true":
+        return False
+    from packages.gcp_phone_weather.src.prefetch import request_prefetch_if_moved
+
+    try:
+        return request_prefetch_if_moved(
+            device_id, location["Latitude"], location["Longitude"]
+        )
+    except Exception as e:
+        log(f"Failed to request the prefetch of the weather forecast: {e}")
+    return False
+
+
+def check_geofences_on_store(device_id, locations):
+    """
+    Evaluate the newly stored locations of a device against the geofences (see `check_geofences`).
+
+    Args:
+    - device_id (str): The device ID.
+    - locations (list): The newly stored locations, sorted by time.
+
+    Returns:
+    - list: The geofence events.
+    """
+    if not os.getenv("GEOFENCES"):
+        return []
+    from packages.gcp_phone_location.src.geofence import check_geofences
+
+    try:
+        return check_geofences(device_id, locations)
+    except Exception as e:
+        log(f"Failed to check the geofences: {e}")
+    return []
+
+
+def commit_locations(device_id, locations):
+    """
+    Write location data points and advance the watermark of a device in one transaction (compare-and-set).
+    The watermark is read inside the transaction and only the points newer than it are written, so
+    concurrent or retried invocations never write a point twice or move the watermark backwards.
+    The document IDs are the `Date` of the points, so rewriting a point is idempotent anyway.
+    The daily aggregates of the device are updated in the same transaction (see `update_daily_aggregates`),
+    so that every point is counted exactly once.
+
+    Args:
+    - device_id (str): The device ID.
+    - locations (list): The location data points with their `Epoch`, sorted by time
+      (see `chunk_locations` for how many fit in one transaction).
+
+    Returns:
+    - list: The points which were written.
+    """
+    client = get_client()
+    last_updated_time_ref = get_document(LAST_UPDATED_TIME_PATH.format(device_id=device_id))
+    aggregate = daily.is_aggregation_enabled()
+
+    def commit(transaction):
+        # Transactions are retried on contention, so this must not have side effects
+        doc = last_updated_time_ref.get(transaction=transaction)
+        last_updated_time, last_updated_epoch = parse_last_updated_time(doc)
+        new_locations = [loc for loc in locations if loc["Epoch"] > last_updated_epoch]
+        if not new_locations:
+            return []
+        # Firestore transactions must read everything before writing
+        if aggregate:
+            aggregates, previous = daily.read_daily_aggregates_for_commit(
+                transaction, device_id, doc.exists and last_updated_time, new_locations
+            )
+        for location in new_locations:
+            location_path = f"device_locations/devices/{device_id}/{location['Date']}"
+            transaction.set(client.document(location_path), location)
+        last_location = new_locations[-1]
+        watermark = make_last_updated_time(last_location["Date"], last_location["Epoch"])
+        transaction.set(last_updated_time_ref, watermark)
+        if aggregate:
+            updated = daily.update_daily_aggregates(aggregates, new_locations, previous)
+            for day, daily_aggregate in updated.items():
+                transaction.set(daily.get_daily_aggregate_ref(device_id, day), daily_aggregate)
+        return new_locations
+
+    return run_transaction(commit)
+
+
 def store_location(location_data):
     """
     Store the location data in a file.
@@ -94,35 +379,161 @@ def store_location(location_data):
     Returns:
     - bool: True if the location data was stored successfully, False otherwise.
     """
-    default_updated_time = "1970-01-01T00:00:00Z"
     for device_id, location in location_data.items():
-        last_updated_time_path = (
-            f"device_locations/last_updated_times/{device_id}/last_updated_time"
-        )
-        last_updated_time = Firestore(last_updated_time_path).read(allow_empty=True)
-
-        if last_updated_time == {}:
-            last_updated_time = default_updated_time
+        # Cheap check first: most polls have nothing new, and then no transaction is needed
+        last_updated_time, last_updated_epoch = read_last_updated_time(device_id)
         updated_time = location.get("Date")
-        if convert_time_to_utc(updated_time) <= convert_time_to_utc(last_updated_time):
+        updated_epoch = convert_time_to_epoch(updated_time)
+        if updated_epoch <= last_updated_epoch:
             log(f"No new location data for device {device_id}.")
             continue
 
-        last_updated_time_zone = parse_time_zone(last_updated_time)
-        current_time_zone = parse_time_zone(updated_time)
-        if current_time_zone != last_updated_time_zone:
-            # Time zone changed! We have to reschedule the weather service.
-            log(f"Time zone changed for device {device_id}!")
-            log("Rescheduling the weather service...")
-            from packages.gcp_phone_weather.schedule import schedule_service
+        # Only store the location if it is newer than the last stored location
+        location["Epoch"] = updated_epoch
+        if not commit_locations(device_id, [location]):
+            log(f"Location of device {device_id} already stored by another run.")
+            continue
+        reschedule_on_time_zone_change(device_id, last_updated_time, updated_time)
+        check_geofences_on_store(device_id, [location])
+        request_prefetch_on_move(device_id, location)
+    return True
 
-            try:
-                schedule_service(time_zone=current_time_zone)
-            except Exception as e:
-                log(f"Failed to reschedule the weather service: {e}")
 
-        # Only store the location if it is newer than the last stored location
-        location_path = f"device_locations/devices/{device_id}/{updated_time}"
-        Firestore(location_path).write(location)
-        Firestore(last_updated_time_path).write({"data": updated_time})
+def chunk_locations(locations, batch_size=MAX_BATCH_SIZE):
+    """
+    Split location data points into chunks which fit in one transaction of `commit_locations`:
+    one write per point, plus the watermark and the aggregate of every day in the chunk.
+
+    Args:
+    - locations (list): The location data points, sorted by time.
+    - batch_size (int): The maximum number of writes per transaction.
+
+    Returns:
+    - list: The chunks of location data points.
+    """
+    chunks = []
+    chunk, days = [], set()
+    for location in locations:
+        new_days = days | {location["Date"][:10]}
+        if chunk and len(chunk) + 2 + len(new_days) > batch_size:
+            chunks.append(chunk)
+            chunk, new_days = [], {location["Date"][:10]}
+        chunk.append(location)
+        days = new_days
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def store_location_history(
+    device_id,
+    locations,
+    last_updated_time=None,
+    last_updated_epoch=None,
+    batch_size=MAX_BATCH_SIZE,
+):
+    """
+    Bulk-write the location data points of a device which are newer than its watermark.
+    Every batch is a transaction which also advances the watermark (see `commit_locations`),
+    so an interrupted write is picked up where it stopped and concurrent runs do not race.
+
+    Args:
+    - device_id (str): The device ID.
+    - locations (list): The location data points to store.
+    - last_updated_time (str): The watermark of the device. If None, it is read from Firestore.
+    - last_updated_epoch (int): The UTC epoch of the watermark. Computed if not provided.
+    - batch_size (int): The maximum number of writes per transaction (including the watermark).
+
+    Returns:
+    - list: The location data points which were stored.
+    """
+    if last_updated_time is None:
+        last_updated_time, last_updated_epoch = read_last_updated_time(device_id)
+    if last_updated_epoch is None:
+        last_updated_epoch = convert_time_to_epoch(last_updated_time)
+    locations = dedupe_locations(locations, start_epoch=last_updated_epoch)
+    if not locations:
+        log(f"No new location data for device {device_id}.")
+        return []
+
+    stored_locations = []
+    for chunk in chunk_locations(locations, batch_size):
+        stored_locations += commit_locations(device_id, chunk)
+    log(f"Stored {len(stored_locations)} location data points for device {device_id}.")
+    if stored_locations:
+        reschedule_on_time_zone_change(device_id, last_updated_time, stored_locations[-1]["Date"])
+        check_geofences_on_store(device_id, stored_locations)
+        request_prefetch_on_move(device_id, locations[-1])
+    return stored_locations
+
+
+def parse_shard(shard):
+    """
+    Parse a shard of the devices, e.g. "0/2" for the first of two shards.
+
+    Args:
+    - shard (str): The shard as "index/count".
+
+    Returns:
+    - tuple: The shard index and the number of shards.
+    """
+    index, count = shard.split("/")
+    return int(index), int(count)
+
+
+def is_device_in_shard(device_id, shard_index, num_shards):
+    """
+    Check whether a device belongs to a shard. The devices are assigned by a stable hash of their ID,
+    so every instance agrees on the assignment.
+
+    Args:
+    - device_id (str): The device ID.
+    - shard_index (int): The index of the shard.
+    - num_shards (int): The number of shards.
+
+    Returns:
+    - bool: True if the device belongs to the shard.
+    """
+    return zlib.crc32(str(device_id).encode()) % num_shards == shard_index
+
+
+def sync_location_history(max_backfill_days=None, shard=None):
+    """
+    Store every location data point recorded since the last sync for all devices.
+    Any gap left by downtime is backfilled from the FollowMee history, up to `max_backfill_days`.
+
+    Args:
+    - max_backfill_days (int): How far back to backfill at most. Defaults to the env variable
+      `FOLLOWMEE_MAX_BACKFILL_DAYS` or 30 days.
+    - shard (str): Only sync the devices of this shard, e.g. "0/2" (see `is_device_in_shard`).
+      Defaults to the env variable `FOLLOWMEE_SHARD` or all the devices.
+
+    Returns:
+    - bool: True if the location data was synced successfully.
+    """
+    if max_backfill_days is None:
+        max_backfill_days = int(os.getenv("FOLLOWMEE_MAX_BACKFILL_DAYS", 30))
+    shard = shard or os.getenv("FOLLOWMEE_SHARD")
+    earliest_time = datetime.now(timezone.utc) - timedelta(days=max_backfill_days)
+    current_locations = get_current_location()
+    if shard:
+        shard_index, num_shards = parse_shard(shard)
+        current_locations = {
+            device_id: location
+            for device_id, location in current_locations.items()
+            if is_device_in_shard(device_id, shard_index, num_shards)
+        }
+    for device_id, location in current_locations.items():
+        last_updated_time, last_updated_epoch = read_last_updated_time(device_id)
+        start_time = last_updated_time
+        if last_updated_epoch < earliest_time.timestamp():
+            start_time = earliest_time.isoformat()
+        history = get_location_history(device_id, start_time, location["Date"])
+        for point in history:
+            # The history points do not carry the device information
+            point.setdefault("DeviceID", device_id)
+            point.setdefault("DeviceName", location.get("DeviceName"))
+        store_location_history(
+            device_id, history + [location], last_updated_time, last_updated_epoch
+        )
     return True
@@ -0,0 +1,398 @@
+import os
+import re
+import struct
+import numpy as np
+import pandas as pd
+
+from packages.gcp_phone_location.src.location import convert_time_to_epoch
+
+# File layout (all integers little-endian):
+#   MAGIC
+#   chunks: CHUNK_HEADER (number of points, payload bytes) + payload, time-sorted
+#   end of chunks: CHUNK_HEADER with 0 points
+#   index: INDEX_ENTRY (offset, number of points, first epoch, last epoch) per chunk
+#   footer: FOOTER (number of chunks) + MAGIC
+# A chunk payload is the time zone runs (number of runs, then run length and UTC offset in minutes,
+# zigzag varints), followed by the zigzag varints of the deltas of the epochs (seconds), then of the
+# latitudes and the longitudes (microdegrees). The first delta of every column is from 0, so every chunk
+# decodes on its own.
+MAGIC = b"TRJ1"
+CHUNK_HEADER = struct.Struct("<II")
+INDEX_ENTRY = struct.Struct("<QIqq")
+FOOTER = struct.Struct("<I4s")
+MICRODEGREES = 1_000_000
+# About a day of points at one fix every 2 minutes, so that a day reads one or two chunks
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def get_trajectory_path(device_id):
+    """
+    Get the path of the trajectory export of a device.
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - str: The path of the file.
+    """
+    return f"output/location_export_{device_id}.traj"
+
+
+def zigzag_encode(values):
+    """
+    Map signed integers to unsigned ones, small in absolute value to small (0, -1, 1, -2... to 0, 1, 2, 3...).
+    """
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def encode_varints(values):
+    """
+    Pack unsigned integers as varints (7 bits per byte, the high bit set on all but the last byte),
+    vectorised over the bytes of every value.
+
+    Args:
+    - values (np.ndarray): The unsigned integers.
+
+    Returns:
+    - bytes: The varints.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        num_bytes += values >= (np.uint64(1) << np.uint64(shift))
+    ends = np.cumsum(num_bytes)
+    starts = ends - num_bytes
+    output = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for i in range(int(num_bytes.max()) if len(values) else 0):
+        has_byte = num_bytes > i
+        byte = (values[has_byte] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        byte |= np.where(num_bytes[has_byte] > i + 1, 0x80, 0).astype(np.uint64)
+        output[starts[has_byte] + i] = byte
+    return output.tobytes()
+
+
+def decode_varints(data, count=None):
+    """
+    Unpack varints, vectorised: the value of every byte is shifted by its position in its varint
+    and the bytes of every varint are summed.
+
+    Args:
+    - data (bytes): The varints.
+    - count (int): The number of varints expected, to check the data.
+
+    Returns:
+    - np.ndarray: The unsigned integers.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    is_last = data < 0x80
+    starts = np.flatnonzero(np.concatenate([[True], is_last[:-1]]))
+    positions = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    values = (data & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    values = np.add.reduceat(values, starts)
+    if count is not None and len(values) != count:
+        raise ValueError(f"Corrupt trajectory chunk: {len(values)} values instead of {count}.")
+    return values
+
+
+def parse_utc_offset(date):
+    """
+    Get the UTC offset in minutes of an ISO date string (e.g. '2024-05-28T20:09:53+02:00' is 120, 'Z' is 0).
+    """
+    match = re.search(r"([+-])(\d{2}):?(\d{2})$", date)
+    if match is None:
+        return 0
+    sign, hours, minutes = match.groups()
+    return (-1 if sign == "-" else 1) * (int(hours) * 60 + int(minutes))
+
+
+def parse_utc_offsets(dates):
+    """
+    Get the UTC offsets in minutes of ISO date strings. Only the few distinct suffixes are parsed.
+    """
+    suffixes = pd.Series(dates, dtype=str).str[-6:]
+    return suffixes.map({suffix: parse_utc_offset(suffix) for suffix in suffixes.unique()}).to_numpy(np.int64)
+
+
+def format_dates(epochs, offsets):
+    """
+    Format UTC epochs and UTC offsets in minutes as local ISO date strings (the inverse of `parse_utc_offsets`).
+    """
+    local = (np.asarray(epochs) + np.asarray(offsets) * 60).astype("datetime64[s]")
+    unique_offsets, inverse = np.unique(offsets, return_inverse=True)
+    suffixes = np.array(
+        [f"{'-' if offset < 0 else '+'}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}" for offset in unique_offsets]
+    )
+    return np.char.add(np.datetime_as_string(local, unit="s"), suffixes[inverse]).astype(object)
+
+
+def encode_chunk(epochs, latitudes, longitudes, offsets):
+    """
+    Encode a chunk of time-sorted points (see the file layout above).
+
+    Args:
+    - epochs (np.ndarray): The UTC epochs in seconds.
+    - latitudes (np.ndarray): The latitudes in microdegrees.
+    - longitudes (np.ndarray): The longitudes in microdegrees.
+    - offsets (np.ndarray): The UTC offsets in minutes.
+
+    Returns:
+    - bytes: The chunk, with its header.
+    """
+    change = np.flatnonzero(np.diff(offsets)) + 1
+    run_starts = np.concatenate([[0], change])
+    run_lengths = np.diff(np.append(run_starts, len(offsets)))
+    runs = np.empty(2 * len(run_starts), dtype=np.int64)
+    runs[0::2], runs[1::2] = run_lengths, offsets[run_starts]
+    columns = np.stack([epochs, latitudes, longitudes]).astype(np.int64)
+    deltas = np.diff(columns, axis=1, prepend=0).ravel()
+    payload = encode_varints(zigzag_encode(np.concatenate([[len(run_starts)], runs, deltas])))
+    return CHUNK_HEADER.pack(len(epochs), len(payload)) + payload
+
+
+def decode_chunk(payload, count):
+    """
+    Decode the payload of a chunk (see `encode_chunk`).
+
+    Returns:
+    - tuple: The epochs, latitudes and longitudes (microdegrees) and UTC offsets (minutes) of the points.
+    """
+    values = zigzag_decode(decode_varints(payload))
+    num_runs = int(values[0])
+    runs = values[1 : 1 + 2 * num_runs]
+    offsets = np.repeat(runs[1::2], runs[0::2])
+    deltas = values[1 + 2 * num_runs :]
+    if len(deltas) != 3 * count or len(offsets) != count:
+        raise ValueError(f"Corrupt trajectory chunk: expected {count} points.")
+    epochs, latitudes, longitudes = np.cumsum(deltas.reshape(3, count), axis=1)
+    return epochs, latitudes, longitudes, offsets
+
+
+def to_trajectory_columns(df):
+    """
+    Convert location data to the integer columns of the codec, sorted by time.
+
+    Args:
+    - df (pd.DataFrame): The location data with `Date`, `Latitude`, `Longitude` and optionally `Epoch`.
+
+    Returns:
+    - tuple: The epochs, latitudes and longitudes (microdegrees) and UTC offsets (minutes).
+    """
+    df = df.dropna(subset=["Latitude", "Longitude"])
+    if "Epoch" not in df.columns:
+        df = df.assign(Epoch=df["Date"].apply(convert_time_to_epoch))
+    df = df.sort_values("Epoch", kind="stable")
+    epochs = df["Epoch"].to_numpy(dtype=np.int64)
+    latitudes = np.rint(df["Latitude"].to_numpy(dtype=float) * MICRODEGREES).astype(np.int64)
+    longitudes = np.rint(df["Longitude"].to_numpy(dtype=float) * MICRODEGREES).astype(np.int64)
+    return epochs, latitudes, longitudes, parse_utc_offsets(df["Date"])
+
+
+class TrajectoryWriter:
+    """
+    Streaming encoder of a trajectory file: points are buffered and written a chunk at a time, and the index
+    is written on `close`. Opening an existing file appends to it (the points must be newer than its last one).
+    """
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.index = []
+        self.buffer = []
+        self.buffered = 0
+        self.last_epoch = None
+        if os.path.exists(path):
+            self.index = read_index(path)
+            self.file = open(path, "r+b")
+            end = len(MAGIC)
+            if self.index:
+                offset, count, _, self.last_epoch = self.index[-1]
+                self.file.seek(offset)
+                _, size = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+                end = offset + CHUNK_HEADER.size + size
+                if count < chunk_size:
+                    # Re-encode the last chunk with the new points rather than leave it partial
+                    self.buffer = [decode_chunk(self.file.read(size), count)]
+                    self.buffered = count
+                    self.index.pop()
+                    end = offset
+            # Drop the end marker, the index and the footer: they are rewritten on close
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(MAGIC)
+
+    def write(self, epochs, latitudes, longitudes, offsets):
+        """
+        Add time-sorted points (see `to_trajectory_columns`).
+        """
+        if len(epochs) == 0:
+            return
+        if self.last_epoch is not None and epochs[0] < self.last_epoch:
+            raise ValueError("Trajectory points must be appended in time order.")
+        self.last_epoch = int(epochs[-1])
+        self.buffer.append((epochs, latitudes, longitudes, offsets))
+        self.buffered += len(epochs)
+        while self.buffered >= self.chunk_size:
+            self.flush(self.chunk_size)
+
+    def flush(self, count=None):
+        if not self.buffered:
+            return
+        columns = [np.concatenate(column) for column in zip(*self.buffer)]
+        count = min(count or self.buffered, self.buffered)
+        chunk = [column[:count] for column in columns]
+        rest = [column[count:] for column in columns]
+        self.index.append((self.file.tell(), count, int(chunk[0][0]), int(chunk[0][-1])))
+        self.file.write(encode_chunk(*chunk))
+        self.buffer = [rest] if len(rest[0]) else []
+        self.buffered -= count
+
+    def close(self):
+        self.flush()
+        self.file.write(CHUNK_HEADER.pack(0, 0))
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(len(self.index), MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_trajectory(df, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write (or append) location data to a trajectory file. Points not newer than the last point
+    of the file are skipped.
+
+    Args:
+    - df (pd.DataFrame): The location data (see `to_trajectory_columns`).
+    - path (str): The path of the file.
+    - chunk_size (int): The number of points per chunk.
+
+    Returns:
+    - int: The number of points written.
+    """
+    columns = to_trajectory_columns(df)
+    with TrajectoryWriter(path, chunk_size) as writer:
+        if writer.last_epoch is not None:
+            columns = [column[columns[0] > writer.last_epoch] for column in columns]
+        writer.write(*columns)
+    return len(columns[0])
+
+
+def read_index(path):
+    """
+    Read the chunk index of a trajectory file.
+
+    Args:
+    - path (str): The path of the file.
+
+    Returns:
+    - list: The (offset, number of points, first epoch, last epoch) of every chunk.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file.")
+        file.seek(-FOOTER.size, os.SEEK_END)
+        num_chunks, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} has no index (it was not closed).")
+        file.seek(-FOOTER.size - num_chunks * INDEX_ENTRY.size, os.SEEK_END)
+        data = file.read(num_chunks * INDEX_ENTRY.size)
+    return list(INDEX_ENTRY.iter_unpack(data))
+
+
+def iter_chunks(file):
+    """
+    Decode the chunks of a trajectory file in order, without the index (e.g. while it is being streamed).
+
+    Args:
+    - file (file object): The file, opened in binary mode at its start.
+
+    Yields:
+    - tuple: The columns of every chunk (see `decode_chunk`).
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a trajectory file.")
+    while True:
+        header = file.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return
+        count, size = CHUNK_HEADER.unpack(header)
+        if count == 0:
+            return
+        yield decode_chunk(file.read(size), count)
+
+
+def to_dataframe(columns, with_dates=True):
+    """
+    Convert decoded columns to location data (the inverse of `to_trajectory_columns`).
+    """
+    epochs, latitudes, longitudes, offsets = columns
+    df = pd.DataFrame(
+        {
+            "Epoch": epochs,
+            "Latitude": latitudes / MICRODEGREES,
+            "Longitude": longitudes / MICRODEGREES,
+        }
+    )
+    if with_dates:
+        df.insert(0, "Date", format_dates(epochs, offsets) if len(epochs) else [])
+    return df
+
+
+def read_trajectory(path, start_epoch=None, end_epoch=None, with_dates=True):
+    """
+    Read the points of a trajectory file between two UTC epochs. Only the chunks overlapping the range
+    are read (random access through the index), and every chunk is decoded with vectorised operations.
+
+    Args:
+    - path (str): The path of the file.
+    - start_epoch (int): The start of the range (inclusive). Defaults to the first point.
+    - end_epoch (int): The end of the range (inclusive). Defaults to the last point.
+    - with_dates (bool): Whether to format the local `Date` strings (the slowest part of decoding).
+
+    Returns:
+    - pd.DataFrame: The location data (`Date`, `Epoch`, `Latitude`, `Longitude`), sorted by time.
+    """
+    start_epoch = -np.inf if start_epoch is None else start_epoch
+    end_epoch = np.inf if end_epoch is None else end_epoch
+    chunks = []
+    with open(path, "rb") as file:
+        for offset, count, first_epoch, last_epoch in read_index(path):
+            if last_epoch < start_epoch or first_epoch > end_epoch:
+                continue
+            file.seek(offset)
+            _, size = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+            chunks.append(decode_chunk(file.read(size), count))
+    if not chunks:
+        return to_dataframe([np.zeros(0, dtype=np.int64)] * 4, with_dates)
+    columns = [np.concatenate(column) for column in zip(*chunks)]
+    mask = (columns[0] >= start_epoch) & (columns[0] <= end_epoch)
+    return to_dataframe([column[mask] for column in columns], with_dates)
+
+
+def get_last_trajectory_epoch(path):
+    """
+    Get the UTC epoch of the last point of a trajectory file, from its index.
+
+    Args:
+    - path (str): The path of the file.
+
+    Returns:
+    - int: The last epoch, or None if the file has no points.
+    """
+    index = read_index(path)
+    return index[-1][3] if index else None
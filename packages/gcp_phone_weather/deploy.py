@@ -1,6 +1,6 @@
 from gcp_pal import CloudRun
 
-from packages.gcp_phone_weather.schedule import schedule_service
+from packages.gcp_phone_weather.schedule import schedule_service, unschedule_reschedule_task
 
 
 def deploy_phone_weather():
@@ -17,4 +17,5 @@ def deploy_phone_weather():
     status = CloudRun("phone-weather").status()
     print("Scheduling service...")
     schedule_service()
+    unschedule_reschedule_task()
     print(f"Status: {status}")
@@ -2,27 +2,69 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from datetime import datetime, timezone
+
 from packages.gcp_phone_weather.src.weather import query_weather_forecast
 from packages.gcp_phone_weather.src.utils import (
     compute_text_message,
     send_text_message,
     obtain_recent_coordinates,
 )
+from packages.gcp_phone_weather.src.fanout import fan_out_weather
+from packages.gcp_phone_weather.src.prefetch import get_cached_forecast
+from packages.gcp_phone_weather.src.notify import drain_pending_notifications
 
 
-def main():
+def main(device_id=None):
     """
     Query the weather forecast for the most recent coordinates of the device and send a text message.
 
+    Args:
+    - device_id (str): The device ID. Defaults to the env variable `FOLLOWMEE_DEVICE_ID`.
+
     Returns:
     - dict: A dictionary containing the response.
     """
-    latitude, longitude = obtain_recent_coordinates()
-    weather, metadata = query_weather_forecast(latitude, longitude)
-    message = compute_text_message(weather, metadata, use_llm=True)
+    started = datetime.now(timezone.utc)
+    latitude, longitude = obtain_recent_coordinates(device_id)
+    # The forecast is usually prefetched when the device last moved (see `request_prefetch_if_moved`)
+    cached = get_cached_forecast(latitude, longitude, device_id)
+    if cached is not None:
+        weather, metadata, advice = cached
+    else:
+        weather, metadata = query_weather_forecast(latitude, longitude)
+        advice = None
+    message = compute_text_message(weather, metadata, advice=advice)
     status = send_text_message(message, metadata)
+    # Today's message goes first, then whatever earlier runs could not deliver. If today's message was
+    # just queued, it is left to the next drain rather than retried with a second full timeout
+    drain_pending_notifications(created_before=started)
     return status
 
 
+def main_fan_out():
+    """
+    Send the weather forecast to the recipients of all tracked devices (one forecast per location cell).
+
+    Returns:
+    - dict: A summary of the run.
+    """
+    started = datetime.now(timezone.utc)
+    output = fan_out_weather()
+    drain_pending_notifications(created_before=started)
+    return output
+
+
+def main_notify():
+    """
+    Deliver the notifications which earlier runs could not deliver.
+
+    Returns:
+    - dict: A dictionary containing the response.
+    """
+    outcomes = drain_pending_notifications()
+    return {"status": "success", "outcomes": outcomes}
+
+
 if __name__ == "__main__":
     main()
@@ -3,7 +3,12 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from gcp_pal import CloudScheduler, CloudRun, Firestore
+import time
+import functools
+from gcp_pal import CloudScheduler, CloudRun
+from gcp_pal.utils import log
+
+from packages.firestore import get_client, get_document, get_firestore
 
 
 def obtain_latest_time_zone():
@@ -19,13 +24,38 @@ def obtain_latest_time_zone():
     if device_id is None:
         return "UTC"
     path = f"device_locations/last_updated_times/{device_id}/last_updated_time"
-    last_updated_time = Firestore(path).read(allow_empty=True)
+    last_updated_time = get_firestore(path).read(allow_empty=True)
     time_zone = parse_time_zone(last_updated_time)
     print(f"Obtained latest time zone: {time_zone}")
 
     return time_zone
 
 
+@functools.lru_cache(maxsize=None)
+def get_service_uri():
+    """
+    Get the URI of the phone weather Cloud Run service (cached for the lifetime of the process).
+
+    Returns:
+    - str: The URI of the service.
+    """
+    return CloudRun("phone-weather").uri()
+
+
+def get_scheduled_time_zone():
+    """
+    Get the time zone the phone weather service is currently scheduled in.
+
+    Returns:
+    - str: The time zone, or None if the service is not scheduled.
+    """
+    try:
+        return CloudScheduler("phone-weather").get().time_zone
+    except Exception as e:
+        log(f"Failed to get the phone weather schedule: {e}")
+        return None
+
+
 def schedule_service(time_zone=None):
     """
     Schedules the phone weather service to run every day at 5:58 AM.
@@ -37,7 +67,7 @@ def schedule_service(time_zone=None):
     if time_zone is None:
         time_zone = obtain_latest_time_zone()
 
-    cloud_run_uri = CloudRun("phone-weather").uri()
+    cloud_run_uri = get_service_uri()
     once_a_day_at_5_58_am = "58 5 * * *"
     CloudScheduler("phone-weather").create(
         target=cloud_run_uri,
@@ -49,3 +79,53 @@ def schedule_service(time_zone=None):
     status = CloudScheduler("phone-weather").status()
     print(f"Status: {status}")
     return status
+
+
+def apply_pending_reschedule(debounce_minutes=None):
+    """
+    Apply the rescheduling requested by the location service when the time zone changed
+    (see `reschedule_on_time_zone_change`), once the time zone has not changed for `debounce_minutes`.
+    Only the latest time zone is applied, and nothing is updated if the service is already scheduled in it.
+
+    Args:
+    - debounce_minutes (float): How long the time zone must be stable. Defaults to the env variable
+      `WEATHER_RESCHEDULE_DEBOUNCE_MINUTES` or 30 minutes.
+
+    Returns:
+    - str: "none" (nothing pending), "waiting" (not settled yet), "unchanged" or "rescheduled".
+    """
+    from packages.gcp_phone_location.src.location import PENDING_RESCHEDULE_PATH
+
+    if debounce_minutes is None:
+        debounce_minutes = float(os.getenv("WEATHER_RESCHEDULE_DEBOUNCE_MINUTES", 30))
+    doc_ref = get_document(PENDING_RESCHEDULE_PATH)
+    snapshot = doc_ref.get()
+    pending = snapshot.to_dict()
+    if not pending:
+        return "none"
+    if time.time() - pending["detected_at"] < debounce_minutes * 60:
+        return "waiting"
+    time_zone = pending["time_zone"]
+    outcome = "unchanged"
+    if get_scheduled_time_zone() != time_zone:
+        log(f"Rescheduling the weather service in {time_zone}...")
+        schedule_service(time_zone=time_zone)
+        outcome = "rescheduled"
+    # Only delete the request if no newer change was written in the meantime
+    client = get_client()
+    try:
+        doc_ref.delete(option=client.write_option(last_update_time=snapshot.update_time))
+    except Exception as e:
+        log(f"The time zone changed again while rescheduling: {e}")
+    return outcome
+
+
+def unschedule_reschedule_task():
+    """
+    Deletes the Cloud Scheduler job which used to apply the pending reschedules on the weather service.
+    They are applied by the "reschedule" task of the location Cloud Function instead (see `schedule_reschedule`),
+    which does not wake up the weather service.
+    """
+    if CloudScheduler("phone-weather-reschedule").exists():
+        CloudScheduler("phone-weather-reschedule").delete()
+        print("Deleted the phone-weather-reschedule job.")
@@ -0,0 +1,130 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Thresholds of the rules (same units as `parse_weather_forecast`)
+ADVICE_THRESHOLDS = {
+    "prob_precip": 0.4,  # Probability of precipitation (0-1) above which to take an umbrella
+    "rain": 0.3,  # Rain volume in mm over 3 hours above which to take an umbrella
+    "cold": 5,  # Feels-like temperature in °C below which to dress warmly
+    "freezing": 0,  # Feels-like temperature in °C below which to wear gloves
+    "hot": 25,  # Feels-like temperature in °C above which to dress light
+    "temp_range": 8,  # Temperature range in °C over the day above which to dress in layers
+    "wind_chill": 3,  # Difference in °C between the temperature and the feels-like temperature
+    "sunny_cloudiness": 25,  # Cloudiness in % below which it is sunny
+    "wind_speed": 30,  # Wind speed in km/h above which it is windy
+    "wind_gust": 50,  # Wind gust in km/h above which it is windy
+}
+RAIN_WEATHERS = ["rain", "drizzle", "thunderstorm"]
+# Keyword patterns of every advice topic, to compare the advice of different engines. "light" only counts
+# after "dress", so that "light rain", "light snow" or "lightning" are not advice to dress light, and a coat
+# or jacket is only warm clothing if it is said to be (not e.g. a waterproof or lightweight jacket)
+ADVICE_TOPICS = {
+    "umbrella": ["umbrella", "rain"],
+    "snow": ["snow", "boots"],
+    "warm": ["warm", r"(?:winter|thick|heavy|padded|down) (?:coat|jacket)"],
+    "gloves": ["gloves", "hat", "scarf"],
+    "light": [r"dress(?:es|ing)? light\b", "hydrated"],
+    "layers": ["layers"],
+    "feels_colder": ["feels colder"],
+    "sunglasses": ["sunglasses", "sunscreen"],
+    "wind": ["wind"],
+}
+
+
+def get_rule_advice(weather_df, thresholds=None):
+    """
+    Get actionable advice for the weather forecast (like the LLM with `PROMPT_1`) from fixed rules.
+    Every rule is a vectorised condition over the forecast columns, so the advice is deterministic
+    and takes about a millisecond.
+
+    Args:
+    - weather_df (pd.DataFrame): The weather forecast data (see `parse_weather_forecast`).
+    - thresholds (dict): Overrides of the `ADVICE_THRESHOLDS`.
+
+    Returns:
+    - str: The advice, one "- " line per suggestion.
+    """
+    t = {**ADVICE_THRESHOLDS, **(thresholds or {})}
+    if weather_df.empty:
+        return "- No forecast available."
+    weather = weather_df["weather"].astype(str).str.lower().to_numpy().astype(str)
+    temp = weather_df["temp"].to_numpy(dtype=float)
+    feels_like = weather_df["temp_feels_like"].to_numpy(dtype=float)
+    prob_precip = weather_df["prob_precip"].to_numpy(dtype=float)
+    rain = weather_df["rain"].to_numpy(dtype=float)
+    snow = weather_df["snow"].to_numpy(dtype=float)
+    cloudiness = weather_df["cloudiness"].to_numpy(dtype=float)
+    wind_speed = weather_df["wind_speed"].to_numpy(dtype=float)
+    wind_gust = weather_df["wind_gust"].to_numpy(dtype=float)
+    hours = pd.to_datetime(weather_df["timestamp"]).dt.hour.to_numpy()
+
+    rainy_weather = np.zeros(len(weather), dtype=bool)
+    for keyword in RAIN_WEATHERS:
+        rainy_weather |= np.char.find(weather, keyword) >= 0
+    wet = (prob_precip >= t["prob_precip"]) & ((rain >= t["rain"]) | rainy_weather)
+    daytime = (hours >= 9) & (hours <= 17)
+    sunny = daytime & (cloudiness <= t["sunny_cloudiness"]) & ~wet
+
+    advice = []
+    if wet.any():
+        advice.append("Take umbrella.")
+    if (snow > 0).any():
+        advice.append("Wear boots, snow expected.")
+    if feels_like.min() <= t["freezing"]:
+        advice.append("Wear gloves and a hat.")
+    elif feels_like.min() <= t["cold"]:
+        advice.append("Dress warmly.")
+    elif feels_like.max() >= t["hot"]:
+        advice.append("Dress light and stay hydrated.")
+    if temp.max() - temp.min() >= t["temp_range"]:
+        advice.append("Dress in layers.")
+    if (temp - feels_like).mean() >= t["wind_chill"]:
+        advice.append("Feels colder than actual temperature.")
+    if sunny.any():
+        advice.append("Take sunglasses.")
+    if (wind_speed >= t["wind_speed"]).any() or (wind_gust >= t["wind_gust"]).any():
+        advice.append("Expect strong wind.")
+    if not advice:
+        advice.append("No special precautions needed.")
+    return "\n".join(f"- {line}" for line in advice)
+
+
+def get_advice_topics(advice):
+    """
+    Get the topics (umbrella, layers, sunglasses, wind...) covered by some advice.
+
+    Args:
+    - advice (str): The advice, e.g. from the LLM or `get_rule_advice`.
+
+    Returns:
+    - set: The topics (keys of `ADVICE_TOPICS`).
+    """
+    advice = advice.lower()
+    topics = set()
+    for topic, keywords in ADVICE_TOPICS.items():
+        if any(re.search(rf"\b{keyword}", advice) for keyword in keywords):
+            topics.add(topic)
+    return topics
+
+
+def compare_advice(rule_advice, llm_advice):
+    """
+    Compare the advice of the rules with the advice of the LLM for the same forecast.
+
+    Args:
+    - rule_advice (str): The advice of `get_rule_advice`.
+    - llm_advice (str): The advice of the LLM.
+
+    Returns:
+    - dict: The topics in both, only in the rules and only in the LLM advice, and their Jaccard similarity.
+    """
+    rule_topics = get_advice_topics(rule_advice)
+    llm_topics = get_advice_topics(llm_advice)
+    union = rule_topics | llm_topics
+    return {
+        "common": sorted(rule_topics & llm_topics),
+        "rules_only": sorted(rule_topics - llm_topics),
+        "llm_only": sorted(llm_topics - rule_topics),
+        "similarity": len(rule_topics & llm_topics) / len(union) if union else 1.0,
+    }
@@ -0,0 +1,146 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import json
+import concurrent.futures
+from gcp_pal import Firestore
+from gcp_pal.utils import log
+
+from packages.firestore_usage import in_current_context
+from packages.gcp_phone_weather.src.weather import query_weather_forecast
+from packages.gcp_phone_weather.src.utils import (
+    compute_text_message,
+    get_weather_image_icon,
+    make_weather_notification,
+    obtain_recent_coordinates,
+)
+from packages.gcp_phone_weather.src.notify import deliver_notifications
+
+
+def get_recipients():
+    """
+    Get the Pushover recipient of every device to send the weather forecast for.
+    The mapping is read from the env variable `PUSHOVER_RECIPIENTS` (e.g. '{"device_id": "user_key"}').
+    If it is not set, every tracked device is sent to `PUSHOVER_USER_KEY`.
+
+    Returns:
+    - dict: A dictionary where the keys are the device IDs and the values are the Pushover user keys.
+    """
+    recipients = os.getenv("PUSHOVER_RECIPIENTS")
+    if recipients:
+        return json.loads(recipients)
+    device_ids = Firestore("device_locations/last_updated_times").ls()
+    return {device_id: os.environ["PUSHOVER_USER_KEY"] for device_id in device_ids}
+
+
+def quantise_location(latitude, longitude, cell_size=None):
+    """
+    Snap a location to the centre of its grid cell, so that nearby devices share one forecast.
+
+    Args:
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+    - cell_size (float): The size of the cell in degrees. Defaults to the env variable
+      `WEATHER_CELL_SIZE` or 0.1 (about 11 km).
+
+    Returns:
+    - tuple: The latitude and longitude of the centre of the cell.
+    """
+    if cell_size is None:
+        cell_size = float(os.getenv("WEATHER_CELL_SIZE", 0.1))
+    latitude = round(round(float(latitude) / cell_size) * cell_size, 6)
+    longitude = round(round(float(longitude) / cell_size) * cell_size, 6)
+    return latitude, longitude
+
+
+def compute_cell_message(cell, use_llm=None):
+    """
+    Compute the weather message of a location cell: one forecast, one message and one image for all its devices.
+
+    Args:
+    - cell (tuple): The latitude and longitude of the centre of the cell.
+    - use_llm (bool): Whether to use the LLM model. Defaults to `WEATHER_ADVICE_ENGINE` (see `compute_text_message`).
+
+    Returns:
+    - tuple: The message, the metadata of the location and the weather image icon (or None).
+    """
+    latitude, longitude = cell
+    weather, metadata = query_weather_forecast(latitude, longitude)
+    message = compute_text_message(weather, metadata, use_llm=use_llm)
+    try:
+        base64_image = get_weather_image_icon(metadata)
+    except Exception as e:
+        base64_image = None
+    return message, metadata, base64_image
+
+
+def fan_out_weather(recipients=None, use_llm=None, max_workers=8):
+    """
+    Send the weather forecast for every tracked device to its recipient.
+    Devices are grouped by location cell, so the cost scales with the number of distinct locations.
+    The notifications are delivered through the Pushover delivery queue.
+
+    Args:
+    - recipients (dict): The Pushover user key of every device. Defaults to `get_recipients()`.
+    - use_llm (bool): Whether to use the LLM model. Defaults to `WEATHER_ADVICE_ENGINE` (see `compute_text_message`).
+    - max_workers (int): The maximum number of concurrent requests per stage.
+
+    Returns:
+    - dict: A summary of the run: the number of devices, cells, and sent/queued/failed notifications,
+      and the devices whose coordinates could not be obtained (which are skipped).
+    """
+    if recipients is None:
+        recipients = get_recipients()
+    device_ids = list(recipients)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        coordinate_futures = {
+            device_id: executor.submit(in_current_context(obtain_recent_coordinates), device_id)
+            for device_id in device_ids
+        }
+
+        # Every recipient gets one message per cell, however many of their devices are in it
+        cells = {}
+        failed_devices = []
+        for device_id, future in coordinate_futures.items():
+            try:
+                latitude, longitude = future.result()
+            except Exception as e:
+                log(f"Failed to obtain the coordinates of device {device_id}: {e}")
+                failed_devices.append(device_id)
+                continue
+            cell = quantise_location(latitude, longitude)
+            cells.setdefault(cell, set()).add(recipients[device_id])
+        log(f"Weather fan-out: {len(device_ids)} devices in {len(cells)} cells.")
+
+        cell_futures = {
+            cell: executor.submit(in_current_context(compute_cell_message), cell, use_llm)
+            for cell in cells
+        }
+        notifications = []
+        for cell, future in cell_futures.items():
+            try:
+                message, metadata, base64_image = future.result()
+            except Exception as e:
+                log(f"Failed to compute the weather message for cell {cell}: {e}")
+                continue
+            for user in cells[cell]:
+                notification = make_weather_notification(
+                    message, metadata, user, base64_image, fetch_image=False
+                )
+                notifications.append(notification)
+
+    outcomes = list(deliver_notifications(notifications).values())
+    output = {
+        "status": "success",
+        "devices": len(device_ids),
+        "cells": len(cells),
+        "sent": outcomes.count("sent"),
+        "queued": outcomes.count("queued"),
+        "failed": len(outcomes) - outcomes.count("sent") - outcomes.count("queued"),
+        "failed_devices": failed_devices,
+    }
+    log(f"Weather fan-out finished: {output}")
+    return output
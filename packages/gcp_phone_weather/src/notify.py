@@ -0,0 +1,320 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import requests
+import concurrent.futures
+from datetime import datetime, timezone
+from gcp_pal import Firestore
+from gcp_pal.utils import log
+
+from packages.firestore_usage import in_current_context
+
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+PENDING_NOTIFICATIONS_PATH = "notifications/pending/pushover"
+# Pushover asks clients not to open more than 2 concurrent connections
+PUSHOVER_MAX_CONCURRENCY = 2
+# The credentials are not persisted with the queued notifications, but re-attached from the environment
+CREDENTIAL_FIELDS = ["token", "user"]
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter which spaces out the requests by at least `min_interval` seconds.
+    """
+
+    def __init__(self, min_interval=0.5):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        """
+        Block until the next request is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def make_notification(message, title, user=None, token=None, **fields):
+    """
+    Make a Pushover notification which can be delivered now or persisted for later.
+
+    Args:
+    - message (str): The message to send.
+    - title (str): The title of the notification.
+    - user (str): The Pushover user key. Defaults to the env variable `PUSHOVER_USER_KEY`.
+    - token (str): The Pushover application token. Defaults to the env variable `PUSHOVER_WEATHER_API_TOKEN`.
+    - fields (dict): Any other Pushover fields (e.g. `priority`, `attachment_base64`).
+
+    Returns:
+    - dict: The notification.
+    """
+    data = {
+        "token": token or os.environ["PUSHOVER_WEATHER_API_TOKEN"],
+        "user": user or os.environ["PUSHOVER_USER_KEY"],
+        "title": title,
+        "message": message,
+        **fields,
+    }
+    data = {key: value for key, value in data.items() if value is not None}
+    notification = {
+        "id": uuid.uuid4().hex,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "attempts": 0,
+        "data": data,
+    }
+    return notification
+
+
+def post_notification(notification, timeout=10):
+    """
+    Make a single attempt to deliver a notification to Pushover.
+
+    Args:
+    - notification (dict): The notification (see `make_notification`).
+    - timeout (float): The timeout of the request in seconds.
+
+    Returns:
+    - str: "sent", "retry" (network error, rate limit or server error), "rejected" (invalid request)
+      or "exhausted" (the monthly message limit of the application is reached).
+    """
+    notification["attempts"] += 1
+    try:
+        response = requests.post(PUSHOVER_URL, data=notification["data"], timeout=timeout)
+    except requests.RequestException as e:
+        log(f"Failed to reach Pushover: {e}")
+        return "retry"
+    if response.status_code == 200:
+        if response.headers.get("X-Limit-App-Remaining") == "0":
+            log("Pushover message limit reached.")
+        return "sent"
+    if response.status_code == 429:
+        if response.headers.get("X-Limit-App-Remaining") == "0":
+            return "exhausted"
+        return "retry"
+    if response.status_code >= 500:
+        return "retry"
+    log(f"Pushover rejected the notification: {response.text}")
+    return "rejected"
+
+
+def deliver_notification(
+    notification, rate_limiter, max_attempts=4, backoff=1.0, deadline=None
+):
+    """
+    Deliver a notification, retrying with exponential backoff (and jitter) on transient failures.
+
+    Args:
+    - notification (dict): The notification (see `make_notification`).
+    - rate_limiter (RateLimiter): The rate limiter shared by all deliveries.
+    - max_attempts (int): The maximum number of attempts of this delivery.
+    - backoff (float): The delay before the first retry in seconds. It doubles after every attempt.
+    - deadline (float): The `time.monotonic()` after which no more attempts are made.
+
+    Returns:
+    - str: The outcome of the last attempt (see `post_notification`).
+    """
+    outcome = "retry"
+    for attempt in range(max_attempts):
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        rate_limiter.wait()
+        timeout = 10 if deadline is None else max(1.0, deadline - time.monotonic())
+        outcome = post_notification(notification, timeout=min(timeout, 10))
+        if outcome != "retry":
+            break
+        delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+    return outcome
+
+
+def deliver_notifications(
+    notifications,
+    max_workers=PUSHOVER_MAX_CONCURRENCY,
+    min_interval=0.5,
+    max_attempts=4,
+    timeout=None,
+    persist=True,
+):
+    """
+    Deliver notifications concurrently within the Pushover rate limits.
+    The notifications which could not be delivered (yet) are persisted in Firestore to be drained later.
+
+    Args:
+    - notifications (list): The notifications (see `make_notification`).
+    - max_workers (int): The maximum number of concurrent requests.
+    - min_interval (float): The minimum interval between two requests in seconds.
+    - max_attempts (int): The maximum number of attempts per notification in this call.
+    - timeout (float): The time budget of the whole delivery in seconds. Defaults to the env variable
+      `PUSHOVER_TIMEOUT` or 30 seconds.
+    - persist (bool): Whether to persist the undelivered notifications.
+
+    Returns:
+    - dict: The outcome of every notification, keyed by notification ID.
+    """
+    if not notifications:
+        return {}
+    if timeout is None:
+        timeout = float(os.getenv("PUSHOVER_TIMEOUT", 30))
+    deadline = time.monotonic() + timeout
+    rate_limiter = RateLimiter(min_interval)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                in_current_context(deliver_notification),
+                notification,
+                rate_limiter,
+                max_attempts=max_attempts,
+                deadline=deadline,
+            )
+            for notification in notifications
+        ]
+        outcomes = {
+            notification["id"]: future.result()
+            for notification, future in zip(notifications, futures)
+        }
+    undelivered = [n for n in notifications if outcomes[n["id"]] in ["retry", "exhausted"]]
+    if persist and undelivered:
+        for notification_id in persist_notifications(undelivered):
+            outcomes[notification_id] = "queued"
+    sent = sum(outcome == "sent" for outcome in outcomes.values())
+    log(f"Delivered {sent}/{len(notifications)} notifications.")
+    return outcomes
+
+
+def get_recipient_keys():
+    """
+    Get the Pushover user keys of the configured recipients, keyed by the reference persisted in their place:
+    "default" for `PUSHOVER_USER_KEY`, and the device ID for the recipients of `PUSHOVER_RECIPIENTS`.
+
+    Returns:
+    - dict: The user key of every recipient reference.
+    """
+    recipients = json.loads(os.getenv("PUSHOVER_RECIPIENTS") or "{}")
+    if os.getenv("PUSHOVER_USER_KEY"):
+        recipients["default"] = os.environ["PUSHOVER_USER_KEY"]
+    return recipients
+
+
+def get_recipient_reference(user):
+    """
+    Get the reference of a Pushover user key (see `get_recipient_keys`), preferring "default".
+
+    Args:
+    - user (str): The Pushover user key.
+
+    Returns:
+    - str: The reference, or None if the user key is not configured.
+    """
+    references = [reference for reference, key in get_recipient_keys().items() if key == user]
+    return "default" if "default" in references else next(iter(references), None)
+
+
+def persist_notifications(notifications):
+    """
+    Persist undelivered notifications in Firestore so that a later invocation can deliver them.
+    Only the message fields and a reference to the recipient are persisted, not the Pushover credentials
+    (see `restore_notification`). Notifications to a recipient which is not configured cannot be referenced,
+    and are dropped.
+
+    Args:
+    - notifications (list): The notifications (see `make_notification`).
+
+    Returns:
+    - list: The IDs of the persisted notifications.
+    """
+    persisted = []
+    for notification in notifications:
+        recipient = get_recipient_reference(notification["data"].get("user"))
+        if recipient is None:
+            log(f"Not queueing notification {notification['id']}: its recipient is not configured.")
+            continue
+        data = {key: value for key, value in notification["data"].items() if key not in CREDENTIAL_FIELDS}
+        Firestore(f"{PENDING_NOTIFICATIONS_PATH}/{notification['id']}").write(
+            {**notification, "recipient": recipient, "data": data}
+        )
+        persisted.append(notification["id"])
+    log(f"Queued {len(persisted)} undelivered notifications.")
+    return persisted
+
+
+def restore_notification(notification):
+    """
+    Re-attach the current Pushover credentials to a persisted notification (see `persist_notifications`).
+
+    Args:
+    - notification (dict): The persisted notification.
+
+    Returns:
+    - dict: The notification, or None if its recipient is no longer configured.
+    """
+    # Notifications queued before the credentials were stripped still carry the user key
+    recipient = notification.get("recipient") or get_recipient_reference(notification["data"].get("user"))
+    user = get_recipient_keys().get(recipient)
+    if user is None:
+        return None
+    data = {**notification["data"], "token": os.environ["PUSHOVER_WEATHER_API_TOKEN"], "user": user}
+    return {**notification, "data": data}
+
+
+def drain_pending_notifications(max_age_hours=24, created_before=None, **kwargs):
+    """
+    Deliver the notifications persisted by earlier invocations, with the current Pushover credentials.
+    Delivered, rejected and expired notifications (and those whose recipient is no longer configured)
+    are removed from the queue.
+
+    Args:
+    - max_age_hours (float): Notifications older than this are dropped, as they are no longer relevant.
+    - created_before (datetime): If provided, the notifications created since then are left in the queue.
+      A run which just queued its own notification passes its start time, so that it does not wait for
+      the same delivery twice.
+    - kwargs (dict): Passed to `deliver_notifications`.
+
+    Returns:
+    - dict: The outcome of every pending notification, keyed by notification ID.
+    """
+    pending = Firestore(PENDING_NOTIFICATIONS_PATH).read(allow_empty=True)
+    if not pending:
+        return {}
+    now = datetime.now(timezone.utc)
+    notifications, outcomes = {}, {}
+    for notification_id, notification in pending.items():
+        created = datetime.fromisoformat(notification["created"])
+        if created_before is not None and created >= created_before:
+            continue
+        age = now - created
+        if age.total_seconds() > max_age_hours * 3600:
+            outcomes[notification_id] = "expired"
+            continue
+        notification = restore_notification(notification)
+        if notification is None:
+            outcomes[notification_id] = "unknown recipient"
+        else:
+            notifications[notification_id] = notification
+    outcomes.update(deliver_notifications(list(notifications.values()), persist=False, **kwargs))
+    for notification_id, outcome in outcomes.items():
+        if outcome not in ["retry", "exhausted"]:
+            Firestore(f"{PENDING_NOTIFICATIONS_PATH}/{notification_id}").delete()
+    undelivered = [
+        notifications[notification_id]
+        for notification_id, outcome in outcomes.items()
+        if outcome in ["retry", "exhausted"]
+    ]
+    if undelivered:
+        # Keep the attempts count up to date
+        persist_notifications(undelivered)
+    log(f"Drained the notification queue: {outcomes}")
+    return outcomes
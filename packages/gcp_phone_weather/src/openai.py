@@ -7,6 +7,11 @@ import json
 import requests
 
 from packages.gcp_phone_weather.src.weather import print_weather
+from packages.gcp_phone_weather.src.prompt import (
+    encode_weather_compact,
+    estimate_tokens,
+    get_prompt_encoding,
+)
 
 
 PROMPT_1 = """You are presented with a weather forecast for the day.
@@ -23,18 +28,31 @@ The output will be sent as a text message at 6am and will be read first thing in
 E.g. "Temperature 12°C-17°C-14°C. Wind speed 13 km/h. Rain probability 50% over 6 hours. Take umbrella (if applicable)."."""
 
 
-def get_llm_prompt(weather_df=None, metadata=None):
+def get_llm_prompt(weather_df=None, metadata=None, encoding=None, max_tokens=None):
     """
-    Query the OpenAI GPT-3 API.
+    Make the LLM prompt asking for advice on the weather forecast.
 
     Args:
-    - prompt (str): The prompt to query.
+    - weather_df (pd.DataFrame): The weather forecast data.
+    - metadata (dict): The metadata of the location.
+    - encoding (str): How to encode the forecast: "full" or "compact". Defaults to `get_prompt_encoding()`.
+    - max_tokens (int): The token budget of the compact forecast (see `encode_weather_compact`).
 
     Returns:
-    - str: The response from the GPT-3 API.
+    - str: The prompt.
     """
-    weather_string = print_weather(weather_df)
-    prompt = f"""It is 6am. The following is a weather forecast for today:
+    if encoding is None:
+        encoding = get_prompt_encoding()
+    if encoding == "compact":
+        weather_string, _ = encode_weather_compact(weather_df, metadata, max_tokens)
+        prompt = f"""It is 6am. Today's forecast:
+```
+{weather_string}
+```
+{PROMPT_1}"""
+    else:
+        weather_string = print_weather(weather_df)
+        prompt = f"""It is 6am. The following is a weather forecast for today:
 ```
 {weather_string}
 ```
@@ -42,6 +60,7 @@ def get_llm_prompt(weather_df=None, metadata=None):
 Additional metadata:
 {json.dumps(metadata)}
 """
+    print(f"LLM prompt ({encoding}): ~{estimate_tokens(prompt)} tokens.")
     return prompt
 
 
@@ -0,0 +1,230 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import json
+import time
+from gcp_pal.utils import log
+
+from packages.firestore import get_client, get_collection, get_document
+from packages.gcp_phone_weather.src.providers import fetch_forecast, parse_forecast
+from packages.gcp_phone_weather.src.openai import get_llm_prompt, query_openai_prompt
+from packages.gcp_phone_location.src.analysis import haversine
+
+FORECAST_CACHE_PATH = "weather_forecasts/{device_id}"
+# The prefetches requested by the location service, one document per device
+PREFETCH_REQUESTS_PATH = "weather_forecast_requests"
+# Prefetched advice is only reused if it was computed for (roughly) the same forecast window
+MAX_ADVICE_AGE_HOURS = 3
+
+# The last prefetched forecast of every device (without the forecast itself), so that
+# the location updates of a warm instance do not read Firestore to decide whether to prefetch
+LAST_FORECASTS = {}
+# The last prefetch request of every device, so that a warm instance does not request it again while it is pending
+LAST_REQUESTS = {}
+
+
+def get_prefetch_distance_km():
+    """
+    Get the distance from the last forecast location above which the forecast is fetched again.
+
+    Returns:
+    - float: The distance in km. Defaults to the env variable `WEATHER_PREFETCH_DISTANCE_KM` or 20 km.
+    """
+    return float(os.getenv("WEATHER_PREFETCH_DISTANCE_KM", 20))
+
+
+def get_max_forecast_age_hours():
+    """
+    Get the age above which a cached forecast is no longer used.
+
+    Returns:
+    - float: The age in hours. Defaults to the env variable `WEATHER_FORECAST_MAX_AGE_HOURS` or 6 hours.
+    """
+    return float(os.getenv("WEATHER_FORECAST_MAX_AGE_HOURS", 6))
+
+
+def read_cached_forecast(device_id):
+    """
+    Read the cached forecast of a device from Firestore.
+
+    Args:
+    - device_id (str): The device ID.
+
+    Returns:
+    - dict: The cached forecast (see `prefetch_forecast`), or None if there is none.
+    """
+    path = FORECAST_CACHE_PATH.format(device_id=device_id)
+    return get_document(path).get().to_dict()
+
+
+def is_forecast_usable(cached, latitude, longitude, now=None):
+    """
+    Check whether a cached forecast is recent enough and close enough to a location.
+
+    Args:
+    - cached (dict): The cached forecast (see `prefetch_forecast`).
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+    - now (float): The current UTC epoch. Defaults to the current time.
+
+    Returns:
+    - bool: True if the cached forecast can be used for the location.
+    """
+    if not cached:
+        return False
+    now = time.time() if now is None else now
+    if now - cached["fetched_at"] > get_max_forecast_age_hours() * 3600:
+        return False
+    return is_within_prefetch_distance(cached, latitude, longitude)
+
+
+def is_within_prefetch_distance(reference, latitude, longitude):
+    """
+    Check whether a location is close enough to the location of a forecast (or of a prefetch request)
+    for the forecast to be used there.
+
+    Args:
+    - reference (dict): The forecast or request, with its `latitude` and `longitude`.
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+
+    Returns:
+    - bool: True if the location is within `get_prefetch_distance_km`.
+    """
+    distance_m = haversine(reference["latitude"], reference["longitude"], latitude, longitude)
+    return distance_m <= get_prefetch_distance_km() * 1000
+
+
+def prefetch_forecast(device_id, latitude, longitude, with_advice=None):
+    """
+    Fetch the weather forecast of a location ahead of time and cache it in Firestore.
+    The raw forecast is cached, so that it is parsed for the right time window when it is used.
+
+    Args:
+    - device_id (str): The device ID.
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+    - with_advice (bool): Whether to also compute the LLM advice. Defaults to the env variable
+      `WEATHER_PREFETCH_ADVICE` or False.
+
+    Returns:
+    - dict: The cached forecast. Schema:
+        - latitude (float): The latitude of the forecast location.
+        - longitude (float): The longitude of the forecast location.
+        - fetched_at (int): The UTC epoch of the fetch.
+        - provider (str): The provider of the forecast (see `fetch_forecast`).
+        - forecast (str): The raw forecast of the provider as JSON.
+        - advice (str): The LLM advice, if computed.
+      None if the forecast could not be fetched.
+    """
+    if with_advice is None:
+        with_advice = os.getenv("WEATHER_PREFETCH_ADVICE", "false").lower() == "true"
+    try:
+        forecast = fetch_forecast(latitude, longitude)
+    except RuntimeError as e:
+        log(f"Failed to prefetch the weather forecast: {e}")
+        return None
+    cached = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "fetched_at": int(time.time()),
+        "provider": forecast["provider"],
+        "forecast": json.dumps(forecast["forecast"]),
+    }
+    if with_advice:
+        prompt = get_llm_prompt(forecast["weather"], forecast["metadata"])
+        cached["advice"] = query_openai_prompt(prompt)
+    get_document(FORECAST_CACHE_PATH.format(device_id=device_id)).set(cached)
+    LAST_FORECASTS[device_id] = {k: v for k, v in cached.items() if k != "forecast"}
+    log(f"Prefetched the weather forecast for device {device_id}.")
+    return cached
+
+
+def request_prefetch_if_moved(device_id, latitude, longitude):
+    """
+    Request the prefetch of the weather forecast if the device moved far from the location of its cached
+    forecast (or of its last request). Only the request is written here: the forecast is fetched by the
+    "prefetch" task (see `prefetch_requested_forecasts`), so that storing a location never waits for the
+    weather providers or the LLM.
+
+    Args:
+    - device_id (str): The device ID.
+    - latitude (float): The latitude of the device.
+    - longitude (float): The longitude of the device.
+
+    Returns:
+    - bool: True if the prefetch was requested.
+    """
+    reference = LAST_REQUESTS.get(device_id) or LAST_FORECASTS.get(device_id)
+    if reference is None:
+        cached = read_cached_forecast(device_id)
+        if cached:
+            reference = LAST_FORECASTS[device_id] = {k: v for k, v in cached.items() if k != "forecast"}
+    if reference is not None and is_within_prefetch_distance(reference, latitude, longitude):
+        return False
+    request = {"latitude": latitude, "longitude": longitude, "requested_at": int(time.time())}
+    get_document(f"{PREFETCH_REQUESTS_PATH}/{device_id}").set(request)
+    LAST_REQUESTS[device_id] = request
+    log(f"Requested the prefetch of the weather forecast for device {device_id}.")
+    return True
+
+
+def prefetch_requested_forecasts():
+    """
+    Prefetch the weather forecasts requested by the location service (see `request_prefetch_if_moved`).
+    A request is removed once its forecast is cached, unless the device moved again in the meantime;
+    failed requests are kept for the next run.
+
+    Returns:
+    - dict: The outcome of every request ("prefetched" or "failed"), keyed by device ID.
+    """
+    client = get_client()
+    outcomes = {}
+    for snapshot in get_collection(PREFETCH_REQUESTS_PATH).stream():
+        device_id = snapshot.id
+        request = snapshot.to_dict()
+        try:
+            cached = prefetch_forecast(device_id, request["latitude"], request["longitude"])
+        except Exception as e:
+            log(f"Failed to prefetch the weather forecast for device {device_id}: {e}")
+            cached = None
+        if cached is None:
+            outcomes[device_id] = "failed"
+            continue
+        outcomes[device_id] = "prefetched"
+        # Only delete the request if no newer one was written in the meantime
+        try:
+            snapshot.reference.delete(option=client.write_option(last_update_time=snapshot.update_time))
+        except Exception as e:
+            log(f"Device {device_id} moved again while prefetching: {e}")
+    return outcomes
+
+
+def get_cached_forecast(latitude, longitude, device_id=None):
+    """
+    Get the prefetched weather forecast of a device, if it can be used for its current location.
+
+    Args:
+    - latitude (float): The latitude of the device.
+    - longitude (float): The longitude of the device.
+    - device_id (str): The device ID. Defaults to the env variable `FOLLOWMEE_DEVICE_ID`.
+
+    Returns:
+    - tuple: The parsed forecast and metadata (see `parse_weather_forecast`) and the prefetched advice
+      (None if there is none or it is too old), or None if there is no usable forecast.
+    """
+    if device_id is None:
+        device_id = os.environ["FOLLOWMEE_DEVICE_ID"]
+    cached = read_cached_forecast(device_id)
+    if not is_forecast_usable(cached, latitude, longitude):
+        return None
+    # Forecasts cached before the providers were introduced are from OpenWeatherMap
+    provider = cached.get("provider", "openweathermap")
+    weather_df, metadata = parse_forecast(provider, json.loads(cached["forecast"]))
+    advice = cached.get("advice")
+    if time.time() - cached["fetched_at"] > MAX_ADVICE_AGE_HOURS * 3600:
+        advice = None
+    log(f"Using the weather forecast prefetched for device {device_id}.")
+    return weather_df, metadata, advice
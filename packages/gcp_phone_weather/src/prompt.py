@@ -0,0 +1,168 @@
+import os
+import re
+import pandas as pd
+
+# The columns of the compact encoding: {name: (description, function of a forecast row)}
+COMPACT_COLUMNS = {
+    "h": ("hour", lambda row: row["timestamp"].strftime("%H")),
+    "wx": ("weather", lambda row: row["weather"]),
+    "t": ("temp °C", lambda row: f"{row['temp']:.0f}"),
+    "fl": ("feels like °C", lambda row: f"{row['temp_feels_like']:.0f}"),
+    "w": ("wind km/h", lambda row: f"{row['wind_speed']:.0f}"),
+    "g": ("gust km/h", lambda row: f"{row['wind_gust']:.0f}"),
+    "p": ("precip prob %", lambda row: f"{100 * row['prob_precip']:.0f}"),
+    "r": ("rain mm", lambda row: f"{row['rain']:.1f}".rstrip("0").rstrip(".")),
+    "s": ("snow mm", lambda row: f"{row['snow']:.1f}".rstrip("0").rstrip(".")),
+    "c": ("cloud %", lambda row: f"{row['cloudiness']:.0f}"),
+}
+# The columns dropped first when the forecast is over the token budget (the least decision-relevant first)
+COMPACT_DROP_ORDER = ["c", "g", "w", "fl"]
+DEFAULT_PROMPT_MAX_TOKENS = 250
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a prompt. Uses `tiktoken` if it is installed, otherwise counts the
+    words, numbers and punctuation marks (about one token each in the tabular encodings).
+
+    Args:
+    - text (str): The prompt.
+
+    Returns:
+    - int: The estimated number of tokens.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return len(re.findall(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]", text))
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+def get_prompt_max_tokens():
+    """
+    Get the token budget of the compact forecast, from the env variable `WEATHER_PROMPT_MAX_TOKENS`.
+
+    Returns:
+    - int: The maximum number of tokens.
+    """
+    return int(os.getenv("WEATHER_PROMPT_MAX_TOKENS", DEFAULT_PROMPT_MAX_TOKENS))
+
+
+def merge_forecast_steps(weather_df):
+    """
+    Merge every two consecutive forecast steps into one, keeping the worst of each pair
+    (the weather of the wetter step, the lowest feels-like temperature, the strongest wind).
+
+    Args:
+    - weather_df (pd.DataFrame): The weather forecast data (see `parse_weather_forecast`).
+
+    Returns:
+    - pd.DataFrame: The merged forecast, with half as many steps.
+    """
+    merged = []
+    for i in range(0, len(weather_df), 2):
+        steps = weather_df.iloc[i : i + 2]
+        wettest = steps.loc[steps["prob_precip"].astype(float).idxmax()]
+        merged.append(
+            {
+                "timestamp": steps["timestamp"].iloc[0],
+                "weather": wettest["weather"],
+                "temp": steps["temp"].astype(float).mean(),
+                "temp_feels_like": steps["temp_feels_like"].astype(float).min(),
+                "wind_speed": steps["wind_speed"].astype(float).max(),
+                "wind_gust": steps["wind_gust"].astype(float).max(),
+                "prob_precip": steps["prob_precip"].astype(float).max(),
+                "rain": steps["rain"].astype(float).sum(),
+                "snow": steps["snow"].astype(float).sum(),
+                "cloudiness": steps["cloudiness"].astype(float).mean(),
+            }
+        )
+    return pd.DataFrame(merged)
+
+
+def encode_table(weather_df, columns):
+    """
+    Encode the forecast as a terse table: a legend, a header and one "|"-separated line per step.
+
+    Args:
+    - weather_df (pd.DataFrame): The weather forecast data.
+    - columns (list): The names of the `COMPACT_COLUMNS` to keep.
+
+    Returns:
+    - str: The table.
+    """
+    legend = ", ".join(f"{column}={COMPACT_COLUMNS[column][0]}" for column in columns)
+    if len(weather_df) > 1:
+        step_h = (weather_df["timestamp"].iloc[1] - weather_df["timestamp"].iloc[0]).total_seconds() / 3600
+        legend += f" ({step_h:g}h steps)"
+    lines = [legend, "|".join(columns)]
+    for _, row in weather_df.iterrows():
+        lines.append("|".join(COMPACT_COLUMNS[column][1](row) for column in columns))
+    return "\n".join(lines)
+
+
+def encode_weather_compact(weather_df, metadata=None, max_tokens=None):
+    """
+    Encode the forecast for the LLM prompt with only the decision-relevant fields (those the advice rules
+    use, see `get_rule_advice`) as a terse table, within a token budget. The rain and snow columns are
+    replaced by a note when they are all zero. Over the budget, the least relevant columns are dropped
+    (`COMPACT_DROP_ORDER`), then consecutive steps are merged, keeping the worst of each pair.
+
+    Args:
+    - weather_df (pd.DataFrame): The weather forecast data (see `parse_weather_forecast`).
+    - metadata (dict): The metadata of the location (name, country, sunrise and sunset).
+    - max_tokens (int): The token budget of the encoded forecast. Defaults to `get_prompt_max_tokens()`.
+
+    Returns:
+    - tuple: The encoded forecast and its estimated number of tokens.
+    """
+    if max_tokens is None:
+        max_tokens = get_prompt_max_tokens()
+    weather_df = weather_df.copy()
+    weather_df["timestamp"] = pd.to_datetime(weather_df["timestamp"])
+
+    notes = []
+    if metadata:
+        place = ", ".join(part for part in [metadata.get("name"), metadata.get("country")] if part)
+        sun = [
+            f"{event} {pd.to_datetime(metadata[event]).strftime('%H:%M')}"
+            for event in ["sunrise", "sunset"]
+            if metadata.get(event)
+        ]
+        notes.append("; ".join([place] + sun))
+    columns = list(COMPACT_COLUMNS)
+    for column, field in [("r", "rain"), ("s", "snow")]:
+        if (weather_df[field].astype(float) == 0).all():
+            columns.remove(column)
+            notes.append(f"no {field}")
+    header = "; ".join(note for note in notes if note)
+
+    def encode():
+        text = "\n".join(part for part in [header, encode_table(weather_df, columns)] if part)
+        return text, estimate_tokens(text)
+
+    text, num_tokens = encode()
+    drop_order = [column for column in COMPACT_DROP_ORDER if column in columns]
+    while num_tokens > max_tokens and (drop_order or len(weather_df) > 1):
+        if drop_order:
+            columns.remove(drop_order.pop(0))
+        else:
+            weather_df = merge_forecast_steps(weather_df)
+        text, num_tokens = encode()
+    return text, num_tokens
+
+
+def get_prompt_encoding():
+    """
+    Get how the forecast is encoded in the LLM prompt, from the env variable `WEATHER_PROMPT_ENCODING`:
+    "full" (every field of `print_weather` and the metadata as JSON, by default) or "compact"
+    (see `encode_weather_compact`).
+
+    Returns:
+    - str: The encoding.
+    """
+    encoding = os.getenv("WEATHER_PROMPT_ENCODING", "full").lower()
+    if encoding not in ["full", "compact"]:
+        raise ValueError(f"Unknown prompt encoding: {encoding}")
+    return encoding
+
@@ -0,0 +1,367 @@
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import requests
+from gcp_pal.utils import log
+
+from packages.firestore import get_document
+from packages.firestore_usage import in_current_context
+from packages.gcp_phone_weather.src.weather import (
+    query_openweathermap,
+    parse_weather_forecast,
+    select_forecast_window,
+    format_local_time,
+)
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+OPEN_METEO_HOURLY = [
+    "temperature_2m",
+    "apparent_temperature",
+    "pressure_msl",
+    "relative_humidity_2m",
+    "wind_speed_10m",
+    "wind_gusts_10m",
+    "wind_direction_10m",
+    "rain",
+    "showers",
+    "snowfall",
+    "precipitation_probability",
+    "cloud_cover",
+    "weather_code",
+]
+# WMO weather interpretation codes, worded like the OpenWeatherMap descriptions
+WMO_DESCRIPTIONS = {
+    0: "clear sky",
+    1: "few clouds",
+    2: "scattered clouds",
+    3: "overcast clouds",
+    45: "fog",
+    48: "fog",
+    51: "light intensity drizzle",
+    53: "drizzle",
+    55: "heavy intensity drizzle",
+    56: "freezing drizzle",
+    57: "freezing drizzle",
+    61: "light rain",
+    63: "moderate rain",
+    65: "heavy intensity rain",
+    66: "freezing rain",
+    67: "freezing rain",
+    71: "light snow",
+    73: "snow",
+    75: "heavy snow",
+    77: "snow",
+    80: "light shower rain",
+    81: "shower rain",
+    82: "heavy intensity shower rain",
+    85: "light shower snow",
+    86: "heavy shower snow",
+    95: "thunderstorm",
+    96: "thunderstorm with light hail",
+    99: "thunderstorm with heavy hail",
+}
+# The WMO codes from the least to the most severe weather: the codes themselves are not ordered by severity
+# (e.g. fog is 45, above overcast clouds and below drizzle, and showers are 80-82, above snow)
+WMO_SEVERITY = {
+    code: rank
+    for rank, code in enumerate(
+        [0, 1, 2, 3, 45, 48, 51, 53, 55, 61, 80, 63, 81, 65, 82, 56, 57, 66, 67, 71, 85, 73, 77, 75, 86, 95, 96, 99]
+    )
+}
+
+# Recent latencies (seconds) of every provider, shared by the invocations of a warm instance
+# and persisted so that cold starts hedge with the same delays
+PROVIDER_LATENCIES_PATH = "weather_providers/latencies"
+PROVIDER_LATENCIES = {}
+PROVIDER_LATENCIES_LOCK = threading.Lock()
+MAX_LATENCY_SAMPLES = 100
+# The hedging delay is only derived from the latencies once there are enough of them
+MIN_LATENCY_SAMPLES = 5
+DEFAULT_HEDGE_DELAY_S = 1.0
+# The losing requests finish in the background, so the pool is not tied to one call
+HEDGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+
+def query_open_meteo(latitude, longitude, timeout=10):
+    """
+    Query the weather forecast from the Open-Meteo API (no API key needed).
+
+    Args:
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+    - timeout (float): The timeout of the request in seconds.
+
+    Returns:
+    - dict: The raw hourly weather forecast data, with UNIX times.
+    """
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": ",".join(OPEN_METEO_HOURLY),
+        "daily": "sunrise,sunset",
+        "timezone": "auto",
+        "timeformat": "unixtime",
+        "forecast_days": 3,
+    }
+    response = requests.get(OPEN_METEO_URL, params=params, timeout=timeout)
+    return response.json()
+
+
+def parse_open_meteo_forecast(weather_forecast):
+    """
+    Parse the Open-Meteo forecast to the schema of `parse_weather_forecast`. The hourly steps are
+    grouped into the 3-hour steps of OpenWeatherMap: the rain and snow are summed over the step,
+    the probability of precipitation and the weather are the worst of the step (see `WMO_SEVERITY`),
+    the rest is taken at its start.
+
+    Args:
+    - weather_forecast (dict): The raw forecast (see `query_open_meteo`).
+
+    Returns:
+    - tuple: The parsed forecast and the metadata of the location (see `parse_weather_forecast`).
+    """
+    hourly = weather_forecast["hourly"]
+    df = pd.DataFrame(hourly)
+    df["timestamp"] = pd.to_datetime(df["time"], unit="s")
+    df["step"] = df["timestamp"].dt.floor("3h")
+    # Open-Meteo splits the rain into large-scale rain and convective showers; OpenWeatherMap's rain is both
+    df["total_rain"] = df["rain"].fillna(0) + df["showers"].fillna(0)
+    df["severity"] = df["weather_code"].map(WMO_SEVERITY).fillna(-1)
+    steps = df.groupby("step", sort=True)
+    worst_codes = steps["severity"].idxmax().map(df["weather_code"])
+    parsed_forecast = pd.DataFrame(
+        {
+            "timestamp": steps["step"].first(),
+            "weather": worst_codes.map(WMO_DESCRIPTIONS).fillna("unknown"),
+            "temp": steps["temperature_2m"].first(),
+            "temp_feels_like": steps["apparent_temperature"].first(),
+            "pressure": steps["pressure_msl"].first(),
+            "humidity": steps["relative_humidity_2m"].first(),
+            "wind_speed": steps["wind_speed_10m"].first(),
+            "wind_gust": steps["wind_gusts_10m"].first(),
+            "wind_direction": steps["wind_direction_10m"].first(),
+            "rain": steps["total_rain"].sum(),
+            # Snowfall is in cm of snow, which is about as many mm of water (OpenWeatherMap's unit)
+            "snow": steps["snowfall"].sum(),
+            # OpenWeatherMap's "pop" is a fraction
+            "prob_precip": steps["precipitation_probability"].max().fillna(0) / 100,
+            "cloudiness": steps["cloud_cover"].first(),
+        }
+    ).reset_index(drop=True)
+    parsed_forecast = select_forecast_window(parsed_forecast)
+
+    # Open-Meteo does not name the location (and the city of its time zone can be hundreds of km away)
+    utc_offset_seconds = weather_forecast["utc_offset_seconds"]
+    metadata = {
+        "name": f"{weather_forecast['latitude']:.2f}, {weather_forecast['longitude']:.2f}",
+        "country": "",
+        "timezone": utc_offset_seconds / 3600,
+        "sunrise": format_local_time(weather_forecast["daily"]["sunrise"][0], utc_offset_seconds),
+        "sunset": format_local_time(weather_forecast["daily"]["sunset"][0], utc_offset_seconds),
+    }
+    return parsed_forecast, metadata
+
+
+# The forecast providers: how to query them and how to parse their forecast
+PROVIDERS = {
+    "openweathermap": (query_openweathermap, parse_weather_forecast),
+    "open-meteo": (query_open_meteo, parse_open_meteo_forecast),
+}
+
+
+def get_providers():
+    """
+    Get the forecast providers to use, from the env variable `WEATHER_PROVIDERS`
+    (comma-separated, "openweathermap,open-meteo" by default).
+
+    Returns:
+    - list: The names of the providers.
+    """
+    providers = os.getenv("WEATHER_PROVIDERS", "openweathermap,open-meteo")
+    providers = [provider.strip() for provider in providers.split(",") if provider.strip()]
+    for provider in providers:
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown weather provider: {provider}")
+    return providers
+
+
+def parse_forecast(provider, weather_forecast):
+    """
+    Parse the raw forecast of a provider to the schema of `parse_weather_forecast`.
+
+    Args:
+    - provider (str): The name of the provider.
+    - weather_forecast (dict): The raw forecast of the provider.
+
+    Returns:
+    - tuple: The parsed forecast and the metadata of the location.
+    """
+    _, parse = PROVIDERS[provider]
+    return parse(weather_forecast)
+
+
+def load_provider_latencies():
+    """
+    Load the persisted latencies of the providers, once per process.
+
+    Returns:
+    - dict: The recent latencies of every provider.
+    """
+    with PROVIDER_LATENCIES_LOCK:
+        if PROVIDER_LATENCIES:
+            return PROVIDER_LATENCIES
+    try:
+        latencies = get_document(PROVIDER_LATENCIES_PATH).get().to_dict() or {}
+    except Exception as e:
+        log(f"Failed to load the weather provider latencies: {e}")
+        latencies = {}
+    with PROVIDER_LATENCIES_LOCK:
+        for provider in PROVIDERS:
+            samples = PROVIDER_LATENCIES.setdefault(
+                provider, collections.deque(maxlen=MAX_LATENCY_SAMPLES)
+            )
+            if not samples:
+                samples.extend(latencies.get(provider, []))
+    return PROVIDER_LATENCIES
+
+
+def record_latency(provider, latency_s):
+    """
+    Record the latency of a successful request to a provider.
+
+    Args:
+    - provider (str): The name of the provider.
+    - latency_s (float): The latency in seconds.
+    """
+    latencies = load_provider_latencies()
+    with PROVIDER_LATENCIES_LOCK:
+        latencies[provider].append(round(latency_s, 4))
+
+
+def save_provider_latencies():
+    """
+    Persist the recent latencies of the providers for the next cold starts.
+    """
+    with PROVIDER_LATENCIES_LOCK:
+        latencies = {provider: list(samples) for provider, samples in PROVIDER_LATENCIES.items()}
+    try:
+        get_document(PROVIDER_LATENCIES_PATH).set(latencies)
+    except Exception as e:
+        log(f"Failed to save the weather provider latencies: {e}")
+
+
+def get_median_latency(provider):
+    """
+    Get the median latency of a provider.
+
+    Args:
+    - provider (str): The name of the provider.
+
+    Returns:
+    - float: The median latency in seconds, or None if there are too few samples.
+    """
+    samples = load_provider_latencies()[provider]
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return None
+    return float(np.median(samples))
+
+
+def get_hedge_delay(provider, percentile=None):
+    """
+    Get how long to wait for a provider before sending the hedged request to the next one:
+    a percentile of its recent latencies, so that only its slowest requests are hedged
+    (about a quarter of them with the default, which cuts the tail latency by a third or more).
+
+    Args:
+    - provider (str): The name of the provider.
+    - percentile (float): The percentile of the latencies. Defaults to the env variable
+      `WEATHER_HEDGE_PERCENTILE` or 75.
+
+    Returns:
+    - float: The delay in seconds.
+    """
+    if percentile is None:
+        percentile = float(os.getenv("WEATHER_HEDGE_PERCENTILE", 75))
+    samples = load_provider_latencies()[provider]
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return DEFAULT_HEDGE_DELAY_S
+    return float(np.percentile(samples, percentile))
+
+
+def fetch_provider(provider, latitude, longitude):
+    """
+    Query and parse the forecast of a provider. An error or an empty forecast raises.
+
+    Args:
+    - provider (str): The name of the provider.
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+
+    Returns:
+    - dict: The forecast. Schema:
+        - provider (str): The name of the provider.
+        - forecast (dict): The raw forecast.
+        - weather (pd.DataFrame): The parsed forecast (see `parse_weather_forecast`).
+        - metadata (dict): The metadata of the location.
+    """
+    query, parse = PROVIDERS[provider]
+    start = time.perf_counter()
+    forecast = query(latitude, longitude)
+    latency_s = time.perf_counter() - start
+    weather, metadata = parse(forecast)
+    if weather.empty:
+        raise ValueError(f"The forecast of {provider} is empty.")
+    record_latency(provider, latency_s)
+    return {"provider": provider, "forecast": forecast, "weather": weather, "metadata": metadata}
+
+
+def fetch_forecast(latitude, longitude, providers=None):
+    """
+    Fetch the weather forecast with hedged requests. The provider with the lowest median latency is queried
+    first, and the next one is also queried if it has not answered within its hedging delay
+    (see `get_hedge_delay`) or as soon as it fails. The first valid forecast wins.
+
+    Args:
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+    - providers (list): The names of the providers. Defaults to `get_providers()`.
+
+    Returns:
+    - dict: The forecast (see `fetch_provider`).
+    """
+    providers = providers or get_providers()
+    load_provider_latencies()
+    # Providers without enough samples keep their configured order, after the measured ones
+    medians = {provider: get_median_latency(provider) for provider in providers}
+    remaining = sorted(
+        providers, key=lambda provider: (medians[provider] is None, medians[provider] or 0)
+    )
+    pending = {}
+    errors = []
+    while remaining or pending:
+        if remaining:
+            provider = remaining.pop(0)
+            future = HEDGE_EXECUTOR.submit(in_current_context(fetch_provider), provider, latitude, longitude)
+            pending[future] = provider
+            timeout = get_hedge_delay(provider) if remaining else None
+        else:
+            timeout = None
+        done, _ = concurrent.futures.wait(
+            pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                output = future.result()
+            except Exception as e:
+                errors.append(f"{provider}: {e}")
+                continue
+            if len(pending) or errors:
+                log(f"Weather forecast from {provider} (hedged, errors: {errors}).")
+            threading.Thread(target=in_current_context(save_provider_latencies), daemon=True).start()
+            return output
+    raise RuntimeError(f"No weather provider answered: {errors}")
@@ -3,14 +3,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import base64
-import requests
-from gcp_pal import Firestore
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 
+from packages.firestore import get_client, get_firestore
+from packages.gcp_phone_weather.src.notify import make_notification, deliver_notifications
 from packages.gcp_phone_weather.src.openai import get_llm_prompt, query_openai_prompt
+from packages.gcp_phone_weather.src.advice import get_rule_advice, compare_advice
 
 
 def obtain_recent_coordinates(device_id=None):
@@ -29,11 +29,11 @@ def obtain_recent_coordinates(device_id=None):
     firestore_time_path = (
         f"device_locations/last_updated_times/{device_id}/last_updated_time"
     )
-    last_updated_time = Firestore(firestore_time_path).read()
+    last_updated_time = get_firestore(firestore_time_path).read()
     firestore_location_path = (
         f"device_locations/devices/{device_id}/{last_updated_time}"
     )
-    last_location = Firestore(firestore_location_path).read()
+    last_location = get_client().document(firestore_location_path).get().to_dict()
     latitude = last_location["Latitude"]
     longitude = last_location["Longitude"]
     return latitude, longitude
@@ -71,81 +71,130 @@ def get_weather_image_icon(metadata):
     return image_data
 
 
-def send_text_message(message, metadata):
+def make_weather_notification(
+    message, metadata, user=None, base64_image=None, fetch_image=True
+):
     """
-    Send a notification to the phone using Pushover API.
+    Make the weather notification for the Pushover delivery queue.
 
     Args:
     - message (str): The message to send.
     - metadata (dict): The metadata of the location.
+    - user (str): The Pushover user key of the recipient. Defaults to the env variable `PUSHOVER_USER_KEY`.
+    - base64_image (str): The weather image icon to attach, if already obtained.
+    - fetch_image (bool): Whether to get the weather image icon if it is not provided.
+
+    Returns:
+    - dict: The notification.
     """
     city = metadata["name"]
     message = f"{city} Weather:\n{message}"
-    try:
-        base64_image = get_weather_image_icon(metadata)
-    except Exception as e:
-        # print(f"Failed to get weather image icon. Passing")
-        base64_image = None
-    # base64_image = base64.b64encode(base64_image).decode("utf-8")
-    url = "https://api.pushover.net/1/messages.json"
-    data = {
-        "token": os.environ["PUSHOVER_WEATHER_API_TOKEN"],
-        "user": os.environ["PUSHOVER_USER_KEY"],
-        "title": "Weather Forecast",
-        "message": message,
-        "priority": 0,
-        "attachment_base64": base64_image,
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
+    if base64_image is None and fetch_image:
+        try:
+            base64_image = get_weather_image_icon(metadata)
+        except Exception as e:
+            # print(f"Failed to get weather image icon. Passing")
+            base64_image = None
+    notification = make_notification(
+        message,
+        title="Weather Forecast",
+        user=user,
+        priority=0,
+        attachment_base64=base64_image,
+    )
+    return notification
+
+
+def send_text_message(message, metadata, user=None, base64_image=None, fetch_image=True):
+    """
+    Send a notification to the phone using Pushover API.
+    Transient failures are retried, and the notification is queued for a later run if it still fails.
+
+    Args:
+    - message (str): The message to send.
+    - metadata (dict): The metadata of the location.
+    - user (str): The Pushover user key of the recipient. Defaults to the env variable `PUSHOVER_USER_KEY`.
+    - base64_image (str): The weather image icon to attach, if already obtained.
+    - fetch_image (bool): Whether to get the weather image icon if it is not provided.
+
+    Returns:
+    - dict: The status of the notification: "success", "queued" or "failure".
+    """
+    notification = make_weather_notification(
+        message, metadata, user, base64_image, fetch_image
+    )
+    outcome = deliver_notifications([notification])[notification["id"]]
+    if outcome == "sent":
         print("Notification sent.")
         return {"status": "success"}
+    if outcome == "queued":
+        print("Notification queued for a later run.")
+        return {"status": "queued"}
     print("Failed to send notification.")
     return {"status": "failure"}
 
 
-def compute_text_message(weather_df, metadata, use_llm=True):
+def get_forecast_summary(weather_df):
+    """
+    Summarise the weather forecast as one short line per time step, e.g. "9am: 12°C 🌧️".
+
+    Args:
+    - weather_df (pd.DataFrame): The weather forecast data.
+
+    Returns:
+    - str: The summary.
+    """
+    temps = weather_df.temp.apply(lambda x: round(x, 0)).astype(int)
+    conds = weather_df.weather
+    # Abbreviate the weather conditions to only keep first 2 letters of every word
+    cond_dict = {
+        "clear sky": "☀️",
+        "few clouds": "🌤️",
+        "scattered clouds": "🌥️",
+        "broken clouds": "☁️",
+        "shower rain": "🌧️🌧️",
+        "rain": "🌧️",
+        "thunderstorm": "⛈️",
+        "snow": "❄️",
+        "mist": "🌫️",
+    }
+    conds = conds.apply(lambda x: cond_dict.get(x, x))
+    timestamps = weather_df.timestamp.dt.strftime("%I%p").str.lower()
+    timestamps = timestamps.str.replace("^0", "", regex=True)
+    prefixes = [
+        f"{time}: {temp}°C {cond}" for time, temp, cond in zip(timestamps, temps, conds)
+    ]
+    return "\n".join(prefixes)
+
+
+def compute_text_message(weather_df, metadata, use_llm=None, advice=None):
     """
     Compute the text message to send based on the weather forecast.
-    Can either use the LLM model for text generation or a simple rule-based approach.
+    The advice either comes from the LLM model or from the deterministic rules (see `get_rule_advice`),
+    which are also the fallback if the LLM model fails.
 
     Args:
     - weather_df (pd.DataFrame): The weather forecast data.
     - metadata (dict): The metadata of the location.
-    - use_llm (bool): Whether to use the LLM model.
+    - use_llm (bool): Whether to use the LLM model. Defaults to the env variable
+      `WEATHER_ADVICE_ENGINE` ("llm" or "rules", "llm" by default).
+    - advice (str): The advice, if already obtained (e.g. prefetched).
 
     Returns:
     - str: The text message to send.
     """
-    if use_llm:
-        prompt = get_llm_prompt(weather_df, metadata)
-        message = query_openai_prompt(prompt)
-        temps = weather_df.temp.apply(lambda x: round(x, 0)).astype(int)
-        conds = weather_df.weather
-        # Abbreviate the weather conditions to only keep first 2 letters of every word
-        cond_dict = {
-            "clear sky": "☀️",
-            "few clouds": "🌤️",
-            "scattered clouds": "🌥️",
-            "broken clouds": "☁️",
-            "shower rain": "🌧️🌧️",
-            "rain": "🌧️",
-            "thunderstorm": "⛈️",
-            "snow": "❄️",
-            "mist": "🌫️",
-        }
-        conds = conds.apply(lambda x: cond_dict.get(x, x))
-        timestamps = weather_df.timestamp.dt.strftime("%I%p").str.lower()
-        timestamps = timestamps.str.replace("^0", "", regex=True)
-        prefixes = [
-            f"{time}: {temp}°C {cond}"
-            for time, temp, cond in zip(timestamps, temps, conds)
-        ]
-        prefix = "\n".join(prefixes)
-        message = f"{prefix}\n{message}"
-
-    else:
-        from packages.gcp_phone_weather.src.weather import get_message_for_weather
-
-        message = get_message_for_weather(weather_df, metadata)
+    if use_llm is None:
+        use_llm = os.getenv("WEATHER_ADVICE_ENGINE", "llm").lower() == "llm"
+    rule_advice = get_rule_advice(weather_df)
+    if advice is None and use_llm:
+        try:
+            prompt = get_llm_prompt(weather_df, metadata)
+            advice = query_openai_prompt(prompt)
+            # Keep track of how well the rules agree with the LLM
+            print(f"Rule advice agreement: {compare_advice(rule_advice, advice)}")
+        except Exception as e:
+            print(f"Failed to query the LLM model, using the rules instead: {e}")
+    if advice is None:
+        advice = rule_advice
+    message = f"{get_forecast_summary(weather_df)}\n{advice}"
     return message
@@ -5,29 +5,58 @@ load_dotenv()
 import os
 import requests
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 
-def query_weather_forecast(latitude, longitude, parse_output=True):
+def query_weather_forecast(latitude, longitude):
+    """
+    Query the weather forecast from the forecast providers (hedged, see `fetch_forecast`).
+
+    Args:
+    - latitude (float): The latitude of the location.
+    - longitude (float): The longitude of the location.
+
+    Returns:
+    - tuple: The parsed weather forecast and the metadata of the location (see `parse_weather_forecast`).
+    """
+    from packages.gcp_phone_weather.src.providers import fetch_forecast
+
+    forecast = fetch_forecast(latitude, longitude)
+    return forecast["weather"], forecast["metadata"]
+
+
+def query_openweathermap(latitude, longitude, timeout=10):
     """
     Query the weather forecast from the OpenWeatherMap API.
 
     Args:
     - latitude (float): The latitude of the location.
     - longitude (float): The longitude of the location.
+    - timeout (float): The timeout of the request in seconds.
 
     Returns:
-    - dict: The weather forecast data.
+    - dict: The raw weather forecast data.
     """
-    metadata = None
     api_key = os.environ["OPENWEATHERMAP_API_KEY"]
     url = "https://api.openweathermap.org/data/2.5/forecast"
     params = {"lat": latitude, "lon": longitude, "appid": api_key}
-    response = requests.get(url, params=params)
-    output = response.json()
-    if parse_output:
-        output, metadata = parse_weather_forecast(output)
-    return output, metadata
+    response = requests.get(url, params=params, timeout=timeout)
+    return response.json()
+
+
+def format_local_time(epoch, utc_offset_seconds):
+    """
+    Format a UNIX time as the local time of a location, regardless of the time zone of the server.
+
+    Args:
+    - epoch (int): The UNIX time.
+    - utc_offset_seconds (int): The UTC offset of the location in seconds.
+
+    Returns:
+    - str: The local time without offset (e.g. '2024-05-28T04:52:00').
+    """
+    local_time_zone = timezone(timedelta(seconds=utc_offset_seconds))
+    return datetime.fromtimestamp(epoch, local_time_zone).replace(tzinfo=None).isoformat()
 
 
 def parse_city_metadata(city):
@@ -40,15 +69,12 @@ def parse_city_metadata(city):
     Returns:
     - dict: The parsed city metadata.
     """
-    timezone = city["timezone"] / 3600
-    sunrise = city["sunrise"]
-    sunset = city["sunset"]
-    sunrise = datetime.fromtimestamp(sunrise).isoformat()
-    sunset = datetime.fromtimestamp(sunset).isoformat()
+    sunrise = format_local_time(city["sunrise"], city["timezone"])
+    sunset = format_local_time(city["sunset"], city["timezone"])
     metadata = {
         "name": city["name"],
         "country": city["country"],
-        "timezone": timezone,
+        "timezone": city["timezone"] / 3600,
         "sunrise": sunrise,
         "sunset": sunset,
     }
@@ -112,18 +138,30 @@ def parse_weather_forecast(weather_forecast):
     parsed_forecast = parsed_forecast.rename(columns={"index": "timestamp"})
     parsed_forecast = parsed_forecast.reset_index(drop=True)
     parsed_forecast["timestamp"] = pd.to_datetime(parsed_forecast["timestamp"])
-    # Get the granularity of the forecast
-    current_time = pd.Timestamp.now()
-    filter_time_min = current_time - pd.Timedelta(hours=1)
-    filter_time_max = current_time + pd.Timedelta(hours=16)
-    query_str = "timestamp >= @filter_time_min and timestamp <= @filter_time_max"
-    parsed_forecast = parsed_forecast.query(query_str)
+    parsed_forecast = select_forecast_window(parsed_forecast)
 
     metadata = parse_city_metadata(weather_forecast["city"])
 
     return parsed_forecast, metadata
 
 
+def select_forecast_window(parsed_forecast):
+    """
+    Keep the steps of a parsed forecast from an hour ago to 16 hours ahead.
+
+    Args:
+    - parsed_forecast (pd.DataFrame): The parsed weather forecast (see `parse_weather_forecast`).
+
+    Returns:
+    - pd.DataFrame: The steps within the window.
+    """
+    current_time = pd.Timestamp.now()
+    filter_time_min = current_time - pd.Timedelta(hours=1)
+    filter_time_max = current_time + pd.Timedelta(hours=16)
+    query_str = "timestamp >= @filter_time_min and timestamp <= @filter_time_max"
+    return parsed_forecast.query(query_str)
+
+
 def print_weather(weather_df):
     """
     Print the weather forecast for the LLM prompt.
@@ -156,23 +194,3 @@ def print_weather(weather_df):
     print_string = "\n".join(print_strings)
     return print_string
 
-
-def get_message_for_weather(weather_df, metadata):
-    """
-    Get the message for the weather forecast.
-
-    Args:
-    - weather_df (pd.DataFrame): The weather forecast data.
-
-    Returns:
-    - str: The message for the weather forecast.
-    """
-    city = metadata["name"]
-    country = metadata["country"]
-    sunrise = metadata["sunrise"]
-    sunset = metadata["sunset"]
-    message = f"Here is the weather forecast for {city}, {country}:\n"
-    message += print_weather(weather_df)
-    message += f"\nSunrise: {sunrise}"
-    message = f"\nSunset: {sunset}"
-    return message
@@ -1,5 +1,12 @@
 import os
+import ast
 import glob
+import json
+import hashlib
+import concurrent.futures
+
+DEPLOY_STATE_PATH = ".deploy_state.json"
+DEPENDENCY_FILES = ["pyproject.toml", "poetry.lock"]
 
 
 def copy_requirements(packages=None):
@@ -27,3 +34,180 @@ def make_requirements():
     os.system(command)
 
     copy_requirements()
+
+
+def resolve_module(module_name):
+    """
+    Resolves a module name to its source file in the repository.
+
+    Args:
+    - module_name (str): The module name (e.g. "packages.gcp_phone_location.main").
+
+    Returns:
+    - str: The path to the source file, or None if the module is not in the repository.
+    """
+    path = module_name.replace(".", "/")
+    for candidate in [f"{path}.py", f"{path}/__init__.py"]:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def get_import_closure(entry_points, prefix="packages"):
+    """
+    Finds all the repository modules which the entry points (transitively) import.
+    Imports are found statically, including the ones made inside functions.
+
+    Args:
+    - entry_points (list): The paths to the entry point files.
+    - prefix (str): Only follow the imports of modules starting with this prefix.
+
+    Returns:
+    - list: The sorted paths to all the source files in the closure (including the entry points).
+    """
+    closure = set()
+    to_visit = list(entry_points)
+    while to_visit:
+        path = to_visit.pop()
+        if path in closure:
+            continue
+        closure.add(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        module_names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                module_names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                module_names.append(node.module)
+                # `from package import module` imports a module too
+                module_names += [f"{node.module}.{alias.name}" for alias in node.names]
+        for module_name in module_names:
+            if not module_name.startswith(prefix):
+                continue
+            parts = module_name.split(".")
+            # The parent packages are imported as well
+            for i in range(1, len(parts) + 1):
+                module_path = resolve_module(".".join(parts[:i]))
+                if module_path is not None and module_path not in closure:
+                    to_visit.append(module_path)
+    return sorted(closure)
+
+
+def hash_files(paths):
+    """
+    Computes a fingerprint of the content of the files.
+
+    Args:
+    - paths (list): The paths to the files. Missing files are hashed as missing.
+
+    Returns:
+    - str: The SHA-256 hex digest of the paths and contents of the files.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(set(paths)):
+        digest.update(path.encode())
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        else:
+            digest.update(b"<missing>")
+    return digest.hexdigest()
+
+
+def read_deploy_state(path=DEPLOY_STATE_PATH):
+    """
+    Reads the fingerprints of the last successful deployments.
+
+    Args:
+    - path (str): The path to the deploy state file.
+
+    Returns:
+    - dict: The fingerprint of every deployed service (and of the requirements).
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_deploy_state(state, path=DEPLOY_STATE_PATH):
+    """
+    Writes the fingerprints of the last successful deployments.
+
+    Args:
+    - state (dict): The fingerprint of every deployed service (and of the requirements).
+    - path (str): The path to the deploy state file.
+    """
+    with open(path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def make_requirements_if_changed(state, force=False):
+    """
+    Makes the requirements.txt files only if the dependencies changed since the last deployment.
+
+    Args:
+    - state (dict): The deploy state, updated in place with the fingerprint of the dependencies.
+    - force (bool): If True, always make the requirements.
+
+    Returns:
+    - bool: True if the requirements were made.
+    """
+    fingerprint = hash_files(DEPENDENCY_FILES)
+    if not force and state.get("requirements") == fingerprint:
+        print("Dependencies unchanged, skipping requirements export.")
+        return False
+    make_requirements()
+    state["requirements"] = fingerprint
+    return True
+
+
+def deploy_services(services, force=False, max_workers=None):
+    """
+    Deploys the services whose source or dependencies changed since their last deployment, in parallel.
+
+    Args:
+    - services (dict): The services to deploy. The keys are the service names and the values are dicts with:
+        - deploy (callable): The function which deploys the service and updates its scheduler.
+        - entry_points (list): The paths to the entry point files of the service.
+        - files (list): Any other files the deployment depends on (e.g. the Dockerfile).
+    - force (bool): If True, deploy all the services regardless of their fingerprints.
+    - max_workers (int): The maximum number of concurrent deployments.
+
+    Returns:
+    - dict: The outcome of every service: "deployed", "skipped" or "failed".
+    """
+    state = read_deploy_state()
+    make_requirements_if_changed(state, force=force)
+
+    fingerprints = {}
+    for name, service in services.items():
+        paths = get_import_closure(service["entry_points"])
+        paths += service.get("files", []) + DEPENDENCY_FILES
+        fingerprints[name] = hash_files(paths)
+    to_deploy = [
+        name
+        for name in services
+        if force or state.get("services", {}).get(name) != fingerprints[name]
+    ]
+    outcomes = {name: "skipped" for name in services if name not in to_deploy}
+    for name in outcomes:
+        print(f"{name}: unchanged, skipping.")
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or max(len(to_deploy), 1)
+    ) as executor:
+        futures = {name: executor.submit(services[name]["deploy"]) for name in to_deploy}
+        for name, future in futures.items():
+            try:
+                future.result()
+                outcomes[name] = "deployed"
+                state.setdefault("services", {})[name] = fingerprints[name]
+            except Exception as e:
+                print(f"{name}: failed to deploy: {e}")
+                outcomes[name] = "failed"
+
+    write_deploy_state(state)
+    return outcomes
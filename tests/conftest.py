@@ -0,0 +1,31 @@
+import pytest
+
+from adhoc.local_firestore import LocalFirestore
+from packages.gcp_phone_location.src import aggregates, compaction, export, location
+from packages.gcp_phone_weather.src import prefetch
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    """
+    The in-memory Firestore stand-in (see `adhoc/local_firestore.py`), used by the location modules
+    instead of the real client. The weather prefetch and the geofences are disabled.
+    """
+    client = LocalFirestore()
+    handles = {
+        "get_client": lambda: client,
+        "get_document": client.document,
+        "get_collection": client.collection,
+        "get_firestore": client.handle,
+        "run_transaction": client.run_transaction,
+        "Firestore": client.handle,
+    }
+    for module in [location, aggregates, compaction, export, prefetch]:
+        for name, handle in handles.items():
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, handle)
+    monkeypatch.setattr(prefetch, "LAST_FORECASTS", {})
+    monkeypatch.setattr(prefetch, "LAST_REQUESTS", {})
+    monkeypatch.setenv("WEATHER_PREFETCH", "false")
+    monkeypatch.delenv("GEOFENCES", raising=False)
+    return client
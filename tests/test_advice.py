@@ -0,0 +1,45 @@
+import json
+import pathlib
+import pytest
+import pandas as pd
+
+from packages.gcp_phone_weather.src.advice import get_advice_topics, get_rule_advice, compare_advice
+
+# Typical LLM answers in the format of `PROMPT_1` (written after its examples, not recorded from the API),
+# with the forecasts they answer and the topics a reader would assign them
+SAMPLE_ADVICE = json.loads((pathlib.Path(__file__).parent / "fixtures" / "llm_advice.json").read_text())
+
+
+@pytest.mark.parametrize("case", SAMPLE_ADVICE, ids=[case["name"] for case in SAMPLE_ADVICE])
+def test_rule_advice_covers_llm_advice(case):
+    weather_df = pd.DataFrame(case["forecast"])
+    comparison = compare_advice(get_rule_advice(weather_df), case["llm_advice"])
+    assert get_advice_topics(case["llm_advice"]) == set(case["llm_topics"])
+    assert set(case["common_topics"]) <= set(comparison["common"])
+
+
+@pytest.mark.parametrize(
+    "advice",
+    ["- Light rain expected.", "- Wear boots, light snow expected.", "- Expect lightning.", "- Wear a lightweight jacket."],
+)
+def test_light_topic_is_only_dressing_light(advice):
+    assert "light" not in get_advice_topics(advice)
+
+
+def test_light_topic():
+    assert "light" in get_advice_topics("- Dress light and stay hydrated.")
+
+
+@pytest.mark.parametrize(
+    "advice, warm",
+    [
+        ("- Dress warmly.", True),
+        ("- Wear a warm jacket.", True),
+        ("- Take a winter coat.", True),
+        ("- Wear a waterproof jacket.", False),
+        ("- Take a raincoat.", False),
+        ("- Wear a lightweight jacket.", False),
+    ],
+)
+def test_warm_topic_is_only_warm_clothing(advice, warm):
+    assert ("warm" in get_advice_topics(advice)) == warm
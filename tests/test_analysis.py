@@ -0,0 +1,59 @@
+import pandas as pd
+
+from packages.gcp_phone_location.src.analysis import cluster_stay_points, detect_stay_points
+
+HOME = (51.5, -0.12)
+# About 300 m north of home: a separate place with `radius_m=200`
+NEIGHBOUR = (51.5027, -0.12)
+
+
+def make_stay_points(stays):
+    """
+    Make stay points from (latitude, longitude, duration) tuples.
+    """
+    return pd.DataFrame(stays, columns=["Latitude", "Longitude", "Duration"])
+
+
+def test_detect_stay_points():
+    # 30 min at home, then moving north, then 20 min at the neighbour
+    points = [(HOME[0], HOME[1], 60 * i) for i in range(31)]
+    points += [(HOME[0] + 0.01 * i, HOME[1], 1800 + 60 * i) for i in range(1, 4)]
+    points += [(NEIGHBOUR[0] + 0.03, NEIGHBOUR[1], 2100 + 60 * i) for i in range(21)]
+    history = pd.DataFrame(points, columns=["Latitude", "Longitude", "Epoch"])
+    stay_points = detect_stay_points(history, radius_m=100, min_duration_s=15 * 60)
+    assert stay_points["Duration"].tolist() == [1800, 1200]
+    assert stay_points["NumPoints"].tolist() == [31, 21]
+    assert stay_points["Latitude"].iloc[0] == HOME[0]
+
+
+def test_stays_are_clustered_into_places():
+    stay_points = make_stay_points([(*HOME, 3600), (*NEIGHBOUR, 600), (HOME[0] + 0.0005, HOME[1], 1800)])
+    stay_points, places = cluster_stay_points(stay_points, radius_m=200)
+    assert stay_points["Place"].tolist() == ["Place 1", "Place 2", "Place 1"]
+    assert places["Place"].tolist() == ["Place 1", "Place 2"]
+    assert places["Visits"].tolist() == [2, 1]
+    assert places["TotalDuration"].tolist() == [5400, 600]
+
+
+def test_known_place_names_its_closest_place_only():
+    # Both places are within 200 m of the known place, which is closer to the neighbour
+    known = (51.5015, -0.12)
+    stay_points = make_stay_points([(*HOME, 3600), (*NEIGHBOUR, 600)])
+    stay_points, places = cluster_stay_points(stay_points, radius_m=200, known_places={"Shop": known})
+    assert places["Place"].tolist() == ["Place 1", "Shop"]
+    assert places["Place"].is_unique
+    assert stay_points["Place"].tolist() == ["Place 1", "Shop"]
+
+
+def test_known_places_sharing_a_closest_place():
+    # Work is farther from home than Home: it names nothing rather than overwriting Home
+    stay_points = make_stay_points([(*HOME, 3600)])
+    known_places = {"Home": HOME, "Work": (HOME[0] + 0.0001, HOME[1])}
+    _, places = cluster_stay_points(stay_points, radius_m=200, known_places=known_places)
+    assert places["Place"].tolist() == ["Home"]
+
+
+def test_known_place_out_of_range():
+    stay_points = make_stay_points([(*HOME, 3600)])
+    _, places = cluster_stay_points(stay_points, radius_m=200, known_places={"Work": NEIGHBOUR})
+    assert places["Place"].tolist() == ["Place 1"]
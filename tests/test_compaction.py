@@ -0,0 +1,128 @@
+import io
+import pytest
+from datetime import datetime, timezone
+
+from packages.gcp_phone_location.src import compaction
+
+DAY_START = 1716854400  # 2024-05-28T00:00:00Z
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+class ArchiveFile(io.BytesIO):
+    """
+    An archive file of the in-memory bucket, saved when it is closed.
+    """
+
+    def __init__(self, bucket, path, content=b""):
+        super().__init__(content)
+        self.bucket = bucket
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            self.bucket[self.path] = self.getvalue()
+        super().close()
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """
+    An in-memory Cloud Storage bucket for the archives.
+    """
+    files = {}
+
+    def open_archive(path, mode):
+        if mode == "rb":
+            return io.BytesIO(files[path]) if path in files else None
+        return ArchiveFile(files, path)
+
+    monkeypatch.setattr(compaction, "open_archive", open_archive)
+    monkeypatch.setenv("LOCATION_ARCHIVE_PATH", "gs://bucket/archive/")
+    return files
+
+
+def add_points(firestore, device_id, epochs, latitude=51.5):
+    documents = {}
+    for epoch in epochs:
+        date = datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+        documents[date] = {"Date": date, "Epoch": epoch, "Latitude": latitude, "Longitude": -0.12}
+        firestore.documents[f"device_locations/devices/{device_id}/{date}"] = documents[date]
+    return documents
+
+
+def get_stored_epochs(firestore, device_id):
+    prefix = f"device_locations/devices/{device_id}/"
+    return sorted(data["Epoch"] for path, data in firestore.documents.items() if path.startswith(prefix))
+
+
+def test_archive_root_must_be_a_bucket(monkeypatch):
+    monkeypatch.setenv("LOCATION_ARCHIVE_PATH", "/tmp/archive")
+    with pytest.raises(ValueError):
+        compaction.get_archive_root()
+    monkeypatch.setenv("LOCATION_ARCHIVE_PATH", "gs://bucket/archive/")
+    assert compaction.get_archive_path("phone", "2024-05-28") == "gs://bucket/archive/phone/day=2024-05-28.jsonl.gz"
+
+
+def test_archive_merges_and_keeps_the_raw_points(bucket):
+    first = {"a": {"Epoch": 2, "Latitude": 1}, "b": {"Epoch": 1, "Latitude": 2}}
+    path = compaction.archive_locations("phone", "2024-05-28", first)
+    # A re-run with a downsampled version of "a" does not overwrite the archived one
+    compaction.archive_locations("phone", "2024-05-28", {"a": {"Epoch": 2, "Latitude": 9}, "c": {"Epoch": 3}})
+    archived = compaction.read_archive(path)
+    assert list(archived) == ["b", "a", "c"]
+    assert archived["a"]["Latitude"] == 1
+
+
+def test_archive_is_verified(bucket, monkeypatch):
+    monkeypatch.setattr(compaction, "read_archive", lambda path: {})
+    with pytest.raises(RuntimeError):
+        compaction.archive_locations("phone", "2024-05-28", {"a": {"Epoch": 1}})
+
+
+def test_downsample_keeps_the_first_point_of_every_interval():
+    documents = {str(epoch): {"Epoch": epoch} for epoch in range(0, 1800, 60)}
+    assert compaction.downsample_locations(documents, {"interval_s": 600}) == {"0", "600", "1200"}
+    assert compaction.downsample_locations({}, {"interval_s": 600}) == set()
+
+
+def test_compact_day_archives_before_deleting(firestore, bucket):
+    documents = add_points(firestore, "phone", range(DAY_START, DAY_START + 3600, 60))
+    num_read, num_deleted = compaction.compact_day("phone", DAY_START, {"interval_s": 600})
+    assert (num_read, num_deleted) == (60, 54)
+    assert get_stored_epochs(firestore, "phone") == list(range(DAY_START, DAY_START + 3600, 600))
+    archived = compaction.read_archive(compaction.get_archive_path("phone", "2024-05-28"))
+    assert archived == documents
+
+
+def test_compact_day_without_deletes_writes_no_archive(firestore, bucket):
+    add_points(firestore, "phone", [DAY_START, DAY_START + 600])
+    assert compaction.compact_day("phone", DAY_START, {"interval_s": 600}) == (2, 0)
+    assert bucket == {}
+
+
+def test_compact_device_applies_the_tiers_and_resumes(firestore, bucket):
+    old_day = DAY_START - 400 * compaction.SECONDS_PER_DAY
+    recent_day = int(NOW.timestamp()) - 30 * compaction.SECONDS_PER_DAY
+    add_points(firestore, "phone", range(old_day, old_day + 3600, 60))
+    add_points(firestore, "phone", range(DAY_START, DAY_START + 3600, 60))
+    add_points(firestore, "phone", range(recent_day, recent_day + 3600, 60))
+    tiers = [{"after_days": 90, "interval_s": 600}, {"after_days": 365, "interval_s": 1800}]
+
+    summary = compaction.compact_device("phone", tiers, max_days=10, now=NOW)
+    assert summary == {"days": 2, "read": 120, "deleted": 112}
+    stored = get_stored_epochs(firestore, "phone")
+    assert [epoch for epoch in stored if epoch < DAY_START] == [old_day, old_day + 1800]
+    assert len([epoch for epoch in stored if DAY_START <= epoch < recent_day]) == 6
+    # The recent day is not old enough for any tier
+    assert len([epoch for epoch in stored if epoch >= recent_day]) == 60
+
+    # The next run starts where this one stopped
+    assert compaction.compact_device("phone", tiers, max_days=10, now=NOW) == {"days": 0, "read": 0, "deleted": 0}
+
+
+def test_compact_device_refuses_a_local_archive(firestore, monkeypatch):
+    add_points(firestore, "phone", range(DAY_START, DAY_START + 3600, 60))
+    monkeypatch.setenv("LOCATION_ARCHIVE_PATH", "/tmp/archive")
+    with pytest.raises(ValueError):
+        compaction.compact_device("phone", [{"after_days": 90, "interval_s": 600}], now=NOW)
+    assert len(get_stored_epochs(firestore, "phone")) == 60
@@ -0,0 +1,37 @@
+from packages.gcp_phone_location.src.export import get_epoch_range, query_locations, split_range
+from packages.gcp_phone_location.src.location import store_location_history
+
+DATES = [
+    "2024-05-28T20:00:00+02:00",
+    "2024-05-28T19:30:00+00:00",
+    "2024-05-28T22:00:00+02:00",
+    "2024-05-28T16:00:00-05:00",
+]
+
+
+def store_points(dates):
+    locations = [{"Date": date, "Latitude": 51.5, "Longitude": -0.12} for date in dates]
+    return store_location_history("phone", locations)
+
+
+def test_query_locations_by_epoch(firestore):
+    store_points(DATES)
+    # 18:00, 19:30, 20:00 and 21:00 UTC: the range is by instant, not by the `Date` strings
+    output = query_locations("phone", 1716919200, 1716926400)
+    assert list(output) == ["2024-05-28T20:00:00+02:00", "2024-05-28T19:30:00+00:00", "2024-05-28T22:00:00+02:00"]
+    output = query_locations("phone", 1716919200, 1716926400, end_inclusive=False)
+    assert list(output) == ["2024-05-28T20:00:00+02:00", "2024-05-28T19:30:00+00:00"]
+    assert set(next(iter(output.values()))) == {"Date", "Epoch", "Latitude", "Longitude"}
+
+
+def test_epoch_range(firestore):
+    assert get_epoch_range("phone") == (None, None)
+    store_points(DATES)
+    assert get_epoch_range("phone") == (1716919200, 1716930000)
+
+
+def test_split_range():
+    assert split_range(0, 99, 4) == [(0, 25), (25, 50), (50, 75), (75, 99)]
+    # Never more shards than epochs
+    assert split_range(10, 11, 8) == [(10, 11), (11, 11)]
+    assert split_range(5, 5, 3) == [(5, 5)]
@@ -0,0 +1,89 @@
+import json
+import pytest
+
+from packages.gcp_phone_location.src import geofence
+
+HOME = {"name": "Home", "center": [51.5, -0.12], "radius_m": 150, "dwell_s": 600}
+PARK = {"name": "Park", "points": [[51.51, -0.13], [51.51, -0.11], [51.52, -0.11], [51.52, -0.13]]}
+COUNTRY = {"name": "Country", "points": [[50, -5], [50, 2], [56, 2], [56, -5]]}
+
+
+@pytest.fixture(autouse=True)
+def device_states(monkeypatch):
+    monkeypatch.setattr(geofence, "DEVICE_STATES", {})
+    monkeypatch.setenv("GEOFENCES", json.dumps([HOME, PARK, COUNTRY]))
+
+
+def make_fix(epoch, latitude, longitude):
+    return {"Epoch": epoch, "Date": str(epoch), "Latitude": latitude, "Longitude": longitude}
+
+
+def get_events(events):
+    return [(event["fence"], event["event"], event["epoch"]) for event in events]
+
+
+def test_fence_needs_a_shape():
+    with pytest.raises(ValueError):
+        geofence.make_fence({"name": "Nowhere"})
+
+
+def test_is_inside_circle_and_polygon():
+    home, park = geofence.make_fence(HOME), geofence.make_fence(PARK)
+    assert geofence.is_inside(home, 51.5, -0.12)
+    assert geofence.is_inside(home, 51.501, -0.12)
+    # Within the bounding box but outside the radius
+    assert not geofence.is_inside(home, 51.5012, -0.1179)
+    assert geofence.is_inside(park, 51.515, -0.12)
+    assert not geofence.is_inside(park, 51.525, -0.12)
+
+
+def test_index_finds_fences_of_every_size():
+    index = geofence.GeofenceIndex([HOME, PARK, COUNTRY])
+    assert sorted(index.query(51.5, -0.12)) == ["Country", "Home"]
+    assert sorted(index.query(51.515, -0.12)) == ["Country", "Park"]
+    assert index.query(40.0, -0.12) == []
+
+
+def test_first_fix_only_initialises_the_state():
+    assert geofence.check_geofences("phone", [make_fix(0, 51.5, -0.12)], notify=False) == []
+    assert set(geofence.DEVICE_STATES["phone"]) == {"Home", "Country"}
+
+
+def test_enter_dwell_and_exit():
+    fixes = [
+        make_fix(0, 51.515, -0.12),  # Park
+        make_fix(100, 51.5, -0.12),  # Home
+        make_fix(500, 51.5, -0.12),
+        make_fix(700, 51.5, -0.12),  # Staying for `dwell_s`
+        make_fix(800, 51.5, -0.12),  # The dwell is only notified once
+        make_fix(900, 51.515, -0.12),  # Park
+    ]
+    events = geofence.check_geofences("phone", fixes, notify=False)
+    assert get_events(events) == [
+        ("Park", "exit", 100),
+        ("Home", "enter", 100),
+        ("Home", "dwell", 700),
+        ("Home", "exit", 900),
+        ("Park", "enter", 900),
+    ]
+
+
+def test_devices_have_separate_states():
+    geofence.check_geofences("phone", [make_fix(0, 51.5, -0.12)], notify=False)
+    geofence.check_geofences("tablet", [make_fix(0, 51.515, -0.12)], notify=False)
+    events = geofence.check_geofences("phone", [make_fix(100, 51.515, -0.12)], notify=False)
+    assert get_events(events) == [("Home", "exit", 100), ("Park", "enter", 100)]
+    assert get_events(geofence.check_geofences("tablet", [make_fix(100, 51.515, -0.12)], notify=False)) == []
+
+
+def test_events_are_notified(monkeypatch):
+    notified = []
+    monkeypatch.setattr(geofence, "notify_geofence_events", notified.extend)
+    geofence.check_geofences("phone", [make_fix(0, 51.5, -0.12), make_fix(100, 51.515, -0.12)])
+    assert get_events(notified) == [("Home", "exit", 100), ("Park", "enter", 100)]
+
+
+def test_no_fences(monkeypatch):
+    monkeypatch.delenv("GEOFENCES")
+    assert geofence.check_geofences("phone", [make_fix(0, 51.5, -0.12)]) == []
+    assert geofence.DEVICE_STATES == {}
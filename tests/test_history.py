@@ -0,0 +1,63 @@
+import pytest
+import pandas as pd
+from datetime import date
+
+from packages.gcp_phone_location.src.history import (
+    get_last_history_epoch,
+    list_history_days,
+    read_history,
+    read_local_days,
+    write_history,
+)
+
+pytest.importorskip("pyarrow")
+
+# 23:00 and 23:30 UTC on the 28th, 00:30 UTC on the 29th
+DATES = ["2024-05-29T01:00:00+02:00", "2024-05-28T23:30:00+00:00", "2024-05-29T02:30:00+02:00"]
+
+
+@pytest.fixture(autouse=True)
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def make_locations(dates, latitude=51.5):
+    return pd.DataFrame({"Date": dates, "Latitude": latitude, "Longitude": -0.12})
+
+
+def test_days_are_partitioned_in_utc():
+    assert write_history(make_locations(DATES), "phone") == ["2024-05-28", "2024-05-29"]
+    assert list_history_days("phone") == ["2024-05-28", "2024-05-29"]
+    history = read_history("phone")
+    assert history["Epoch"].tolist() == [1716937200, 1716939000, 1716942600]
+    assert history["Date"].tolist() == DATES
+    assert get_last_history_epoch("phone") == 1716942600
+
+
+def test_writes_are_merged_by_epoch():
+    write_history(make_locations(DATES[:2]), "phone")
+    # The second point again (updated) and a new one
+    write_history(make_locations(DATES[1:], latitude=52.0), "phone")
+    history = read_history("phone")
+    assert history["Epoch"].tolist() == [1716937200, 1716939000, 1716942600]
+    assert history["Latitude"].tolist() == [51.5, 52.0, 52.0]
+
+
+def test_read_range_and_columns():
+    write_history(make_locations(DATES), "phone")
+    history = read_history("phone", start_epoch=1716939000, end_epoch=1716942600, columns=["Latitude"])
+    assert list(history.columns) == ["Latitude"]
+    assert len(history) == 2
+    assert read_history("phone", start_epoch=1716942601).empty
+
+
+def test_read_local_days_has_a_margin():
+    write_history(make_locations(DATES), "phone")
+    # The caller filters by local date: a UTC+2 day starts on the previous UTC day
+    assert len(read_local_days("phone", date(2024, 5, 29))) == 3
+
+
+def test_missing_history():
+    with pytest.raises(FileNotFoundError):
+        read_history("phone")
+    assert get_last_history_epoch("phone") is None
@@ -0,0 +1,89 @@
+import pytest
+
+import main
+from packages.gcp_phone_location.src.ingest import ingest_locations, validate_location
+from packages.gcp_phone_location.src.location import LAST_UPDATED_TIME_PATH, read_last_updated_time
+
+POINT = {"Date": "2024-06-01T08:00:00+01:00", "Latitude": 51.5, "Longitude": -0.12}
+
+
+@pytest.mark.parametrize(
+    "location, error",
+    [
+        (POINT, None),
+        ("not a point", "The location must be an object."),
+        ({**POINT, "Date": "01/06/2024 08:00"}, "`Date` must be an ISO time string."),
+        ({**POINT, "Date": "2024-06-01T08:00:00"}, "`Date` must have a UTC offset."),
+        ({**POINT, "Latitude": "51.5"}, "`Latitude` must be a number."),
+        ({**POINT, "Longitude": True}, "`Longitude` must be a number."),
+        ({**POINT, "Latitude": 91}, "`Latitude` must be between -90 and 90."),
+        ({**POINT, "Longitude": float("nan")}, "`Longitude` must be between -180 and 180."),
+    ],
+)
+def test_validate_location(location, error):
+    assert validate_location(location) == error
+
+
+def test_ingest_rejects_invalid_points_individually(firestore):
+    locations = [POINT, {**POINT, "Latitude": 100}, {**POINT, "Date": "2024-06-01T08:01:00+01:00"}]
+    output = ingest_locations({"device_id": "phone", "locations": locations})
+    assert output["received"] == 3
+    assert output["stored"] == 2
+    assert output["rejected"] == [{"index": 1, "error": "`Latitude` must be between -90 and 90."}]
+
+
+def test_ingest_requires_a_device_id(firestore):
+    output = ingest_locations({"locations": [POINT]})
+    assert output["stored"] == 0
+    assert output["rejected"] == [{"index": 0, "error": "The device ID is missing or invalid."}]
+
+
+def test_ingest_limits_the_upload_size(firestore):
+    with pytest.raises(ValueError):
+        ingest_locations({"device_id": "phone", "locations": [POINT] * 3}, max_locations=2)
+
+
+def test_ingest_reports_stale_points(firestore):
+    ingest_locations({"device_id": "phone", "locations": [{**POINT, "Date": "2024-06-01T09:00:00+01:00"}]})
+    output = ingest_locations({"device_id": "phone", "locations": [POINT]})
+    assert output["stored"] == 0
+    assert output["stale"] == [0]
+
+
+@pytest.mark.parametrize("epoch", [4102444800, "1717225200"])
+def test_ingest_ignores_an_uploaded_epoch(firestore, epoch):
+    # A far-future epoch would otherwise become the watermark and freeze the ingestion of the device
+    output = ingest_locations({"device_id": "phone", "locations": [{**POINT, "Epoch": epoch}]})
+    assert output["stored"] == 1
+    assert read_last_updated_time("phone") == (POINT["Date"], 1717225200)
+    stored = firestore.documents[f"device_locations/devices/phone/{POINT['Date']}"]
+    assert stored["Epoch"] == 1717225200
+
+    later = {**POINT, "Date": "2024-06-01T08:01:00+01:00"}
+    output = ingest_locations({"device_id": "phone", "locations": [later]})
+    assert output["stored"] == 1
+    assert output["stale"] == []
+
+
+@pytest.mark.parametrize(
+    "token, authorization",
+    [(None, None), (None, "Bearer "), ("secret", None), ("secret", "Bearer wrong"), ("secret", "secret")],
+)
+def test_ingest_endpoint_requires_the_token(firestore, monkeypatch, token, authorization):
+    if token is None:
+        monkeypatch.delenv("INGEST_TOKEN", raising=False)
+    else:
+        monkeypatch.setenv("INGEST_TOKEN", token)
+    headers = {"Authorization": authorization} if authorization is not None else {}
+    response = main.app.test_client().post("/locations", json={"device_id": "phone", "locations": [POINT]}, headers=headers)
+    assert response.status_code == 401
+    assert LAST_UPDATED_TIME_PATH.format(device_id="phone") not in firestore.documents
+
+
+def test_ingest_endpoint(firestore, monkeypatch):
+    monkeypatch.setenv("INGEST_TOKEN", "secret")
+    response = main.app.test_client().post(
+        "/locations", json={"device_id": "phone", "locations": [POINT]}, headers={"Authorization": "Bearer secret"}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["stored"] == 1
@@ -0,0 +1,134 @@
+import pytest
+
+from packages.gcp_phone_location.src import location
+from packages.gcp_phone_location.src.location import convert_time_to_epoch, dedupe_locations, get_location_history
+
+
+@pytest.mark.parametrize(
+    "time, epoch",
+    [
+        ("2024-05-28T20:09:53+02:00", 1716919793),
+        ("2024-05-28T18:09:53+00:00", 1716919793),
+        ("2024-05-28T13:09:53-05:00", 1716919793),
+        ("2024-05-28T18:09:53Z", 1716919793),
+        # Naive times are UTC
+        ("2024-05-28T18:09:53", 1716919793),
+    ],
+)
+def test_convert_time_to_epoch(time, epoch):
+    assert convert_time_to_epoch(time) == epoch
+
+
+def test_dedupe_across_time_zones():
+    locations = [
+        {"Date": "2024-05-28T20:10:00+02:00", "Latitude": 1},
+        {"Date": "2024-05-28T19:09:53+01:00", "Latitude": 2},
+        # Same instant as the previous point, in another time zone: the later one wins
+        {"Date": "2024-05-28T20:09:53+02:00", "Latitude": 3, "Speed(km/h)": 5},
+    ]
+    output = dedupe_locations(locations)
+    assert [point["Latitude"] for point in output] == [3, 1]
+    assert [point["Epoch"] for point in output] == [1716919793, 1716919800]
+    assert "Speed(km/h)" not in output[0]
+
+
+def test_dedupe_range_is_exclusive_at_the_start():
+    locations = [{"Date": f"2024-05-28T18:0{minute}:00+00:00"} for minute in range(5)]
+    start_epoch = convert_time_to_epoch("2024-05-28T18:01:00+00:00")
+    end_epoch = convert_time_to_epoch("2024-05-28T18:03:00+00:00")
+    output = dedupe_locations(locations, start_epoch=start_epoch, end_epoch=end_epoch)
+    assert [point["Date"] for point in output] == ["2024-05-28T18:02:00+00:00", "2024-05-28T18:03:00+00:00"]
+
+
+def test_location_history_is_filtered_exactly(monkeypatch):
+    calls = []
+
+    def query_followmee(function, **params):
+        calls.append(params)
+        # FollowMee returns whole days, in the local time of the device
+        return [
+            {"Date": "2024-05-28T23:30:00+02:00"},
+            {"Date": "2024-05-29T01:30:00+02:00"},
+            {"Date": "2024-05-29T03:30:00+02:00"},
+        ]
+
+    monkeypatch.setattr(location, "query_followmee", query_followmee)
+    history = get_location_history("phone", "2024-05-28T21:30:00+00:00", "2024-05-29T01:30:00+02:00")
+    assert [point["Date"] for point in history] == ["2024-05-29T01:30:00+02:00"]
+    # The range is padded by a day on each side, in windows of at most `max_days`
+    assert calls == [{"deviceid": "phone", "from": "2024-05-27", "to": "2024-05-29"}]
+
+
+def make_track(num_points, start_minute=0):
+    """
+    Make a track of points one minute apart (in UTC+1), with their `Epoch`.
+    """
+    track = []
+    for minute in range(start_minute, start_minute + num_points):
+        date = f"2024-06-01T{8 + minute // 60:02d}:{minute % 60:02d}:00+01:00"
+        track.append({"Date": date, "Epoch": convert_time_to_epoch(date), "Latitude": 51.5, "Longitude": -0.12 + minute * 1e-3})
+    return track
+
+
+def get_num_fixes(firestore):
+    return firestore.documents["device_locations/daily/phone/2024-06-01"]["num_fixes"]
+
+
+def test_commit_is_idempotent(firestore):
+    track = make_track(3)
+    assert location.commit_locations("phone", track) == track
+    writes = firestore.counts["writes"]
+    # A retried or concurrent run with the same points writes nothing
+    assert location.commit_locations("phone", make_track(3)) == []
+    assert firestore.counts["writes"] == writes
+    assert get_num_fixes(firestore) == 3
+    assert location.read_last_updated_time("phone") == (track[-1]["Date"], track[-1]["Epoch"])
+
+
+def test_commit_never_moves_the_watermark_backwards(firestore):
+    location.commit_locations("phone", make_track(2, start_minute=10))
+    # Partly older than the watermark: only the newer points are written
+    stored = location.commit_locations("phone", make_track(4, start_minute=9))
+    assert [point["Date"] for point in stored] == ["2024-06-01T08:12:00+01:00"]
+    assert location.read_last_updated_time("phone")[0] == "2024-06-01T08:12:00+01:00"
+    assert location.commit_locations("phone", make_track(2, start_minute=0)) == []
+    assert location.read_last_updated_time("phone")[0] == "2024-06-01T08:12:00+01:00"
+    assert get_num_fixes(firestore) == 3
+
+
+def test_commit_retries_on_contention(firestore, monkeypatch):
+    # Another run stores the first two points between the read and the commit of this one
+    raced = []
+
+    def run_transaction(function):
+        if not raced:
+            raced.append(True)
+            transaction = firestore.transaction()
+            function(transaction)
+            monkeypatch.setattr(location, "run_transaction", firestore.run_transaction)
+            location.commit_locations("phone", make_track(2))
+            monkeypatch.setattr(location, "run_transaction", run_transaction)
+            try:
+                transaction.commit()
+            except Exception:
+                pass
+            else:
+                raise AssertionError("The stale transaction was committed.")
+        return firestore.run_transaction(function)
+
+    monkeypatch.setattr(location, "run_transaction", run_transaction)
+    stored = location.commit_locations("phone", make_track(3))
+    assert [point["Date"] for point in stored] == ["2024-06-01T08:02:00+01:00"]
+    assert firestore.counts["contentions"] == 1
+    assert get_num_fixes(firestore) == 3
+
+
+def test_history_is_stored_in_chunks(firestore):
+    # One write per point, plus the watermark and the day aggregate per transaction
+    chunks = location.chunk_locations(make_track(25), batch_size=10)
+    assert [len(chunk) for chunk in chunks] == [8, 8, 8, 1]
+    stored = location.store_location_history("phone", make_track(25), batch_size=10)
+    assert len(stored) == 25
+    assert get_num_fixes(firestore) == 25
+    assert location.store_location_history("phone", make_track(30)) == make_track(5, start_minute=25)
+    assert get_num_fixes(firestore) == 30
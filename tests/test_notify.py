@@ -0,0 +1,115 @@
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from adhoc.local_firestore import LocalFirestore
+from packages.gcp_phone_weather.src import notify
+
+PENDING_PREFIX = f"{notify.PENDING_NOTIFICATIONS_PATH}/"
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """
+    The notification queue in the in-memory Firestore stand-in, with a default and a per-device recipient.
+    """
+    client = LocalFirestore()
+    monkeypatch.setattr(notify, "Firestore", client.handle)
+    monkeypatch.setenv("PUSHOVER_WEATHER_API_TOKEN", "token-1")
+    monkeypatch.setenv("PUSHOVER_USER_KEY", "user-default")
+    monkeypatch.setenv("PUSHOVER_RECIPIENTS", json.dumps({"phone": "user-phone"}))
+    return client
+
+
+def get_pending(client):
+    return {path[len(PENDING_PREFIX) :]: data for path, data in client.documents.items() if path.startswith(PENDING_PREFIX)}
+
+
+def deliver_with(monkeypatch, outcome):
+    """
+    Replace the Pushover request by a fixed outcome, and record the delivered notifications.
+    """
+    delivered = []
+
+    def post_notification(notification, timeout=10):
+        notification["attempts"] += 1
+        delivered.append(notification)
+        return outcome
+
+    monkeypatch.setattr(notify, "post_notification", post_notification)
+    return delivered
+
+
+def test_persisted_notifications_do_not_carry_credentials(queue):
+    notifications = [
+        notify.make_notification("Rain", "London"),
+        notify.make_notification("Sun", "Paris", user="user-phone"),
+    ]
+    assert notify.persist_notifications(notifications) == [n["id"] for n in notifications]
+    pending = get_pending(queue)
+    assert {n["recipient"] for n in pending.values()} == {"default", "phone"}
+    for notification in pending.values():
+        assert not set(notify.CREDENTIAL_FIELDS) & set(notification["data"])
+
+
+def test_notifications_to_unknown_recipients_are_not_persisted(queue):
+    notification = notify.make_notification("Rain", "London", user="user-unknown")
+    assert notify.persist_notifications([notification]) == []
+    assert get_pending(queue) == {}
+
+
+def test_restore_attaches_the_current_credentials(queue, monkeypatch):
+    notify.persist_notifications([notify.make_notification("Sun", "Paris", user="user-phone")])
+    (persisted,) = get_pending(queue).values()
+    monkeypatch.setenv("PUSHOVER_WEATHER_API_TOKEN", "token-2")
+    monkeypatch.setenv("PUSHOVER_RECIPIENTS", json.dumps({"phone": "user-phone-2"}))
+    restored = notify.restore_notification(persisted)
+    assert restored["data"]["token"] == "token-2"
+    assert restored["data"]["user"] == "user-phone-2"
+    assert restored["data"]["message"] == "Sun"
+
+    monkeypatch.setenv("PUSHOVER_RECIPIENTS", "{}")
+    assert notify.restore_notification(persisted) is None
+
+
+def test_drain_delivers_and_removes_the_queued_notifications(queue, monkeypatch):
+    notify.persist_notifications([notify.make_notification("Rain", "London")])
+    delivered = deliver_with(monkeypatch, "sent")
+    outcomes = notify.drain_pending_notifications(min_interval=0)
+    assert list(outcomes.values()) == ["sent"]
+    assert delivered[0]["data"]["token"] == "token-1"
+    assert delivered[0]["data"]["user"] == "user-default"
+    assert get_pending(queue) == {}
+
+
+def test_drain_keeps_undelivered_notifications(queue, monkeypatch):
+    notify.persist_notifications([notify.make_notification("Rain", "London")])
+    deliver_with(monkeypatch, "retry")
+    outcomes = notify.drain_pending_notifications(min_interval=0, max_attempts=1)
+    assert list(outcomes.values()) == ["retry"]
+    (pending,) = get_pending(queue).values()
+    assert pending["attempts"] == 1
+    assert "token" not in pending["data"]
+
+
+def test_drain_drops_expired_notifications(queue, monkeypatch):
+    notification = notify.make_notification("Rain", "London")
+    notification["created"] = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    notify.persist_notifications([notification])
+    delivered = deliver_with(monkeypatch, "sent")
+    assert notify.drain_pending_notifications() == {notification["id"]: "expired"}
+    assert delivered == []
+    assert get_pending(queue) == {}
+
+
+def test_drain_skips_the_notifications_of_the_current_run(queue, monkeypatch):
+    earlier = notify.make_notification("Rain", "London")
+    earlier["created"] = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    started = datetime.now(timezone.utc)
+    current = notify.make_notification("Sun", "London")
+    notify.persist_notifications([earlier, current])
+    delivered = deliver_with(monkeypatch, "sent")
+    outcomes = notify.drain_pending_notifications(created_before=started, min_interval=0)
+    assert outcomes == {earlier["id"]: "sent"}
+    assert [n["id"] for n in delivered] == [earlier["id"]]
+    assert list(get_pending(queue)) == [current["id"]]
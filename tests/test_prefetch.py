@@ -0,0 +1,66 @@
+import pytest
+
+from packages.gcp_phone_location.src.location import store_location
+from packages.gcp_phone_weather.src import prefetch
+
+REQUEST_PATH = f"{prefetch.PREFETCH_REQUESTS_PATH}/phone"
+CACHE_PATH = prefetch.FORECAST_CACHE_PATH.format(device_id="phone")
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """
+    Replace the weather providers by a fixed forecast, and record the fetched locations.
+    """
+    fetched = []
+
+    def fetch_forecast(latitude, longitude):
+        fetched.append((latitude, longitude))
+        return {"provider": "openweathermap", "forecast": {"list": []}}
+
+    monkeypatch.setattr(prefetch, "fetch_forecast", fetch_forecast)
+    monkeypatch.setenv("WEATHER_PREFETCH_ADVICE", "false")
+    return fetched
+
+
+def test_request_only_on_move(firestore, fetches):
+    assert prefetch.request_prefetch_if_moved("phone", 51.5, -0.12)
+    # A few km away: the requested forecast is still good there
+    assert not prefetch.request_prefetch_if_moved("phone", 51.52, -0.1)
+    assert firestore.documents[REQUEST_PATH]["latitude"] == 51.5
+    assert prefetch.request_prefetch_if_moved("phone", 48.85, 2.35)
+    assert firestore.documents[REQUEST_PATH]["latitude"] == 48.85
+    assert fetches == []
+
+
+def test_no_request_near_the_cached_forecast(firestore, fetches):
+    prefetch.prefetch_forecast("phone", 51.5, -0.12)
+    prefetch.LAST_FORECASTS.clear()
+    assert not prefetch.request_prefetch_if_moved("phone", 51.5, -0.12)
+    assert REQUEST_PATH not in firestore.documents
+
+
+def test_requested_forecasts_are_prefetched(firestore, fetches):
+    prefetch.request_prefetch_if_moved("phone", 51.5, -0.12)
+    assert prefetch.prefetch_requested_forecasts() == {"phone": "prefetched"}
+    assert fetches == [(51.5, -0.12)]
+    assert firestore.documents[CACHE_PATH]["latitude"] == 51.5
+    assert REQUEST_PATH not in firestore.documents
+
+
+def test_failed_prefetches_are_kept(firestore, monkeypatch):
+    def fetch_forecast(latitude, longitude):
+        raise RuntimeError("All the weather providers failed.")
+
+    monkeypatch.setattr(prefetch, "fetch_forecast", fetch_forecast)
+    prefetch.request_prefetch_if_moved("phone", 51.5, -0.12)
+    assert prefetch.prefetch_requested_forecasts() == {"phone": "failed"}
+    assert REQUEST_PATH in firestore.documents
+
+
+def test_storing_a_location_does_not_fetch_the_forecast(firestore, fetches, monkeypatch):
+    monkeypatch.setenv("WEATHER_PREFETCH", "true")
+    location = {"Date": "2024-06-01T08:00:00+01:00", "Latitude": 51.5, "Longitude": -0.12}
+    store_location({"phone": location})
+    assert fetches == []
+    assert REQUEST_PATH in firestore.documents
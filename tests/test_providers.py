@@ -0,0 +1,79 @@
+import time
+import pytest
+
+from packages.gcp_phone_weather.src.providers import WMO_DESCRIPTIONS, WMO_SEVERITY, parse_open_meteo_forecast
+from packages.gcp_phone_weather.src.weather import parse_city_metadata
+
+# 2024-05-28 at midnight UTC
+DAY = 1716854400
+
+
+def make_open_meteo_forecast(weather_codes, rain=0.0, showers=0.0, utc_offset_seconds=3600):
+    """
+    Make a raw Open-Meteo forecast of hourly steps starting at the next 3-hour step
+    (within the window of `select_forecast_window` whatever the time).
+    """
+    now = int(time.time())
+    start = now - now % (3 * 3600) + 3 * 3600
+    num_steps = len(weather_codes)
+    return {
+        "latitude": 51.5,
+        "longitude": -0.12,
+        "timezone": "Europe/London",
+        "utc_offset_seconds": utc_offset_seconds,
+        "hourly": {
+            "time": [start + 3600 * i for i in range(num_steps)],
+            "temperature_2m": [15.0] * num_steps,
+            "apparent_temperature": [14.0] * num_steps,
+            "pressure_msl": [1012] * num_steps,
+            "relative_humidity_2m": [70] * num_steps,
+            "wind_speed_10m": [10.0] * num_steps,
+            "wind_gusts_10m": [20.0] * num_steps,
+            "wind_direction_10m": [200] * num_steps,
+            "rain": [rain] * num_steps,
+            "showers": [showers] * num_steps,
+            "snowfall": [0.0] * num_steps,
+            "precipitation_probability": [50] * num_steps,
+            "cloud_cover": [80] * num_steps,
+            "weather_code": weather_codes,
+        },
+        "daily": {"sunrise": [DAY + 4 * 3600], "sunset": [DAY + 20 * 3600]},
+    }
+
+
+def test_every_described_code_has_a_severity():
+    assert set(WMO_SEVERITY) == set(WMO_DESCRIPTIONS)
+
+
+@pytest.mark.parametrize(
+    "weather_codes, weather",
+    [
+        ([3, 45, 1], "fog"),
+        ([45, 61, 2], "light rain"),
+        ([95, 61, 80], "thunderstorm"),
+        ([80, 71, 0], "light snow"),
+    ],
+)
+def test_weather_is_the_most_severe_of_the_step(weather_codes, weather):
+    weather_df, _ = parse_open_meteo_forecast(make_open_meteo_forecast(weather_codes))
+    assert weather_df["weather"].tolist() == [weather]
+
+
+def test_rain_includes_the_showers():
+    weather_df, _ = parse_open_meteo_forecast(make_open_meteo_forecast([61, 80, 80], rain=0.2, showers=0.5))
+    assert weather_df["rain"].tolist() == [pytest.approx(2.1)]
+
+
+def test_metadata_is_local_to_the_location():
+    _, metadata = parse_open_meteo_forecast(make_open_meteo_forecast([0, 0, 0], utc_offset_seconds=3600))
+    assert metadata["name"] == "51.50, -0.12"
+    assert metadata["timezone"] == 1
+    assert metadata["sunrise"] == "2024-05-28T05:00:00"
+    assert metadata["sunset"] == "2024-05-28T21:00:00"
+
+
+def test_openweathermap_sun_times_are_local_to_the_location():
+    city = {"name": "London", "country": "GB", "timezone": 3600, "sunrise": DAY + 4 * 3600, "sunset": DAY + 20 * 3600}
+    metadata = parse_city_metadata(city)
+    assert metadata["sunrise"] == "2024-05-28T05:00:00"
+    assert metadata["sunset"] == "2024-05-28T21:00:00"
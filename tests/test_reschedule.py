@@ -0,0 +1,34 @@
+from packages.gcp_phone_location.src import location
+from packages.gcp_phone_location.src.location import PENDING_RESCHEDULE_PATH, store_location, store_location_history
+
+LONDON = {"Date": "2024-06-01T08:00:00+01:00", "Latitude": 51.5, "Longitude": -0.12}
+PARIS = {"Date": "2024-06-01T10:00:00+02:00", "Latitude": 48.85, "Longitude": 2.35}
+
+
+def test_time_zone_change_requests_a_reschedule(firestore):
+    store_location({"phone": dict(LONDON)})
+    firestore.documents.pop(PENDING_RESCHEDULE_PATH)
+    store_location({"phone": dict({**LONDON, "Date": "2024-06-01T08:01:00+01:00"})})
+    assert PENDING_RESCHEDULE_PATH not in firestore.documents
+    store_location({"phone": dict(PARIS)})
+    pending = firestore.documents[PENDING_RESCHEDULE_PATH]
+    assert pending["time_zone"] == "Etc/GMT-2"
+    assert pending["device_id"] == "phone"
+
+
+def test_no_reschedule_if_another_run_stored_the_location(firestore, monkeypatch):
+    store_location({"phone": dict(LONDON)})
+    store_location({"phone": dict(PARIS)})
+    firestore.documents.pop(PENDING_RESCHEDULE_PATH)
+    # This run read the watermark before the other run stored Paris: its commit writes nothing
+    monkeypatch.setattr(location, "read_last_updated_time", lambda device_id: (LONDON["Date"], 1717225200))
+    store_location({"phone": dict(PARIS)})
+    assert PENDING_RESCHEDULE_PATH not in firestore.documents
+
+
+def test_history_requests_a_reschedule_for_the_stored_points(firestore):
+    store_location_history("phone", [dict(LONDON), dict(PARIS)])
+    assert firestore.documents.pop(PENDING_RESCHEDULE_PATH)["time_zone"] == "Etc/GMT-2"
+    # Stale watermark of a run which raced with the one above: nothing is stored, nothing is requested
+    assert store_location_history("phone", [dict(PARIS)], LONDON["Date"], 1717225200) == []
+    assert PENDING_RESCHEDULE_PATH not in firestore.documents
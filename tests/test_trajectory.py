@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from packages.gcp_phone_location.src import trajectory
+from packages.gcp_phone_location.src.export import export_locations
+from packages.gcp_phone_location.src.location import store_location_history
+
+START_EPOCH = 1716919793  # 2024-05-28T18:09:53Z
+
+
+def make_locations(start, count, step=60):
+    """
+    Points in two time zones, moving a little every step.
+    """
+    epochs = np.arange(start, start + count * step, step)
+    offsets = np.where(np.arange(count) % 7 < 4, 120, -330)
+    dates = trajectory.format_dates(epochs, offsets)
+    return pd.DataFrame(
+        {
+            "Date": dates,
+            "Epoch": epochs,
+            "Latitude": 51.5 + np.arange(count) * 1e-4,
+            "Longitude": -0.12 - np.arange(count) * 1e-4,
+        }
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "phone.traj")
+
+
+@pytest.mark.parametrize("values", [[], [0], [127, 128, 300, 16383, 16384, 2**63 - 1], list(range(1000))])
+def test_varints_round_trip(values):
+    encoded = trajectory.encode_varints(np.array(values, dtype=np.uint64))
+    assert trajectory.decode_varints(encoded).tolist() == values
+
+
+def test_zigzag_round_trip():
+    values = np.array([0, -1, 1, -2, 2, -(2**62), 2**62], dtype=np.int64)
+    assert trajectory.zigzag_encode(values)[:5].tolist() == [0, 1, 2, 3, 4]
+    assert trajectory.zigzag_decode(trajectory.zigzag_encode(values)).tolist() == values.tolist()
+
+
+def test_parse_utc_offset():
+    assert trajectory.parse_utc_offset("2024-05-28T20:09:53+02:00") == 120
+    assert trajectory.parse_utc_offset("2024-05-28T12:39:53-05:30") == -330
+    assert trajectory.parse_utc_offset("2024-05-28T18:09:53Z") == 0
+
+
+def test_round_trip(path):
+    df = make_locations(START_EPOCH, 2500)
+    assert trajectory.write_trajectory(df, path, chunk_size=1000) == 2500
+    assert [entry[1] for entry in trajectory.read_index(path)] == [1000, 1000, 500]
+    output = trajectory.read_trajectory(path)
+    assert output["Date"].tolist() == df["Date"].tolist()
+    assert output["Epoch"].tolist() == df["Epoch"].tolist()
+    np.testing.assert_allclose(output["Latitude"], df["Latitude"], atol=1e-6)
+    np.testing.assert_allclose(output["Longitude"], df["Longitude"], atol=1e-6)
+    assert trajectory.get_last_trajectory_epoch(path) == df["Epoch"].iloc[-1]
+
+
+def test_read_range(path):
+    df = make_locations(START_EPOCH, 2500)
+    trajectory.write_trajectory(df, path, chunk_size=1000)
+    start_epoch, end_epoch = int(df["Epoch"].iloc[990]), int(df["Epoch"].iloc[1010])
+    output = trajectory.read_trajectory(path, start_epoch, end_epoch, with_dates=False)
+    assert output["Epoch"].tolist() == df["Epoch"].iloc[990:1011].tolist()
+    assert list(output.columns) == ["Epoch", "Latitude", "Longitude"]
+    assert trajectory.read_trajectory(path, 0, START_EPOCH - 1).empty
+
+
+def test_append(path):
+    df = make_locations(START_EPOCH, 2500)
+    trajectory.write_trajectory(df.iloc[:1500], path, chunk_size=1000)
+    # The points already in the file are skipped, and the partial last chunk is re-encoded
+    assert trajectory.write_trajectory(df.iloc[1400:], path, chunk_size=1000) == 1000
+    assert [entry[1] for entry in trajectory.read_index(path)] == [1000, 1000, 500]
+    assert trajectory.read_trajectory(path)["Date"].tolist() == df["Date"].tolist()
+
+
+def test_writer_rejects_older_points(path):
+    columns = trajectory.to_trajectory_columns(make_locations(START_EPOCH, 10))
+    with trajectory.TrajectoryWriter(path) as writer:
+        writer.write(*[column[5:] for column in columns])
+        with pytest.raises(ValueError):
+            writer.write(*[column[:5] for column in columns])
+
+
+def test_unclosed_file_has_no_index(path):
+    writer = trajectory.TrajectoryWriter(path, chunk_size=4)
+    writer.write(*trajectory.to_trajectory_columns(make_locations(START_EPOCH, 10)))
+    writer.file.close()
+    with pytest.raises(ValueError):
+        trajectory.read_index(path)
+    with open(path, "rb") as file:
+        assert sum(len(chunk[0]) for chunk in trajectory.iter_chunks(file)) == 8
+
+
+def test_export_appends_to_the_trajectory(firestore, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = make_locations(START_EPOCH, 20)
+    locations = df[["Date", "Latitude", "Longitude"]].to_dict("records")
+    store_location_history("phone", locations[:12])
+    assert len(export_locations("phone", output_format="traj")) == 12
+    store_location_history("phone", locations[12:])
+    # Only the points from the last one of the file on are queried, and that one is not written twice
+    assert len(export_locations("phone", output_format="traj")) == 9
+    output = trajectory.read_trajectory(trajectory.get_trajectory_path("phone"))
+    assert output["Date"].tolist() == df["Date"].tolist()
+
+    # Without appending, the file is written again
+    assert len(export_locations("phone", append=False, output_format="traj")) == 20
+    assert len(trajectory.read_trajectory(trajectory.get_trajectory_path("phone"))) == 20